@@ -3,6 +3,7 @@
 import sys
 import os
 import logging
+import multiprocessing
 
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QLineEdit,
@@ -12,27 +13,18 @@ from PySide6.QtWidgets import (
 )
 
 from PySide6.QtGui import QAction
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QThread
 from PySide6.QtGui import QIcon
 
 from config import load_config, save_config
-from functions.scanner import find_mbox_files, parse_all_mailboxes
-from functions.backup_mail_folder import backup_folder
-from functions.process_mboxes import process_mboxes
+from functions.dedup_worker import DedupWorker
 from functions.logging_setup import setup_logging
-from datetime import datetime
-from functions.functions import log_uncaught_exceptions, is_thunderbird_running, calc_duration, format_size
+from functions.functions import log_uncaught_exceptions, is_thunderbird_running
 
 DEBUG_MODE = True
 
-setup_logging(debug=DEBUG_MODE)
-logging.info("-" * 80)
-logging.info("Started Thunderbird Duplicate Email Remover.")
 LOG_FILE = os.path.join("logs", "thunderbird_deduper.log")
 
-# Set global exception handler
-sys.excepthook = log_uncaught_exceptions
-
 
 
 class MainWindow(QMainWindow):
@@ -47,7 +39,7 @@ class MainWindow(QMainWindow):
         - Main widgets including:
             - Folder selection input with browse button
             - Checkbox to exclude trash folders
-            - Start scan button
+            - Start scan button and Cancel button
             - Mailbox files list display
             - Status output text area
             - Exit button
@@ -117,10 +109,16 @@ class MainWindow(QMainWindow):
         self.scan_button = QPushButton("Start")
         self.scan_button.setFixedWidth(125)
         self.scan_button.clicked.connect(self.start_scan)
+
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setFixedWidth(125)
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_scan)
         
         scan_layout = QHBoxLayout()
         scan_layout.addWidget(self.checkbox_trash)
         scan_layout.addWidget(self.scan_button)
+        scan_layout.addWidget(self.cancel_button)
 
         mbox_label = QLabel("Mailbox files found:")
         self.mbox_list = QListWidget()
@@ -148,6 +146,12 @@ class MainWindow(QMainWindow):
         container.setLayout(layout)
         self.setCentralWidget(container)
 
+        # Background pipeline, set while a scan is running
+        self.worker_thread = None
+        self.worker = None
+        self.run_failed = False
+        self.close_requested = False
+
 
 
     # -------------------------------------------------
@@ -204,19 +208,13 @@ class MainWindow(QMainWindow):
         Initiates a scan of Thunderbird mailboxes to find and remove duplicate messages.
         This method performs the following operations:
         1. Checks if Thunderbird is currently running and prompts user to close it if necessary
-        2. Disables UI controls and updates scan button to show "Processing..." state
-        3. Validates the selected folder path
-        4. Creates a backup of the mailbox folder
-        5. Scans for mbox files and identifies duplicate messages
-        6. Processes mboxes to remove duplicates
-        7. Displays results and statistics
-        8. Re-enables UI controls upon completion or error
-        The method handles user configuration persistence, progress bar updates,
-        logging at various stages, and displays appropriate messages to the user
-        via the output box and message dialogs.
-        Raises:
-            Implicitly handles exceptions through try/finally block to ensure
-            UI controls are restored regardless of success or failure.
+        2. Validates the selected folder path
+        3. Disables UI controls, enables the Cancel button and updates scan button to show "Processing..." state
+        4. Starts a DedupWorker in a QThread, which backs up the mailbox folder,
+           scans for mbox files and removes duplicate messages
+        The GUI thread only reacts to the worker's signals, so the window stays
+        responsive during the whole run. Results and statistics are shown by
+        scan_finished() when the worker is done.
         """
 
         # -------------------------------------------------
@@ -236,87 +234,173 @@ class MainWindow(QMainWindow):
 
         if is_thunderbird_running():
             msg_box.open()
+            return
+
+        folder = self.folder_input.text().strip()
 
-        start_time = datetime.now()
+        if folder:
+            self.config["thunderbird_folder"] = folder
+            save_config(self.config)
+
+        if not folder or not os.path.isdir(folder):
+            self.output_box.setPlainText("❌ Please select a valid folder.\n")
+            return
+        
+        self.output_box.setPlainText(f"✔ Folder selected:\n{folder}\n")
+        logging.info(f"Folder selected: {folder}")
 
-        # Disable button & change text
+        # Disable buttons & change text
         self.browse_button.setEnabled(False)
         self.scan_button.setEnabled(False)
-        original_text = self.scan_button.text()
+        self.cancel_button.setEnabled(True)
         self.scan_button.setText("Processing...")
-        QApplication.processEvents()   # Force GUI refresh
-
-        self.progress_label.setText("Backing up mailboxes...")
-
-        try:
-            folder = self.folder_input.text().strip()
-
-            if folder:
-                self.config["thunderbird_folder"] = folder
-                save_config(self.config)
-
-            if not folder or not os.path.isdir(folder):
-                self.output_box.setPlainText("❌ Please select a valid folder.\n")
-                return
-            
-            self.output_box.setPlainText(f"✔ Folder selected:\n{folder}\n")
-            self.progress_bar.setValue(1)
-            logging.info(f"Folder selected: {folder}")
-            QApplication.processEvents()   # Force GUI refresh
-            
-            # ------------- Backing up ------------------------
-            backup_file = backup_folder(folder, self.config)
-
-
-            file_size = os.path.getsize(backup_file)
-            backup_file_absolute_path = os.path.abspath(backup_file)
-            formatted_file_size = format_size(file_size)
-
-            self.output_box.append(f"✔ Backup created:\nSize: {formatted_file_size}, {backup_file_absolute_path}\n")
-            logging.info(f"✔ Backup created:\nSize: {formatted_file_size}, {backup_file_absolute_path}\n")
-                        
-            if logging.getLogger().isEnabledFor(logging.DEBUG):
-                backup_finished_time = datetime.now()
-                duration_mins_secs = calc_duration(start_time, backup_finished_time) 
-                logging.debug(f"Backup duration: {duration_mins_secs}")
-
-            self.progress_bar.setValue(29)
-            self.progress_label.setText("Scanning for duplicate mails...") 
-            mboxes = find_mbox_files(folder, self.checkbox_trash.isChecked() )
-            self.mbox_list.clear()
-            self.mbox_list.addItems(mboxes)
-
-            mboxes, msg_for_output_box, total_messages_deleted = process_mboxes(mboxes, self.progress_bar) 
-            
-            if total_messages_deleted == 0:
-                msg_for_output_box += f"\n❌ No duplicates were found\n"
-            else:   
-                msg_for_output_box += f"\n✔ Total duplicate messages deleted across all mailboxes: {total_messages_deleted}"
-            
+        self.progress_bar.setValue(0)
+        self.run_failed = False
+
+        # ------------- Run the pipeline in a worker thread ------------------------
+        self.worker_thread = QThread(self)
+        self.worker = DedupWorker(folder, self.config, self.checkbox_trash.isChecked())
+        self.worker.moveToThread(self.worker_thread)
+
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.update_progress)
+        self.worker.output.connect(self.output_box.append)
+        self.worker.mboxes_found.connect(self.show_mboxes_found)
+        self.worker.failed.connect(self.scan_failed)
+        self.worker.finished.connect(self.scan_finished)
+        self.worker.finished.connect(self.worker_thread.quit)
+        self.worker_thread.finished.connect(self.worker.deleteLater)
+        self.worker_thread.finished.connect(self.worker_thread.deleteLater)
+
+        self.worker_thread.start()
+
+
+
+    # -------------------------------------------------
+    # Cancel Button Logic
+    # -------------------------------------------------
+    def cancel_scan(self):
+        """
+        Ask the running worker to stop.
+        The worker finishes the mailbox it is working on and then stops, so no
+        mailbox is left half-written. scan_finished() is called when it has stopped.
+        """
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_button.setEnabled(False)
+            self.progress_label.setText("Cancelling...")
+            logging.info("Cancel requested by user")
+
+
+
+    # -------------------------------------------------
+    # Worker signal handlers
+    # -------------------------------------------------
+    def update_progress(self, value, label):
+        self.progress_bar.setValue(value)
+        self.progress_label.setText(label)
+
+
+    def show_mboxes_found(self, mboxes):
+        self.mbox_list.clear()
+        self.mbox_list.addItems(mboxes)
+
+
+    def scan_failed(self, error):
+        self.run_failed = True
+        self.output_box.append(f"\n❌ Processing failed: {error}")
+        QMessageBox.critical(self, "Processing failed", error)
+
+
+    def scan_finished(self, total_messages_deleted, cancelled):
+        """
+        Show the results of a finished run and restore the UI controls.
+        After a failure (see scan_failed()) or a cancel the run did not get
+        through all mailboxes, so there is no summary, only the number of
+        duplicates deleted before it stopped, if any.
+        Args:
+            total_messages_deleted (int): Duplicates deleted across all mailboxes.
+            cancelled (bool): True if the run was stopped by the Cancel button.
+        """
+        completed = not cancelled and not self.run_failed
+
+        if self.run_failed:
+            msg_for_output_box = ""
+            self.progress_label.setText("Failed")
+        elif cancelled:
+            msg_for_output_box = "\n❌ Cancelled"
+            self.progress_label.setText("Cancelled")
+        else:
+            msg_for_output_box = ""
             self.progress_bar.setValue(self.progress_bar.maximum())
             self.progress_label.setText("Finished")
+
+        if total_messages_deleted > 0:
+            msg_for_output_box += f"\n✔ Total duplicate messages deleted across all mailboxes: {total_messages_deleted}"
+        elif completed:
+            msg_for_output_box += f"\n❌ No duplicates were found\n"
+
+        if msg_for_output_box:
             self.output_box.append(msg_for_output_box)
-            
-            end_time = datetime.now()
-            duration_mins_secs = calc_duration(start_time, end_time)
-            logging.info(f"Finished. Execution duration: {duration_mins_secs}")
 
-            # Show summary message box
-            QMessageBox.information(
-                self,
-                "Scan complete",
-                f"\nTotal duplicate messages deleted across all mailboxes: {total_messages_deleted}"
-            )
-        finally:
-            # Re-enable scan button & restore text
-            self.browse_button.setEnabled(True)
-            self.scan_button.setEnabled(True)
-            self.scan_button.setText(original_text)
+        # Re-enable scan button & restore text
+        self.browse_button.setEnabled(True)
+        self.scan_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self.scan_button.setText("Start")
+        self.worker = None
+        self.worker_thread = None
+
+        if not completed or self.close_requested:
+            return
+
+        # Show summary message box
+        QMessageBox.information(
+            self,
+            "Scan complete",
+            f"\nTotal duplicate messages deleted across all mailboxes: {total_messages_deleted}"
+        )
+
+
+
+    # -------------------------------------------------
+    # Window closing
+    # -------------------------------------------------
+    def closeEvent(self, event):
+        """
+        Stop a running worker cleanly before the window closes.
+        A backup or a mailbox being rewritten cannot be interrupted, so the
+        window stays open, without blocking the GUI, until the worker has
+        stopped, and then closes itself.
+        """
+        if self.worker_thread is not None:
+            if not self.close_requested:
+                self.close_requested = True
+                self.worker.cancel()
+                self.cancel_button.setEnabled(False)
+                self.progress_label.setText("Finishing the current step, closing when done...")
+                self.worker_thread.finished.connect(self.close)
+                logging.info("Close requested while running, waiting for the worker to stop")
+
+            event.ignore()
+            return
+
+        event.accept()
 
 # -------------------------------------------------
 # MAIN
 # -------------------------------------------------
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Needed for the process pool in a PyInstaller EXE
+
+    # Only here, not at import: spawned pool workers import this module too
+    setup_logging(debug=DEBUG_MODE)
+    logging.info("-" * 80)
+    logging.info("Started Thunderbird Duplicate Email Remover.")
+
+    # Set global exception handler
+    sys.excepthook = log_uncaught_exceptions
+
     app = QApplication(sys.argv)
 
     window = MainWindow()
@@ -0,0 +1,138 @@
+# benchmarks/hash_benchmark.py
+
+"""
+Compare the fingerprint hash backends on a synthetic mail corpus.
+
+Run from the project root:
+    python -m benchmarks.hash_benchmark [number_of_messages]
+
+For each backend in functions.hashing it reports:
+    - Hash throughput in MB/s over the whole corpus
+    - Time to build a seen set with hex strings and with raw digests
+    - Approximate memory of both seen sets
+    - Collisions (distinct messages with the same digest), expected to be 0
+"""
+
+import random
+import sys
+import time
+
+from functions.functions import format_size
+from functions.hashing import get_hash_backends, new_hasher
+
+DEFAULT_MESSAGE_COUNT = 20000
+
+
+def make_corpus(count, seed=42):
+    """
+    Build a list of unique synthetic messages.
+    Most messages are a few KB, about one in fifty carries a large
+    "attachment", like a real Inbox.
+    Args:
+        count (int): Number of messages.
+        seed (int, optional): Random seed, so runs are comparable. Defaults to 42.
+    Returns:
+        list: The messages as bytes.
+    """
+    rng = random.Random(seed)
+    corpus = []
+
+    for i in range(count):
+        body_size = rng.randint(500, 8000)
+
+        if rng.random() < 0.02:
+            body_size = rng.randint(200_000, 2_000_000)
+
+        headers = (
+            f"From: sender{i % 500}@example.com\n"
+            f"Subject: Message {i}\n"
+            f"Message-ID: <{i}.{rng.getrandbits(64)}@example.com>\n\n"
+        ).encode()
+        corpus.append(headers + rng.randbytes(body_size))
+
+    return corpus
+
+
+def get_set_size(values):
+    """
+    Approximate the memory used by a set and its elements.
+    Args:
+        values (set): The set.
+    Returns:
+        int: Size in bytes.
+    """
+    return sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values)
+
+
+def benchmark_backend(hash_name, corpus):
+    """
+    Benchmark one hash backend.
+    Args:
+        hash_name (str): Name of the backend.
+        corpus (list): Messages as bytes.
+    Returns:
+        dict: The measured values.
+    """
+    total_bytes = sum(len(message) for message in corpus)
+
+    start = time.perf_counter()
+    digests = []
+    for message in corpus:
+        hash_object = new_hasher(hash_name)
+        hash_object.update(message)
+        digests.append(hash_object.digest())
+    hash_seconds = time.perf_counter() - start
+
+    hex_digests = [digest.hex() for digest in digests]
+
+    start = time.perf_counter()
+    hex_seen = set()
+    for digest in hex_digests:
+        if digest not in hex_seen:
+            hex_seen.add(digest)
+    hex_set_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    raw_seen = set()
+    for digest in digests:
+        if digest not in raw_seen:
+            raw_seen.add(digest)
+    raw_set_seconds = time.perf_counter() - start
+
+    return {
+        "hash_name": hash_name,
+        "mb_per_second": total_bytes / (1024 * 1024) / hash_seconds,
+        "hex_set_seconds": hex_set_seconds,
+        "raw_set_seconds": raw_set_seconds,
+        "hex_set_size": get_set_size(hex_seen),
+        "raw_set_size": get_set_size(raw_seen),
+        "collisions": len(corpus) - len(raw_seen),
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MESSAGE_COUNT
+    corpus = make_corpus(count)
+    total_bytes = sum(len(message) for message in corpus)
+
+    print(f"Corpus: {count} messages, {format_size(total_bytes)}\n")
+    print(
+        f"{'backend':<10}{'MB/s':>10}{'hex set':>12}{'raw set':>12}"
+        f"{'hex mem':>14}{'raw mem':>14}{'collisions':>12}"
+    )
+
+    for hash_name in get_hash_backends():
+        result = benchmark_backend(hash_name, corpus)
+        print(
+            f"{result['hash_name']:<10}"
+            f"{result['mb_per_second']:>10.1f}"
+            f"{result['hex_set_seconds'] * 1000:>10.1f}ms"
+            f"{result['raw_set_seconds'] * 1000:>10.1f}ms"
+            f"{format_size(result['hex_set_size']):>14}"
+            f"{format_size(result['raw_set_size']):>14}"
+            f"{result['collisions']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,49 @@
 # functions/backup_mail_folder.py
 
 import datetime
+import gzip
 import os
-import zipfile
+import shutil
+
+from functions.functions import get_cfg_bool
+from functions.parallel_zip import ZIP_METHODS, ParallelZipWriter
+
 
 def backup_folder(source_folder, cfg):
     """
     Create a compressed backup of a mail folder.
     Compresses all files and subdirectories from the source folder into a ZIP archive
     and stores it in a local backup directory with a timestamp.
+    Files are compressed block by block in a thread pool (see ParallelZipWriter),
+    so the backup uses all cores and the result is still a standard ZIP file.
     Args:
         source_folder (str): Path to the mail folder to be backed up.
         cfg (dict): Configuration dictionary containing:
             - "backup_zip_file_compr_level" (str or int): Compression level for the ZIP file (0-9).
+            - "backup_workers" (str or int, optional): Number of compression threads.
+              Defaults to the number of CPUs.
+            - "backup_zip_codec" (str, optional): "deflate", "bzip2", "lzma" or
+              "stored". bzip2 and lzma are smaller but much slower. Defaults to "deflate".
+            - "backup_adaptive_compression" (bool or str, optional): Store files
+              that do not compress and use the fastest level for files that
+              compress poorly, judged from a sample of each file. Defaults to False.
     Returns:
         str: Full path to the created ZIP backup file.
     Raises:
         OSError: If the backup directory cannot be created or the source folder is inaccessible.
-        zipfile.BadZipFile: If there's an issue creating the ZIP file.
+        ValueError: If backup_zip_codec is unknown.
+        zlib.error: If there's an issue compressing a file.
     """
     backup_dir = "mail_folder_backups"
     backup_file_name_start = "ThunderB_Mail_Folder_Backup"
     zip_compression_level = int( cfg["backup_zip_file_compr_level"] )
+    workers = int( cfg.get("backup_workers", os.cpu_count() or 1) )
+    codec = cfg.get("backup_zip_codec", "deflate")
+    adaptive = get_cfg_bool(cfg, "backup_adaptive_compression")
+
+    if codec not in ZIP_METHODS:
+        raise ValueError(f"Unknown backup_zip_codec: {codec}. Available: {', '.join(ZIP_METHODS)}")
+
     os.makedirs(backup_dir, exist_ok = True) # Ensure backup directory exists
 
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H_%M_%S")
@@ -31,11 +53,12 @@ def backup_folder(source_folder, cfg):
         f"{backup_file_name_start}_{timestamp}.zip"
     )
 
-    with zipfile.ZipFile(
+    with ParallelZipWriter(
         zip_path,
-        mode="w",
-        compression = zipfile.ZIP_DEFLATED,
-        compresslevel = zip_compression_level
+        level = zip_compression_level,
+        workers = workers,
+        method = ZIP_METHODS[codec],
+        adaptive = adaptive
     ) as zipf:
         for root, _, files in os.walk(source_folder):
             for file in files:
@@ -43,4 +66,66 @@ def backup_folder(source_folder, cfg):
                 arcname = os.path.relpath(full_path, source_folder)
                 zipf.write(full_path, arcname)
 
-    return zip_path
\ No newline at end of file
+    return zip_path
+
+
+class JustInTimeBackup:
+    """
+    Back up a mailbox right before it is rewritten, instead of the whole folder up front.
+    Pass an instance as before_rewrite to process_mboxes(). Only mailboxes in
+    which duplicates were found are copied, each as a gzip file under one
+    backup directory per run, keeping its path relative to the mail folder.
+    A run where a few mailboxes change then backs up megabytes, not the profile.
+    Instances are picklable, so they also work with a process pool.
+    Restore a mailbox with any gunzip tool, or gzip.open() and copy it back.
+    """
+
+    def __init__(self, source_folder, cfg, backup_dir="mail_folder_backups"):
+        """
+        Args:
+            source_folder (str): Path to the mail folder that is deduplicated.
+            cfg (dict): Configuration dictionary containing:
+                - "backup_zip_file_compr_level" (str or int): Compression level (0-9).
+            backup_dir (str, optional): Directory the run directory is created in.
+        """
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H_%M_%S")
+        self.source_folder = os.path.abspath(source_folder)
+        self.compression_level = int( cfg["backup_zip_file_compr_level"] )
+        self.backup_path = os.path.join(backup_dir, f"ThunderB_Mailbox_Backup_{timestamp}")
+
+    def __call__(self, mbox_path):
+        """
+        Back up one mailbox.
+        Args:
+            mbox_path (str): Path of the mailbox about to be rewritten.
+        Returns:
+            str: Path of the compressed copy.
+        Raises:
+            OSError: If the copy cannot be written; the mailbox is then not rewritten.
+        """
+        full_path = os.path.abspath(mbox_path)
+        rel_path = os.path.relpath(full_path, self.source_folder)
+
+        if rel_path.startswith(os.pardir):
+            rel_path = os.path.basename(full_path)  # Not below the mail folder
+
+        copy_path = os.path.join(self.backup_path, rel_path + ".gz")
+        os.makedirs(os.path.dirname(copy_path), exist_ok=True)
+
+        with open(full_path, "rb") as src, gzip.open(copy_path, "wb", compresslevel=self.compression_level) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+        return copy_path
+
+    def get_backup_files(self):
+        """
+        Returns:
+            list: Paths of the compressed copies made so far, also by other processes.
+        """
+        backup_files = []
+
+        for root, _, files in os.walk(self.backup_path):
+            for file in files:
+                backup_files.append(os.path.join(root, file))
+
+        return sorted(backup_files)
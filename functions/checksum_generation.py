@@ -1,19 +1,22 @@
 # functions/checksum_generation.py
 
-import hashlib
-import mailbox
-
 from functions.fingerprinting import get_one_msg_fingerprint_simple
+from functions.hashing import DEFAULT_HASH, new_hasher
+from functions.parser import iter_message_headers
 
-def get_one_msg_fingerprint_hashed(message):
+def get_one_msg_fingerprint_hashed(message, hash_name=DEFAULT_HASH, hex_digest=True):
     """
-    Generate an MD5 hash fingerprint for a single email message.
+    Generate a hash fingerprint (MD5 by default) for a single email message.
     This function creates a simple fingerprint of a message and then
-    converts it to an MD5 hash digest for comparison and deduplication purposes.
+    converts it to a hash digest for comparison and deduplication purposes.
     Args:
         message: The message object to generate a fingerprint hash for.
+        hash_name (str, optional): Hash backend, see hashing.get_hash_backends().
+            Defaults to "md5".
+        hex_digest (bool, optional): If True, return a hex string, otherwise
+            the raw digest bytes. Defaults to True.
     Returns:
-        str: The hexadecimal representation of the MD5 hash of the message fingerprint.
+        str or bytes: The hex string or raw digest of the hash of the message fingerprint.
     Example:
         >>> hash = get_one_msg_fingerprint_hashed(email_message)
         >>> print(hash)
@@ -22,30 +25,28 @@ def get_one_msg_fingerprint_hashed(message):
    
     msg = get_one_msg_fingerprint_simple(message)
 
-    hash_object = hashlib.md5(msg.encode())
-    hash_object = hash_object.hexdigest()
+    hash_object = new_hasher(hash_name)
+    hash_object.update(msg.encode())
 
-    return hash_object
+    return hash_object.hexdigest() if hex_digest else hash_object.digest()
 
 
 
 def get_messages_fingerprint_hashed_list(mbox_path):
     """
     Generate a list of hashed fingerprints for all messages in an mbox file.
+    The fingerprints only use headers, so only the header block of each
+    message is parsed and the bodies are skipped (see iter_message_headers()).
     Args:
         mbox_path (str): The file path to the mbox file to process.
     Returns:
         list: A list of hashed fingerprints, one for each message in the mbox file.
     Raises:
         FileNotFoundError: If the mbox file does not exist at the specified path.
-        mailbox.Error: If the mbox file is corrupted or cannot be read.
     """
-    
-    
-    mbox = mailbox.mbox(mbox_path)
     msgs_hashed_list = []
 
-    for message in mbox:
+    for message in iter_message_headers(mbox_path):
         msgs_hashed_list.append( get_one_msg_fingerprint_hashed(message) )
     
     return msgs_hashed_list
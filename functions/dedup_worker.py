@@ -0,0 +1,278 @@
+# functions/dedup_worker.py
+
+import logging
+import os
+import threading
+from datetime import datetime
+
+from PySide6.QtCore import QObject, Signal, Slot
+
+from functions.backup_mail_folder import JustInTimeBackup, backup_folder
+from functions.functions import calc_duration, format_size, get_cfg_bool
+from functions.fingerprint_store import find_profile_duplicates, summarize_duplicate_groups
+from functions.global_index import GlobalFingerprintIndex, order_mboxes_by_policy
+from functions.hashing import DEFAULT_HASH
+from functions.incremental_backup import backup_folder_incremental
+from functions.mbox_state import MboxStateStore
+from functions.msf_summary import MSF_HANDLING_MODES, get_reindex_cost
+from functions.process_mboxes import process_mboxes
+from functions.scanner import SCAN_CACHE_FILE, find_mbox_files
+
+# Progress bar values for each step of the pipeline
+PROGRESS_BACKUP_START = 1
+PROGRESS_SCAN_START = 29
+
+# "strict" compares the bytes of messages, "canonical" their decoded MIME content
+FINGERPRINT_MODES = ("strict", "canonical")
+
+
+class DedupWorker(QObject):
+    """
+    Runs the backup, scan and dedup pipeline away from the GUI thread.
+    Move an instance to a QThread and connect its run() slot to the thread's
+    started signal. The worker never touches widgets; everything the GUI has
+    to show is sent through signals, which Qt delivers in the GUI thread.
+    Signals:
+        progress (int, str): Progress bar value (0-100) and a label text.
+        output (str): Text to append to the status output box.
+        mboxes_found (list): Paths of the mailbox files found by the scan.
+        finished (int, bool): Total duplicates deleted and whether a cancel
+            stopped the run before all mailboxes were processed. A cancel
+            that comes after the last mailbox does not count. Always emitted
+            last, also after an error.
+        failed (str): Error message if the pipeline raised an exception.
+    """
+
+    progress = Signal(int, str)
+    output = Signal(str)
+    mboxes_found = Signal(list)
+    finished = Signal(int, bool)
+    failed = Signal(str)
+
+    def __init__(self, folder, cfg, exclude_trash_files):
+        """
+        Args:
+            folder (str): Path to the Thunderbird Local Folders directory.
+            cfg (dict): Configuration dictionary (see config.json).
+            exclude_trash_files (bool): Whether to skip trash folders.
+        """
+        super().__init__()
+        self.folder = folder
+        self.cfg = cfg
+        self.exclude_trash_files = exclude_trash_files
+        self._cancel_event = threading.Event()
+        self._rewritten_mboxes = []
+        self._stopped_early = False
+
+    def cancel(self):
+        """
+        Ask the worker to stop. Safe to call from any thread.
+        The current step (a backup or a mailbox being rewritten) is finished
+        first, so the worker stops cleanly between mailboxes.
+        """
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        """
+        Returns:
+            bool: True if cancel() has been called.
+        """
+        return self._cancel_event.is_set()
+
+    @Slot()
+    def run(self):
+        """
+        Run the whole pipeline: backup, scan for mailboxes and remove duplicates.
+        Emits finished() when done, whether the run completed, was cancelled
+        or failed.
+        """
+        total_messages_deleted = 0
+
+        try:
+            total_messages_deleted = self._run_pipeline()
+        except Exception as e:
+            logging.exception(f"Processing failed: {str(e)}")
+            self.failed.emit(str(e))
+        finally:
+            self.finished.emit(total_messages_deleted, self._stopped_early and self.is_cancelled())
+
+    def _run_pipeline(self):
+        start_time = datetime.now()
+
+        # ------------- Backing up ------------------------
+        self.progress.emit(PROGRESS_BACKUP_START, "Backing up mailboxes...")
+        backup_mode = self.cfg.get("backup_mode", "full")
+        just_in_time_backup = None
+
+        if backup_mode == "just_in_time":
+            # Nothing is backed up yet; each mailbox is copied right before it is rewritten
+            just_in_time_backup = JustInTimeBackup(self.folder, self.cfg)
+            backup_message = (
+                "✔ Just-in-time backup: mailboxes with duplicates are backed up before they are changed, to\n"
+                f"{os.path.abspath(just_in_time_backup.backup_path)}\n"
+            )
+        elif backup_mode == "incremental":
+            manifest_path, stored_files, stored_bytes = backup_folder_incremental(self.folder, self.cfg)
+            backup_message = (
+                f"✔ Incremental backup created:\n"
+                f"{stored_files} changed files stored ({format_size(stored_bytes)}), {os.path.abspath(manifest_path)}\n"
+            )
+        else:
+            backup_file = backup_folder(self.folder, self.cfg)
+
+            file_size = os.path.getsize(backup_file)
+            backup_file_absolute_path = os.path.abspath(backup_file)
+            formatted_file_size = format_size(file_size)
+
+            backup_message = f"✔ Backup created:\nSize: {formatted_file_size}, {backup_file_absolute_path}\n"
+
+        self.output.emit(backup_message)
+        logging.info(backup_message)
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            backup_finished_time = datetime.now()
+            duration_mins_secs = calc_duration(start_time, backup_finished_time)
+            logging.debug(f"Backup duration: {duration_mins_secs}")
+
+        if self.is_cancelled():
+            self._stopped_early = True
+            return 0
+
+        # ------------- Scanning and deduplicating ---------
+        self.progress.emit(PROGRESS_SCAN_START, "Scanning for duplicate mails...")
+        scan_workers = int(self.cfg.get("scan_workers", 1))
+        scan_cache = SCAN_CACHE_FILE if get_cfg_bool(self.cfg, "scan_cache") else None
+        mboxes = find_mbox_files(self.folder, self.exclude_trash_files, workers=scan_workers, cache_path=scan_cache)
+        self.mboxes_found.emit(list(mboxes))
+
+        workers = int(self.cfg.get("dedup_workers", os.cpu_count() or 1))
+
+        global_dedup = get_cfg_bool(self.cfg, "global_dedup")
+        survivor_policy = self.cfg.get("global_survivor_policy", "oldest")
+        folder_priority = self.cfg.get("global_folder_priority", [])
+        hash_name = self.cfg.get("fingerprint_hash", DEFAULT_HASH)
+        fingerprint_mode = self.cfg.get("fingerprint_mode", "strict")
+
+        if fingerprint_mode not in FINGERPRINT_MODES:
+            raise ValueError(f"Unknown fingerprint_mode {fingerprint_mode!r}, expected one of {FINGERPRINT_MODES}")
+
+        canonical = fingerprint_mode == "canonical"
+        tiered = get_cfg_bool(self.cfg, "tiered_dedup") and not global_dedup and not canonical
+        in_place = get_cfg_bool(self.cfg, "rewrite_in_place")
+        ignore_status = get_cfg_bool(self.cfg, "fingerprint_ignore_status")
+        msf_handling = self.cfg.get("msf_handling", "delete")
+
+        if msf_handling not in MSF_HANDLING_MODES:
+            raise ValueError(f"Unknown msf_handling {msf_handling!r}, expected one of {MSF_HANDLING_MODES}")
+
+        # Incremental dedup: skip mailboxes that are unchanged since the last run
+        state_store = None
+        if get_cfg_bool(self.cfg, "incremental_dedup"):
+            state_store = MboxStateStore(settings={
+                "fingerprint_hash": hash_name,
+                "fingerprint_ignore_status": ignore_status,
+                "fingerprint_mode": fingerprint_mode,
+                "global_dedup": global_dedup,
+                "tiered_dedup": tiered,  # Tiered runs store no fingerprints to resume from
+                "global_survivor_policy": survivor_policy if global_dedup else None,
+                "global_folder_priority": folder_priority if global_dedup else None,
+            })
+
+        # Global dedup: one fingerprint index for all mailboxes
+        global_index = GlobalFingerprintIndex() if global_dedup else None
+
+        # Until the progress reaches the total size, a cancel leaves mailboxes unprocessed
+        self._stopped_early = bool(mboxes)
+
+        try:
+            _, _, total_messages_deleted = process_mboxes(
+                mboxes,
+                progress_callback=self._on_mbox_progress,
+                workers=workers,
+                result_callback=self._on_mbox_result,
+                is_cancelled=self.is_cancelled,
+                state_store=state_store,
+                global_index=global_index,
+                survivor_policy=survivor_policy,
+                folder_priority=folder_priority,
+                hash_name=hash_name,
+                before_rewrite=just_in_time_backup,
+                tiered=tiered,
+                in_place=in_place,
+                invalidate_summaries=msf_handling == "delete",
+                ignore_status=ignore_status,
+                canonical=canonical
+            )
+        finally:
+            if state_store is not None:
+                state_store.close()
+
+            if global_index is not None:
+                global_index.close()
+
+        if just_in_time_backup is not None:
+            backup_files = just_in_time_backup.get_backup_files()
+            logging.info(f"Backed up {len(backup_files)} mailboxes before rewriting them")
+
+        if get_cfg_bool(self.cfg, "cross_folder_report") and not global_dedup and not canonical and not self.is_cancelled():
+            ordered = order_mboxes_by_policy(list(mboxes), survivor_policy, folder_priority)
+            self._report_cross_folder_duplicates(ordered, hash_name, ignore_status)
+
+        self._report_reindex_cost()
+
+        end_time = datetime.now()
+        duration_mins_secs = calc_duration(start_time, end_time)
+        logging.info(f"Finished. Execution duration: {duration_mins_secs}")
+
+        return total_messages_deleted
+
+    def _on_mbox_progress(self, processed_size, total_size):
+        self._stopped_early = processed_size < total_size
+        span = 100 - PROGRESS_SCAN_START
+        value = PROGRESS_SCAN_START + int(span * processed_size / total_size)
+        self.progress.emit(value, "Scanning for duplicate mails...")
+
+    def _on_mbox_result(self, mbox_path, msg, messages_deleted):
+        if messages_deleted:
+            self._rewritten_mboxes.append(mbox_path)
+
+        if msg:
+            self.output.emit(msg.rstrip("\n"))
+
+    def _report_cross_folder_duplicates(self, mboxes, hash_name, ignore_status):
+        # Per-folder dedup leaves copies that are in another folder; count them in one batch.
+        # This reads every mailbox again, unchanged ones included, so it is opt-in.
+        self.progress.emit(100, "Looking for copies in other folders...")
+        groups = find_profile_duplicates(mboxes, hash_name, ignore_status, is_cancelled=self.is_cancelled)
+
+        if groups is None:
+            return
+
+        copies, size, per_mbox = summarize_duplicate_groups(groups)
+
+        if not copies:
+            return
+
+        self.output.emit(
+            f"{copies} messages ({format_size(size)}) also exist in another folder. "
+            "Turn on global dedup to remove them."
+        )
+
+        for mbox_path, count in per_mbox.most_common():
+            logging.info(f"Copies of messages kept in another folder: {count} in {mbox_path}")
+
+    def _report_reindex_cost(self):
+        # Thunderbird rebuilds the index of every rewritten folder when it is next opened
+        reindex = get_reindex_cost(self._rewritten_mboxes)
+
+        if not reindex:
+            return
+
+        total_size = sum(size for _, size in reindex)
+        self.output.emit(
+            f"Thunderbird will rebuild the index of {len(reindex)} folders ({format_size(total_size)}) "
+            "the first time they are opened. Large folders can take a while."
+        )
+
+        for mbox_path, size in reindex:
+            logging.info(f"Reindex on next open: {mbox_path} ({format_size(size)})")
@@ -0,0 +1,254 @@
+# functions/fingerprint_store.py
+
+import logging
+from array import array
+from collections import Counter
+
+from functions.fingerprinting import get_raw_msg_fingerprint_strict, get_raw_msg_normalized_length
+from functions.hashing import DEFAULT_HASH, new_hasher
+from functions.mbox_reader import MappedMbox
+
+# numpy is optional; without it the same arrays are sorted in pure Python
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class FingerprintStore:
+    """
+    Compact table of message fingerprints for a whole profile.
+    Each message takes one fixed-width raw digest plus a mailbox id, offset
+    and length in flat arrays (about 36 bytes for MD5) instead of a Python
+    str and tuple per message, so millions of messages fit in a few tens of MB.
+    Duplicates are found all at once by sorting the digests, see
+    find_duplicate_groups(). With numpy installed the table is a structured
+    array and the sort is vectorized.
+    """
+
+    def __init__(self, digest_size=16):
+        """
+        Args:
+            digest_size (int, optional): Size in bytes of the raw digests that
+                will be added. Defaults to 16 (MD5, BLAKE2b-128, XXH3-128).
+        """
+        self.digest_size = digest_size
+        self.mboxes = []
+        self._mbox_ids = {}
+        self._digests = bytearray()
+        self._mbox_index = array("I")
+        self._offsets = array("Q")
+        self._lengths = array("Q")
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def add(self, mbox_path, offset, length, digest):
+        """
+        Add the fingerprint of one message.
+        Args:
+            mbox_path (str): Path of the mailbox the message is in.
+            offset (int): Position of the message in the mailbox.
+            length (int): Length of the raw mbox entry.
+            digest (bytes): Raw digest of the message, digest_size bytes.
+        Raises:
+            ValueError: If the digest does not have digest_size bytes.
+        """
+        if len(digest) != self.digest_size:
+            raise ValueError(f"Expected a digest of {self.digest_size} bytes, got {len(digest)}")
+
+        mbox_id = self._mbox_ids.get(mbox_path)
+
+        if mbox_id is None:
+            mbox_id = self._mbox_ids[mbox_path] = len(self.mboxes)
+            self.mboxes.append(mbox_path)
+
+        self._digests += digest
+        self._mbox_index.append(mbox_id)
+        self._offsets.append(offset)
+        self._lengths.append(length)
+
+    def to_array(self):
+        """
+        Get the table as a numpy structured array.
+        Returns:
+            numpy.ndarray: One row per message with the fields "digest"
+                (fixed-width bytes), "mbox" (index into self.mboxes),
+                "offset" and "length".
+        Raises:
+            ImportError: If numpy is not installed.
+        """
+        if np is None:
+            raise ImportError("numpy is required for FingerprintStore.to_array()")
+
+        table = np.empty(len(self), dtype=[
+            ("digest", f"S{self.digest_size}"),
+            ("mbox", np.uint32),
+            ("offset", np.uint64),
+            ("length", np.uint64),
+        ])
+
+        if len(self):
+            table["digest"] = np.frombuffer(bytes(self._digests), dtype=f"S{self.digest_size}")
+            table["mbox"] = np.frombuffer(self._mbox_index, dtype=f"u{self._mbox_index.itemsize}")
+            table["offset"] = np.frombuffer(self._offsets, dtype=f"u{self._offsets.itemsize}")
+            table["length"] = np.frombuffer(self._lengths, dtype=f"u{self._lengths.itemsize}")
+
+        return table
+
+    def find_duplicate_groups(self):
+        """
+        Find all groups of messages with the same fingerprint.
+        Returns:
+            list: One list per group of two or more messages, each message as
+                  (mbox_path, offset, length) in the order they were added. The
+                  first message of a group is the one to keep, the others are
+                  its duplicates. Groups are ordered by their first message.
+        """
+        if not len(self):
+            return []
+
+        if np is not None:
+            order = self._sorted_order_numpy()
+        else:
+            order = self._sorted_order_python()
+
+        groups = []
+        group = []
+        previous = None
+
+        for i in order:
+            digest = self._digest_at(i)
+
+            if digest != previous:
+                if len(group) > 1:
+                    groups.append(group)
+                group = []
+                previous = digest
+
+            group.append(i)
+
+        if len(group) > 1:
+            groups.append(group)
+
+        groups.sort(key=lambda members: members[0])
+
+        return [
+            [(self.mboxes[self._mbox_index[i]], self._offsets[i], self._lengths[i]) for i in members]
+            for members in groups
+        ]
+
+    def _digest_at(self, i):
+        return bytes(self._digests[i * self.digest_size:(i + 1) * self.digest_size])
+
+    def _sorted_order_numpy(self):
+        # A stable sort keeps the messages of a group in the order they were added,
+        # and only the rows next to an equal digest have to be looked at in Python
+        digests = np.frombuffer(bytes(self._digests), dtype=f"S{self.digest_size}")
+        order = np.argsort(digests, kind="stable")
+        sorted_digests = digests[order]
+
+        same_as_next = np.zeros(len(order), dtype=bool)
+        same_as_next[:-1] = sorted_digests[1:] == sorted_digests[:-1]
+        in_group = same_as_next.copy()
+        in_group[1:] |= same_as_next[:-1]
+
+        return order[in_group].tolist()
+
+    def _sorted_order_python(self):
+        return sorted(range(len(self)), key=self._digest_at)
+
+
+def find_profile_duplicates(mboxes, hash_name=DEFAULT_HASH, ignore_status=False, is_cancelled=None):
+    """
+    Find the duplicate messages of a whole profile in one batch, without changing anything.
+    Works in two passes over the memory-mapped mailboxes:
+        1. Get the normalized length of every message (cheap, see
+           fingerprinting.get_raw_msg_normalized_length()).
+        2. Hash only messages whose length occurs more than once in the
+           profile, into a FingerprintStore, and sort it.
+    The result is the same as in global dedup mode with mailboxes in the given order.
+    Args:
+        mboxes (list): Paths of the mailbox files, the one whose copies should be kept first.
+        hash_name (str, optional): Hash backend, see hashing.get_hash_backends().
+            Defaults to "md5".
+        ignore_status (bool, optional): Leave the Mozilla status headers out,
+            see fingerprinting.get_raw_msg_fingerprint_strict(). Defaults to False.
+        is_cancelled (callable, optional): Returns True when the search should
+            stop. It is checked between mailboxes.
+    Returns:
+        list or None: The duplicate groups, see FingerprintStore.find_duplicate_groups(),
+            or None if the search was cancelled. Mailboxes that cannot be read
+            are logged and left out.
+    """
+    if is_cancelled is None:
+        is_cancelled = lambda: False
+
+    mbox_lengths = {}
+    length_counts = Counter()
+
+    for mbox_path in mboxes:
+        if is_cancelled():
+            return None
+
+        try:
+            with MappedMbox(mbox_path) as mapped:
+                lengths = array("Q", (
+                    get_raw_msg_normalized_length(mapped.buffer, offset, length, ignore_status)
+                    for offset, length in mapped.iter_ranges()
+                ))
+        except OSError as e:
+            logging.warning(f"Left {mbox_path} out of the duplicate report: {e}")
+            continue
+
+        mbox_lengths[mbox_path] = lengths
+        length_counts.update(lengths)
+
+    store = FingerprintStore(new_hasher(hash_name).digest_size)
+
+    for mbox_path, lengths in mbox_lengths.items():
+        if is_cancelled():
+            return None
+
+        if all(length_counts[length] < 2 for length in lengths):
+            continue
+
+        try:
+            with MappedMbox(mbox_path) as mapped:
+                for (offset, length), normalized_length in zip(mapped.iter_ranges(), lengths):
+                    if length_counts[normalized_length] < 2:
+                        continue
+
+                    digest = get_raw_msg_fingerprint_strict(
+                        mapped.buffer, offset, length, hash_name, hex_digest=False, ignore_status=ignore_status
+                    )
+                    store.add(mbox_path, offset, length, digest)
+        except OSError as e:
+            logging.warning(f"Left {mbox_path} out of the duplicate report: {e}")
+
+    return store.find_duplicate_groups()
+
+
+def summarize_duplicate_groups(groups):
+    """
+    Count what removing the duplicates of a profile would free.
+    Args:
+        groups (list): Duplicate groups from find_profile_duplicates().
+    Returns:
+        tuple: A tuple containing:
+            - int: Number of copies that would be deleted (all but the first
+              message of each group).
+            - int: Their size in bytes.
+            - Counter: Number of those copies per mailbox path.
+    """
+    copies = 0
+    size = 0
+    per_mbox = Counter()
+
+    for group in groups:
+        for mbox_path, _, length in group[1:]:
+            copies += 1
+            size += length
+            per_mbox[mbox_path] += 1
+
+    return copies, size, per_mbox
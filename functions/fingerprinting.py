@@ -1,7 +1,21 @@
 # functions/fingerprinting.py
 
-import hashlib
+import email
+from email.header import decode_header, make_header
+
+from functions.hashing import DEFAULT_HASH, new_hasher
 from functions.normalizing import normalize
+from functions.mbox_reader import get_header_bounds, get_message_bounds, get_message_content
+from functions.mozilla_status import get_status_spans
+
+# Strict fingerprints feed the hasher in chunks of this size
+HASH_CHUNK_SIZE = 64 * 1024  # 64 KB
+
+# Headers that go into the canonical fingerprint, besides the decoded MIME parts
+CANONICAL_HEADERS = ("message-id", "date", "from", "to", "cc", "subject")
+
+# Attachments at least this big have their digest cached, see get_one_msg_fingerprint_canonical()
+PART_CACHE_MIN_SIZE = 64 * 1024  # 64 KB
 
 
 def get_one_msg_fingerprint_simple(message):
@@ -68,19 +82,352 @@ def get_one_msg_fingerprint_with_body(message, body_chars=80):
     return f"{header_fp}|{body}"
 
 
-def get_one_msg_fingerprint_strict(message):
+def get_one_msg_fingerprint_strict(message, hash_name=DEFAULT_HASH, hex_digest=True):
     """
-    Generate a strict MD5 fingerprint of an email message.
+    Generate a strict fingerprint of an email message.
     
     Normalizes the message by converting CRLF line endings to LF,
-    then computes and returns the MD5 hash digest as a hexadecimal string.
+    then computes and returns the hash digest (MD5 by default).
     This provides a consistent fingerprint for exact message comparison.
     
     Args:
-        message: An email message object with an as_bytes() method.
+        message: An email message object with an as_bytes() method, or the
+            raw bytes of an mbox entry (see mbox_reader.iter_raw_messages).
+            Raw bytes are hashed directly, without the "From " separator
+            line, so no Message object has to be built.
+        hash_name (str, optional): Hash backend, see hashing.get_hash_backends().
+            Defaults to "md5".
+        hex_digest (bool, optional): If True, return a hex string, otherwise
+            the raw digest bytes, which are smaller and cheaper to compare.
+            Defaults to True.
     
     Returns:
-        str: The hexadecimal representation of the MD5 hash of the normalized message.
+        str or bytes: The hex string or raw digest of the hash of the normalized message.
+    """
+    if isinstance(message, (bytes, bytearray)):
+        return get_raw_msg_fingerprint_strict(message, 0, len(message), hash_name, hex_digest)
+
+    raw = message.as_bytes()
+
+    hash_object = new_hasher(hash_name)
+    update_hasher_crlf_to_lf(hash_object, raw)
+
+    return hash_object.hexdigest() if hex_digest else hash_object.digest()
+
+
+def get_raw_msg_fingerprint_strict(buffer, offset, length, hash_name=DEFAULT_HASH, hex_digest=True,
+                                   ignore_status=False):
+    """
+    Generate the strict fingerprint of a message inside an mbox buffer.
+    Same result as get_one_msg_fingerprint_strict() for the raw bytes of the
+    message, but the message is hashed where it lies, e.g. in a memory-mapped
+    mailbox (mbox_reader.MappedMbox), without copying it out first.
+    Args:
+        buffer (bytes): The mbox contents (bytes or an mmap).
+        offset (int): Position of the message's "From " line in buffer.
+        length (int): Length of the raw mbox entry.
+        hash_name (str, optional): Hash backend, see hashing.get_hash_backends().
+            Defaults to "md5".
+        hex_digest (bool, optional): If True, return a hex string, otherwise
+            the raw digest bytes. Defaults to True.
+        ignore_status (bool, optional): If True, the X-Mozilla-Status,
+            X-Mozilla-Status2 and X-Mozilla-Keys headers are left out, so
+            copies that only differ in read/starred flags or tags get the
+            same fingerprint. Defaults to False.
+    Returns:
+        str or bytes: The hex string or raw digest of the hash of the normalized message.
     """
-    raw = message.as_bytes().replace(b"\r\n", b"\n")
-    return hashlib.md5(raw).hexdigest()
+    start, end = get_message_bounds(buffer, offset, offset + length)
+    skip = get_status_spans(buffer, offset, length) if ignore_status else ()
+
+    hash_object = new_hasher(hash_name)
+    update_hasher_skipping(hash_object, buffer, start, end, skip)
+
+    return hash_object.hexdigest() if hex_digest else hash_object.digest()
+
+
+def get_one_msg_fingerprint_canonical(message, hash_name=DEFAULT_HASH, hex_digest=True, part_cache=None):
+    """
+    Generate a fingerprint of the content of an email message, not of its bytes.
+    Copies of a message that were re-encoded on the way (base64 instead of
+    quoted-printable, another charset, headers folded differently, CRLF
+    instead of LF) get the same canonical fingerprint, while the strict
+    fingerprint tells them apart. The fingerprint is the hash of:
+        - the key headers (CANONICAL_HEADERS), RFC 2047-decoded and normalized,
+        - for each MIME leaf, its content type, file name and the digest of
+          its decoded payload. Text parts are decoded to Unicode with their
+          charset and have their line endings folded to LF.
+    Each leaf is decoded once and hashed on its own, then only its digest
+    goes into the message hash. Status headers such as X-Mozilla-Status are
+    not key headers, so copies with other flags also match.
+    Args:
+        message: An email message object, or the raw bytes of an mbox entry.
+        hash_name (str, optional): Hash backend, see hashing.get_hash_backends().
+            Defaults to "md5".
+        hex_digest (bool, optional): If True, return a hex string, otherwise
+            the raw digest bytes. Defaults to True.
+        part_cache (dict, optional): Digests of attachments seen before. Pass
+            the same dict for all messages of a mailbox. An attachment of at
+            least PART_CACHE_MIN_SIZE whose encoded size matches an earlier
+            one is looked up by a hash of its encoded payload, which costs
+            less than half of decoding and hashing it. So from its third copy
+            on, an attachment is hashed once in encoded form but not decoded
+            again. Attachments with a size of their own get no extra hashing.
+    Returns:
+        str or bytes: The hex string or raw digest of the canonical fingerprint.
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        message = email.message_from_bytes(get_message_content(bytes(message)))
+
+    hash_object = new_hasher(hash_name)
+
+    for name in CANONICAL_HEADERS:
+        for value in message.get_all(name, []):
+            hash_object.update(b"%s:%s\n" % (name.encode(), get_canonical_header(value).encode("utf-8")))
+
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+
+        filename = normalize(part.get_filename() or "")
+        hash_object.update(b"\0%s\0%s\0" % (part.get_content_type().encode(), filename.encode("utf-8")))
+        hash_object.update(get_part_digest(part, hash_name, part_cache))
+
+    return hash_object.hexdigest() if hex_digest else hash_object.digest()
+
+
+def get_raw_msg_fingerprint_canonical(buffer, offset, length, hash_name=DEFAULT_HASH, hex_digest=True,
+                                      part_cache=None):
+    """
+    Generate the canonical fingerprint of a message inside an mbox buffer.
+    Same as get_one_msg_fingerprint_canonical() for the raw bytes of the message.
+    Args:
+        buffer (bytes): The mbox contents (bytes or an mmap).
+        offset (int): Position of the message's "From " line in buffer.
+        length (int): Length of the raw mbox entry.
+        hash_name (str, optional): Hash backend. Defaults to "md5".
+        hex_digest (bool, optional): If True, return a hex string, otherwise
+            the raw digest bytes. Defaults to True.
+        part_cache (dict, optional): Attachment digest cache, see
+            get_one_msg_fingerprint_canonical().
+    Returns:
+        str or bytes: The hex string or raw digest of the canonical fingerprint.
+    """
+    start, end = get_message_bounds(buffer, offset, offset + length)
+    message = email.message_from_bytes(buffer[start:end])
+
+    return get_one_msg_fingerprint_canonical(message, hash_name, hex_digest, part_cache)
+
+
+def get_canonical_header(value):
+    """
+    Decode and normalize a header value, whatever its encoding and folding.
+    Args:
+        value (str): The raw header value.
+    Returns:
+        str: The RFC 2047-decoded value, lowercased, with whitespace collapsed.
+    """
+    try:
+        value = str(make_header(decode_header(str(value))))
+    except (LookupError, UnicodeError, ValueError):
+        value = str(value)
+
+    return normalize(value)
+
+
+def get_part_digest(part, hash_name=DEFAULT_HASH, part_cache=None):
+    """
+    Get the digest of the decoded payload of one MIME leaf.
+    Args:
+        part (email.message.Message): A part that is not multipart.
+        hash_name (str, optional): Hash backend. Defaults to "md5".
+        part_cache (dict, optional): Attachment digest cache, see
+            get_one_msg_fingerprint_canonical().
+    Returns:
+        bytes: The raw digest of the decoded payload.
+    """
+    is_text = part.get_content_maintype() == "text"
+    cache_key = None
+
+    if part_cache is not None and not is_text:
+        encoded = part.get_payload()
+
+        if isinstance(encoded, str) and len(encoded) >= PART_CACHE_MIN_SIZE:
+            encoding = part.get("content-transfer-encoding", "").strip().lower()
+            size_key = (encoding, len(encoded))
+
+            # Only an attachment of the same encoded size as an earlier one can be a copy of it
+            if size_key in part_cache:
+                key_hasher = new_hasher(hash_name)
+                key_hasher.update(encoded.encode("utf-8", "surrogateescape"))
+                cache_key = size_key + (key_hasher.digest(),)
+
+                if cache_key in part_cache:
+                    return part_cache[cache_key]
+            else:
+                part_cache[size_key] = None
+
+    payload = part.get_payload(decode=True) or b""
+
+    if is_text:
+        try:
+            text = payload.decode(part.get_content_charset() or "us-ascii", errors="replace")
+        except LookupError:
+            text = payload.decode("latin-1")
+
+        payload = text.replace("\r\n", "\n").replace("\r", "\n").rstrip().encode("utf-8")
+
+    hash_object = new_hasher(hash_name)
+    hash_object.update(payload)
+    digest = hash_object.digest()
+
+    if cache_key is not None:
+        part_cache[cache_key] = digest
+
+    return digest
+
+
+def get_raw_msg_normalized_length(buffer, offset, length, ignore_status=False):
+    """
+    Get the length of a message inside an mbox buffer, not counting CR bytes.
+    Messages with the same strict fingerprint (get_raw_msg_fingerprint_strict)
+    always have the same normalized length: CRLF folding only removes CRs, so
+    two messages that are equal once folded can only differ in CR bytes. A
+    message whose normalized length no other message has therefore cannot be
+    a duplicate and does not have to be hashed.
+    Counting one byte value is much cheaper than hashing, and free for
+    messages without any CR.
+    Args:
+        buffer (bytes): The mbox contents (bytes or an mmap).
+        offset (int): Position of the message's "From " line in buffer.
+        length (int): Length of the raw mbox entry.
+        ignore_status (bool, optional): Leave out the Mozilla status headers,
+            matching get_raw_msg_fingerprint_strict(). Defaults to False.
+    Returns:
+        int: The length of the message part (see mbox_reader.get_message_bounds)
+             minus the number of CR bytes in it.
+    """
+    start, end = get_message_bounds(buffer, offset, offset + length)
+    normalized_length = end - start - count_cr(buffer, start, end)
+
+    if ignore_status:
+        for span_start, span_end in get_status_spans(buffer, offset, length):
+            normalized_length -= span_end - span_start - count_cr(buffer, span_start, span_end)
+
+    return normalized_length
+
+
+def count_cr(raw, start=0, end=None):
+    """
+    Count the CR bytes in part of a buffer.
+    Args:
+        raw (bytes): The buffer (bytes or an mmap).
+        start (int, optional): First byte to look at. Defaults to 0.
+        end (int, optional): End of the bytes to look at. Defaults to len(raw).
+    Returns:
+        int: The number of "\r" bytes between start and end.
+    """
+    end = len(raw) if end is None else end
+
+    if raw.find(b"\r", start, end) == -1:
+        return 0
+
+    # mmap has no count(), so count in slices of bounded size
+    return sum(
+        raw[chunk_start:min(chunk_start + HASH_CHUNK_SIZE, end)].count(b"\r")
+        for chunk_start in range(start, end, HASH_CHUNK_SIZE)
+    )
+
+
+def get_raw_msg_header_key(buffer, offset, length, hash_name=DEFAULT_HASH, hex_digest=True, ignore_status=False):
+    """
+    Generate a cheap key of a message inside an mbox buffer from its headers only.
+    The key is the hash of the header block (up to the first empty line)
+    with CRLF folded to LF, so the body is never read. Messages with the same
+    strict fingerprint (get_raw_msg_fingerprint_strict) always have the same
+    header key, so messages with a key of their own cannot be duplicates and
+    only messages that share a key have to be hashed in full.
+    Args:
+        buffer (bytes): The mbox contents (bytes or an mmap).
+        offset (int): Position of the message's "From " line in buffer.
+        length (int): Length of the raw mbox entry.
+        hash_name (str, optional): Hash backend, see hashing.get_hash_backends().
+            Defaults to "md5".
+        hex_digest (bool, optional): If True, return a hex string, otherwise
+            the raw digest bytes. Defaults to True.
+        ignore_status (bool, optional): Leave out the Mozilla status headers,
+            matching get_raw_msg_fingerprint_strict(). Defaults to False.
+    Returns:
+        str or bytes: The hex string or raw digest of the hash of the headers.
+    """
+    start, end = get_message_bounds(buffer, offset, offset + length)
+    start, end = get_header_bounds(buffer, start, end)
+    skip = get_status_spans(buffer, offset, length) if ignore_status else ()
+
+    hash_object = new_hasher(hash_name)
+    update_hasher_skipping(hash_object, buffer, start, end, skip)
+
+    return hash_object.hexdigest() if hex_digest else hash_object.digest()
+
+
+def update_hasher_skipping(hash_object, raw, start, end, skip):
+    """
+    Feed bytes to a hasher with CRLF folded to LF, leaving out some spans.
+    Args:
+        hash_object: A hash object with an update() method.
+        raw (bytes): The buffer to hash (bytes or an mmap).
+        start (int): First byte to hash.
+        end (int): End of the bytes to hash.
+        skip (iterable): (start, end) spans inside start..end to leave out, in
+            order. Spans must be whole lines, so no CRLF pair is split.
+    Returns:
+        None
+    """
+    position = start
+
+    for skip_start, skip_end in skip:
+        update_hasher_crlf_to_lf(hash_object, raw, position, skip_start)
+        position = skip_end
+
+    update_hasher_crlf_to_lf(hash_object, raw, position, end)
+
+
+def update_hasher_crlf_to_lf(hash_object, raw, start=0, end=None):
+    """
+    Feed bytes to a hasher as if every CRLF had been replaced by LF.
+    Gives exactly the same digest as hash_object.update(raw[start:end].replace(b"\r\n", b"\n"))
+    without making two full copies of the message. Data without CRLF is fed
+    as memoryview slices, so nothing is copied at all. Otherwise the data is
+    folded chunk by chunk, and a chunk never ends between "\r" and "\n", so
+    at most HASH_CHUNK_SIZE bytes are copied at a time.
+    Args:
+        hash_object: A hash object with an update() method.
+        raw (bytes): The buffer to hash (anything with find() that supports
+            memoryview, such as bytes or an mmap).
+        start (int, optional): First byte to hash. Defaults to 0.
+        end (int, optional): End of the bytes to hash. Defaults to len(raw).
+    Returns:
+        None
+    """
+    end = len(raw) if end is None else end
+    view = memoryview(raw)
+
+    try:
+        if raw.find(b"\r\n", start, end) == -1:
+            for chunk_start in range(start, end, HASH_CHUNK_SIZE):
+                hash_object.update(view[chunk_start:min(chunk_start + HASH_CHUNK_SIZE, end)])
+            return
+
+        chunk_start = start
+
+        while chunk_start < end:
+            chunk_end = min(chunk_start + HASH_CHUNK_SIZE, end)
+
+            # Don't split a CRLF pair between two chunks
+            if chunk_end < end and raw[chunk_end - 1] == 0x0D and raw[chunk_end] == 0x0A:
+                chunk_end += 1
+
+            hash_object.update(bytes(view[chunk_start:chunk_end]).replace(b"\r\n", b"\n"))
+            chunk_start = chunk_end
+    finally:
+        view.release()
@@ -117,3 +117,28 @@ def format_size(bytes_size):
         bytes_size /= 1024
     return f"{bytes_size:.2f} PB"  # unlikely to reach here
 
+
+
+def get_cfg_bool(cfg, key, default=False):
+    """
+    Read a boolean setting from the configuration dictionary.
+    config.json stores flags either as JSON booleans or as the strings
+    "True"/"False" (e.g. "exclude_trash_folders"); both are accepted.
+    Args:
+        cfg (dict): Configuration dictionary.
+        key (str): Name of the setting.
+        default (bool, optional): Value to use if the setting is missing. Defaults to False.
+    Returns:
+        bool: The value of the setting.
+    Examples:
+        >>> get_cfg_bool({"incremental_dedup": "True"}, "incremental_dedup")
+        True
+        >>> get_cfg_bool({}, "incremental_dedup")
+        False
+    """
+    value = cfg.get(key, default)
+
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes")
+
+    return bool(value)
@@ -0,0 +1,166 @@
+# functions/global_index.py
+
+import os
+import sqlite3
+import tempfile
+
+SURVIVOR_POLICIES = ("oldest", "priority", "largest")
+
+# Pending fingerprints are written to the database in batches of this size
+INSERT_BATCH_SIZE = 10000
+
+
+class GlobalFingerprintIndex:
+    """
+    Disk-backed set of message fingerprints shared by all mailboxes of a profile.
+    Used as the seen set of process_one_mbox() in global dedup mode, so a
+    message copied into both Inbox and an archive folder is detected. It
+    supports "in", add() and update() like a set, but the fingerprints live in
+    a SQLite database, so millions of messages do not have to fit in RAM.
+    Recent additions are buffered in memory and written in batches.
+    An index must be used from the thread that created it.
+    """
+
+    def __init__(self, db_path=None):
+        """
+        Open the index.
+        Args:
+            db_path (str, optional): Path to the SQLite file. If not given, a
+                temporary file is used and deleted again by close().
+        """
+        if db_path is None:
+            fd, db_path = tempfile.mkstemp(prefix="thunderbird_deduper_", suffix=".sqlite")
+            os.close(fd)
+            self._temp_path = db_path
+        else:
+            self._temp_path = None
+
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints (fingerprint BLOB PRIMARY KEY)"
+        )
+        self.connection.commit()
+        self._pending = set()
+
+    def __contains__(self, fingerprint):
+        if fingerprint in self._pending:
+            return True
+
+        row = self.connection.execute(
+            "SELECT 1 FROM fingerprints WHERE fingerprint = ?",
+            (fingerprint,)
+        ).fetchone()
+
+        return row is not None
+
+    def __len__(self):
+        self.flush()
+        return self.connection.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+
+    def add(self, fingerprint):
+        """
+        Add a fingerprint to the index.
+        Args:
+            fingerprint (bytes): The fingerprint to add.
+        """
+        self._pending.add(fingerprint)
+
+        if len(self._pending) >= INSERT_BATCH_SIZE:
+            self.flush()
+
+    def update(self, fingerprints):
+        """
+        Add several fingerprints to the index.
+        Args:
+            fingerprints (iterable): The fingerprints to add.
+        """
+        for fingerprint in fingerprints:
+            self.add(fingerprint)
+
+    def flush(self):
+        """
+        Write the buffered fingerprints to the database.
+        """
+        if not self._pending:
+            return
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO fingerprints (fingerprint) VALUES (?)",
+                ((fingerprint,) for fingerprint in self._pending)
+            )
+
+        self._pending.clear()
+
+    def close(self):
+        """
+        Close the database, and delete it if it was a temporary file.
+        """
+        self.connection.close()
+
+        if self._temp_path and os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+def get_folder_priority(mbox_path, folder_priority):
+    """
+    Find the position of a mailbox in a folder priority list.
+    A mailbox matches an entry if the entry equals the name of the mailbox or
+    of one of its parent folders (case-insensitive, Thunderbird's ".sbd"
+    suffix ignored), e.g. "Archives" matches "Local Folders/Archives.sbd/2023".
+    Args:
+        mbox_path (str): Path to the mailbox file.
+        folder_priority (list): Folder names, most important first.
+    Returns:
+        int: Index of the first matching entry, or len(folder_priority) if
+             no entry matches.
+    """
+    parts = os.path.normpath(mbox_path).split(os.sep)
+    names = {part.lower().removesuffix(".sbd") for part in parts}
+
+    for i, folder in enumerate(folder_priority):
+        if folder.lower() in names:
+            return i
+
+    return len(folder_priority)
+
+
+def order_mboxes_by_policy(mboxes, policy="oldest", folder_priority=None):
+    """
+    Sort mailboxes so the one whose copy should survive comes first.
+    In global dedup mode the first mailbox in which a message is seen keeps
+    it, and later copies are deleted.
+    Args:
+        mboxes (list): Paths of the mailbox files.
+        policy (str, optional): One of SURVIVOR_POLICIES:
+            - "oldest": Least recently modified mailbox first.
+            - "priority": In the order of folder_priority, other mailboxes last.
+            - "largest": Biggest mailbox file first.
+            Defaults to "oldest".
+        folder_priority (list, optional): Folder names for the "priority" policy.
+    Returns:
+        list: The mailbox paths in processing order. Ties keep their original order.
+    Raises:
+        ValueError: If policy is not one of SURVIVOR_POLICIES.
+    """
+    def stat_or_none(mbox):
+        try:
+            return os.stat(mbox)
+        except OSError:
+            return None
+
+    if policy == "oldest":
+        def key(mbox):
+            stat = stat_or_none(mbox)
+            return stat.st_mtime if stat else float("inf")
+    elif policy == "largest":
+        def key(mbox):
+            stat = stat_or_none(mbox)
+            return -stat.st_size if stat else 0
+    elif policy == "priority":
+        def key(mbox):
+            return get_folder_priority(mbox, folder_priority or [])
+    else:
+        raise ValueError(f"Unknown survivor policy: {policy}")
+
+    return sorted(mboxes, key=key)
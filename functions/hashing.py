@@ -0,0 +1,67 @@
+# functions/hashing.py
+
+import hashlib
+
+# xxhash is optional; it is a fast non-cryptographic hash
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DEFAULT_HASH = "md5"
+
+# Name -> constructor of a hash object with update(), digest() and hexdigest()
+HASH_BACKENDS = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "blake2b": lambda: hashlib.blake2b(digest_size=16),  # Short digest, same size as MD5
+}
+
+if xxhash is not None:
+    HASH_BACKENDS["xxh3"] = xxhash.xxh3_128
+
+
+def get_hash_backends():
+    """
+    List the hash backends that can be used for fingerprints.
+    Returns:
+        list: The names of the available backends. "xxh3" is only included
+              if the optional xxhash package is installed.
+    """
+    return list(HASH_BACKENDS)
+
+
+def new_hasher(hash_name=DEFAULT_HASH):
+    """
+    Create a new hash object for a backend.
+    Args:
+        hash_name (str, optional): Name of the backend, see get_hash_backends().
+            Defaults to DEFAULT_HASH.
+    Returns:
+        object: A hash object with update(), digest() and hexdigest() methods.
+    Raises:
+        ValueError: If the backend is unknown or not installed.
+    """
+    try:
+        return HASH_BACKENDS[hash_name]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown or unavailable hash backend: {hash_name}. "
+            f"Available: {', '.join(get_hash_backends())}"
+        ) from None
+
+
+def hash_bytes(data, hash_name=DEFAULT_HASH):
+    """
+    Hash a bytes-like object and return the raw digest.
+    Raw digests are half the size of hex strings and cheaper to compare, which
+    matters for the seen sets of mailboxes with millions of messages.
+    Args:
+        data (bytes): The data to hash.
+        hash_name (str, optional): Name of the backend. Defaults to DEFAULT_HASH.
+    Returns:
+        bytes: The digest.
+    """
+    hash_object = new_hasher(hash_name)
+    hash_object.update(data)
+    return hash_object.digest()
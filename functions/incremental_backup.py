@@ -0,0 +1,245 @@
+# functions/incremental_backup.py
+
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+INCREMENTAL_BACKUP_DIR = os.path.join("mail_folder_backups", "incremental")
+MANIFEST_DIR_NAME = "manifests"
+OBJECT_DIR_NAME = "objects"
+
+READ_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+def get_object_path(backup_dir, digest):
+    """
+    Get the path where the contents with a given digest are stored.
+    Args:
+        backup_dir (str): The incremental backup directory.
+        digest (str): SHA-256 hex digest of the file contents.
+    Returns:
+        str: Path of the gzip-compressed object file.
+    """
+    return os.path.join(backup_dir, OBJECT_DIR_NAME, digest[:2], f"{digest}.gz")
+
+
+def load_manifest(manifest_path):
+    """
+    Load a backup manifest.
+    Args:
+        manifest_path (str): Path of the manifest JSON file.
+    Returns:
+        dict: The manifest with "created", "source_folder" and "files", where
+              "files" is a list of {"path", "size", "mtime_ns", "digest"}.
+    """
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_manifests(backup_dir=INCREMENTAL_BACKUP_DIR):
+    """
+    List the backups that can be restored, oldest first.
+    Args:
+        backup_dir (str, optional): The incremental backup directory.
+    Returns:
+        list: Paths of the manifest files. The file names are timestamps, so
+              each one is a point in time that can be restored.
+    """
+    manifest_dir = os.path.join(backup_dir, MANIFEST_DIR_NAME)
+
+    if not os.path.isdir(manifest_dir):
+        return []
+
+    return [
+        os.path.join(manifest_dir, name)
+        for name in sorted(os.listdir(manifest_dir))
+        if name.endswith(".json")
+    ]
+
+
+def store_object(full_path, backup_dir, compression_level):
+    """
+    Store the contents of a file in the object store, unless already there.
+    The file is read once: it is hashed and compressed in the same pass.
+    Args:
+        full_path (str): Path of the file to store.
+        backup_dir (str): The incremental backup directory.
+        compression_level (int): gzip compression level (0-9).
+    Returns:
+        tuple: (digest, stored_bytes) where stored_bytes is the size of the
+               new object, or 0 if identical contents were already stored.
+    """
+    object_dir = os.path.join(backup_dir, OBJECT_DIR_NAME)
+    os.makedirs(object_dir, exist_ok=True)
+
+    hash_object = hashlib.sha256()
+
+    with tempfile.NamedTemporaryFile(dir=object_dir, delete=False) as tmp:
+        tmp_path = tmp.name
+
+    try:
+        with open(full_path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=compression_level) as dst:
+            while chunk := src.read(READ_CHUNK_SIZE):
+                hash_object.update(chunk)
+                dst.write(chunk)
+
+        digest = hash_object.hexdigest()
+        object_path = get_object_path(backup_dir, digest)
+
+        if os.path.exists(object_path):
+            os.remove(tmp_path)
+            return digest, 0
+
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(tmp_path, object_path)
+
+        return digest, os.path.getsize(object_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def backup_folder_incremental(source_folder, cfg, backup_dir=INCREMENTAL_BACKUP_DIR):
+    """
+    Create an incremental backup of a mail folder.
+    Every backup writes a manifest listing (path, size, mtime, digest) for
+    each file. Files whose size and mtime match the previous manifest are not
+    read at all; changed files are stored once, gzip-compressed, under their
+    SHA-256 digest. Identical contents are never stored twice, so a run where
+    little changed costs seconds and a few MB instead of a full ZIP.
+    Args:
+        source_folder (str): Path to the mail folder to be backed up.
+        cfg (dict): Configuration dictionary containing:
+            - "backup_zip_file_compr_level" (str or int): Compression level (0-9).
+        backup_dir (str, optional): The incremental backup directory.
+            Defaults to INCREMENTAL_BACKUP_DIR.
+    Returns:
+        tuple: A tuple containing:
+            - str: Path of the new manifest.
+            - int: Number of files whose contents were newly stored.
+            - int: Bytes added to the object store.
+    Raises:
+        OSError: If the backup directory cannot be written or the source folder is inaccessible.
+    """
+    compression_level = int( cfg["backup_zip_file_compr_level"] )
+    manifest_dir = os.path.join(backup_dir, MANIFEST_DIR_NAME)
+    os.makedirs(manifest_dir, exist_ok=True)
+
+    previous = {}
+    manifests = list_manifests(backup_dir)
+    if manifests:
+        previous = {entry["path"]: entry for entry in load_manifest(manifests[-1])["files"]}
+
+    files = []
+    stored_files = 0
+    stored_bytes = 0
+
+    for root, _, filenames in os.walk(source_folder):
+        for filename in filenames:
+            full_path = os.path.join(root, filename)
+            rel_path = os.path.relpath(full_path, source_folder).replace(os.sep, "/")
+            stat = os.stat(full_path)
+
+            old = previous.get(rel_path)
+            if (
+                old is not None
+                and old["size"] == stat.st_size
+                and old["mtime_ns"] == stat.st_mtime_ns
+                and os.path.exists(get_object_path(backup_dir, old["digest"]))
+            ):
+                digest = old["digest"]
+            else:
+                digest, new_bytes = store_object(full_path, backup_dir, compression_level)
+                if new_bytes:
+                    stored_files += 1
+                    stored_bytes += new_bytes
+
+            files.append({
+                "path": rel_path,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "digest": digest,
+            })
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H_%M_%S_%f")
+    manifest_path = os.path.join(manifest_dir, f"{timestamp}.json")
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "created": timestamp,
+                "source_folder": os.path.abspath(source_folder),
+                "files": files,
+            },
+            f,
+            indent=4
+        )
+
+    return manifest_path, stored_files, stored_bytes
+
+
+def restore_backup(manifest_path, target_folder, backup_dir=None):
+    """
+    Restore a mail folder as it was at the time of a backup.
+    Args:
+        manifest_path (str): Path of the manifest to restore, see list_manifests().
+        target_folder (str): Folder to restore into. Existing files with the
+            same names are overwritten; other files are left alone.
+        backup_dir (str, optional): The incremental backup directory. Defaults
+            to the directory the manifest is in.
+    Returns:
+        int: Number of files restored.
+    Raises:
+        ValueError: If a restored file does not match its digest.
+        FileNotFoundError: If an object of the backup is missing.
+    """
+    if backup_dir is None:
+        backup_dir = os.path.dirname(os.path.dirname(os.path.abspath(manifest_path)))
+
+    manifest = load_manifest(manifest_path)
+
+    for entry in manifest["files"]:
+        target_path = os.path.join(target_folder, *entry["path"].split("/"))
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+        hash_object = hashlib.sha256()
+
+        with gzip.open(get_object_path(backup_dir, entry["digest"]), "rb") as src, open(target_path, "wb") as dst:
+            while chunk := src.read(READ_CHUNK_SIZE):
+                hash_object.update(chunk)
+                dst.write(chunk)
+
+        if hash_object.hexdigest() != entry["digest"]:
+            raise ValueError(f"Restored file does not match the backup: {target_path}")
+
+        os.utime(target_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    return len(manifest["files"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Restore an incremental mail folder backup.")
+    parser.add_argument("manifest", nargs="?", help="Manifest to restore. Lists the backups if left out.")
+    parser.add_argument("target_folder", nargs="?", help="Folder to restore into.")
+    parser.add_argument("--backup-dir", default=INCREMENTAL_BACKUP_DIR, help="Incremental backup directory.")
+    args = parser.parse_args()
+
+    if not args.manifest:
+        for manifest_path in list_manifests(args.backup_dir):
+            print(manifest_path)
+        return
+
+    if not args.target_folder:
+        parser.error("target_folder is required to restore")
+
+    count = restore_backup(args.manifest, args.target_folder, args.backup_dir)
+    print(f"Restored {count} files into {args.target_folder}")
+
+
+if __name__ == "__main__":
+    main()
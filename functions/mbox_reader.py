@@ -0,0 +1,217 @@
+# functions/mbox_reader.py
+
+import mmap
+import os
+from collections import namedtuple
+
+# One message in an mbox file, as it is stored on disk.
+#   offset: Byte position of the message's "From " separator line.
+#   length: Number of bytes up to (not including) the next "From " line.
+#   data:   The raw bytes of the message, including the "From " line.
+RawMessage = namedtuple("RawMessage", ["offset", "length", "data"])
+
+FROM_LINE = b"From "
+FROM_LINE_SEPARATOR = b"\n" + FROM_LINE
+
+
+class MappedMbox:
+    """
+    Read-only memory mapping of an mbox file.
+    Use as a context manager. The mapping (buffer) supports find() and
+    slicing like bytes, so messages can be located with iter_message_ranges()
+    and hashed, parsed or copied as zero-copy memoryview slices, with one
+    mapping shared by all steps instead of reading the file repeatedly.
+    Empty files cannot be mapped; their buffer is b"".
+    Note:
+        - Close the mapping before the file is replaced. Windows does not
+          allow replacing a file that is mapped.
+        - Release all memoryviews of the buffer before closing.
+    """
+
+    def __init__(self, mbox_path):
+        """
+        Args:
+            mbox_path (str): Path to the mbox file to map.
+        Raises:
+            FileNotFoundError: If the mbox file does not exist.
+        """
+        self.mbox_path = mbox_path
+        self._file = open(mbox_path, "rb")
+
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+            self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        except Exception:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def iter_ranges(self, start_offset=0):
+        """
+        Iterate over the messages of the mapped file, see iter_message_ranges().
+        """
+        return iter_message_ranges(self.buffer, start_offset)
+
+    def view(self, offset, length):
+        """
+        Get a zero-copy view of part of the file.
+        Args:
+            offset (int): Start of the part.
+            length (int): Length of the part.
+        Returns:
+            memoryview: The bytes, without copying. Release it when done.
+        """
+        return memoryview(self.buffer)[offset:offset + length]
+
+    def close(self):
+        """
+        Close the mapping and the file.
+        """
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+        self._file.close()
+
+
+def iter_message_ranges(buffer, start_offset=0):
+    """
+    Find the messages in an mbox buffer.
+    Messages start at "From " lines (the same rule the mailbox module uses).
+    The boundaries are found with find() for "\\nFrom " over the whole buffer,
+    which runs at memory speed and copies nothing.
+    Args:
+        buffer (bytes): The mbox contents, typically MappedMbox.buffer.
+        start_offset (int, optional): Byte position to start from. It should
+            be the start of a "From " line, e.g. the end of the file at the
+            last run. Defaults to 0.
+    Yields:
+        tuple: (offset, length) of each message, including its "From " line.
+    Note:
+        - Any bytes before the first "From " line are not part of a message
+          and are skipped.
+        - Lines in message bodies starting with "From " are expected to be
+          escaped (">From "), as Thunderbird does.
+    """
+    size = len(buffer)
+
+    if buffer[start_offset:start_offset + len(FROM_LINE)] == FROM_LINE and (
+        start_offset == 0 or buffer[start_offset - 1] == 0x0A
+    ):
+        start = start_offset
+    else:
+        start = buffer.find(FROM_LINE_SEPARATOR, start_offset)
+        if start == -1:
+            return
+        start += 1
+
+    while True:
+        separator = buffer.find(FROM_LINE_SEPARATOR, start)
+
+        if separator == -1:
+            yield start, size - start
+            return
+
+        yield start, separator + 1 - start
+        start = separator + 1
+
+
+def iter_raw_messages(mbox_path, start_offset=0):
+    """
+    Stream the messages of an mbox file as raw byte ranges.
+    The file is memory-mapped and split with iter_message_ranges(). No
+    email.message.Message objects are built, and each message is copied out
+    of the mapping only when it is yielded, so only one message is held at a time.
+    Args:
+        mbox_path (str): Path to the mbox file to read.
+        start_offset (int, optional): Byte position to start reading from. It
+            should be the start of a "From " line, e.g. the end of the file at
+            the last run. Defaults to 0.
+    Yields:
+        RawMessage: A (offset, length, data) tuple for each message in the file.
+    Raises:
+        FileNotFoundError: If the mbox file does not exist.
+    """
+    with MappedMbox(mbox_path) as mapped:
+        for offset, length in mapped.iter_ranges(start_offset):
+            yield RawMessage(offset, length, mapped.buffer[offset:offset + length])
+
+
+def get_message_bounds(raw, start=0, end=None):
+    """
+    Find the message part of a raw mbox entry without copying it.
+    The message part is what mailbox.mbox hands back as the message itself:
+    the entry without its leading "From " separator line and without the
+    single blank line that separates it from the next entry.
+    Args:
+        raw (bytes): The raw bytes of one mbox entry, or a buffer that
+            contains it (anything that supports slicing and find(), such as
+            bytes or an mmap).
+        start (int, optional): Position of the entry in raw. Defaults to 0.
+        end (int, optional): End of the entry in raw. Defaults to len(raw).
+    Returns:
+        tuple: (start, end) positions of the headers and body in raw.
+    """
+    end = len(raw) if end is None else end
+
+    if raw[start:min(start + len(FROM_LINE), end)] == FROM_LINE:
+        newline = raw.find(b"\n", start, end)
+        start = newline + 1 if newline != -1 else end
+
+    if end - start >= 4 and raw[end - 4:end] == b"\r\n\r\n":
+        end -= 2
+    elif end - start >= 2 and raw[end - 2:end] == b"\n\n":
+        end -= 1
+
+    return start, end
+
+
+def get_header_bounds(raw, start=0, end=None):
+    """
+    Find the header block of a message without looking at its body.
+    The headers end at the first empty line. They are scanned line by line,
+    so the cost depends on the size of the headers, not of the message.
+    Args:
+        raw (bytes): A buffer that contains the message (bytes or an mmap).
+        start (int, optional): Start of the message headers in raw, e.g. from
+            get_message_bounds(). Defaults to 0.
+        end (int, optional): End of the message in raw. Defaults to len(raw).
+    Returns:
+        tuple: (start, end) positions of the headers in raw, including the
+               line break of the last header line but not the empty line.
+    """
+    end = len(raw) if end is None else end
+    line_start = start
+
+    while line_start < end:
+        if raw[line_start:line_start + 1] == b"\n" or raw[line_start:line_start + 2] == b"\r\n":
+            return start, line_start
+
+        newline = raw.find(b"\n", line_start, end)
+        if newline == -1:
+            break
+
+        line_start = newline + 1
+
+    return start, end
+
+
+def get_message_content(raw):
+    """
+    Return the message part of a raw mbox entry.
+    Drops the leading "From " separator line and the single blank line that
+    separates the message from the next one, see get_message_bounds().
+    Args:
+        raw (bytes): The raw bytes of one mbox entry.
+    Returns:
+        bytes: The headers and body of the message.
+    """
+    start, end = get_message_bounds(raw)
+    return raw[start:end]
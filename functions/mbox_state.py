@@ -0,0 +1,310 @@
+# functions/mbox_state.py
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from functions.mbox_reader import FROM_LINE
+
+STATE_DB_FILE = os.path.join("config", "mbox_state.sqlite")
+
+# How much of the start and end of a mailbox goes into its signature
+SIGNATURE_SAMPLE_SIZE = 64 * 1024  # 64 KB
+
+# Bump when the tables change. The store is only a cache, so an older
+# database is simply dropped and rebuilt on the next run.
+SCHEMA_VERSION = 5
+
+
+def get_head_tail_digest(mbox_path, size):
+    """
+    Compute a cheap digest of the first and last bytes of a file.
+    Only SIGNATURE_SAMPLE_SIZE bytes are read from each end, so the cost does
+    not depend on the size of the mailbox.
+    Args:
+        mbox_path (str): Path to the mailbox file.
+        size (int): Size of the part of the file to look at, in bytes.
+    Returns:
+        str: The hexadecimal MD5 digest of the head and tail of the file.
+    """
+    hash_object = hashlib.md5()
+
+    with open(mbox_path, "rb") as f:
+        hash_object.update(f.read(min(size, SIGNATURE_SAMPLE_SIZE)))
+
+        if size > SIGNATURE_SAMPLE_SIZE:
+            f.seek(max(SIGNATURE_SAMPLE_SIZE, size - SIGNATURE_SAMPLE_SIZE))
+            hash_object.update(f.read(size - f.tell()))
+
+    return hash_object.hexdigest()
+
+
+def get_mbox_signature(mbox_path):
+    """
+    Get the signature used to tell whether a mailbox changed since the last run.
+    Args:
+        mbox_path (str): Path to the mailbox file.
+    Returns:
+        tuple: (size, mtime_ns, digest), where digest is the head/tail digest
+               from get_head_tail_digest().
+    Raises:
+        OSError: If the file cannot be read.
+    """
+    stat = os.stat(mbox_path)
+    digest = get_head_tail_digest(mbox_path, stat.st_size)
+
+    return stat.st_size, stat.st_mtime_ns, digest
+
+
+class MboxStateStore:
+    """
+    Persistent record of the mailboxes that were cleanly deduplicated.
+    Stores the size, mtime and head/tail digest of each mailbox, keyed by its
+    path, in a small SQLite database. A mailbox whose size and mtime and
+    digest still match its record has not changed since the last run and
+    does not have to be read again.
+    The fingerprints of the messages in each mailbox are stored as well, so
+    a mailbox that has only grown (Thunderbird appends new mail) can be
+    resumed from where the last run stopped, see get_resume_point().
+    Messages that were never hashed, because no other message had their
+    length, are stored by offset and normalized length instead, see
+    get_unhashed().
+    The records are only valid for the dedup settings they were made with
+    (e.g. global or per-mailbox mode), so the store is cleared when the
+    settings change.
+    A store must be used from the thread that created it.
+    """
+
+    def __init__(self, db_path=STATE_DB_FILE, settings=None):
+        """
+        Open (and if needed create) the state database.
+        Args:
+            db_path (str, optional): Path to the SQLite file. Defaults to STATE_DB_FILE.
+            settings (dict, optional): The dedup settings of this run. If they
+                differ from the settings stored in the database, all records
+                are dropped. Defaults to no settings.
+        """
+        directory = os.path.dirname(db_path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(db_path)
+
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+        if version != SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS mbox_state")
+            self.connection.execute("DROP TABLE IF EXISTS mbox_fingerprints")
+            self.connection.execute("DROP TABLE IF EXISTS mbox_unhashed")
+            self.connection.execute("DROP TABLE IF EXISTS meta")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mbox_state (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mbox_fingerprints (
+                path TEXT NOT NULL,
+                fingerprint BLOB NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS mbox_fingerprints_path ON mbox_fingerprints (path)"
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mbox_unhashed (
+                path TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS mbox_unhashed_path ON mbox_unhashed (path)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+
+        settings_json = json.dumps(settings or {}, sort_keys=True)
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+
+        if row is None or row[0] != settings_json:
+            self.connection.execute("DELETE FROM mbox_state")
+            self.connection.execute("DELETE FROM mbox_fingerprints")
+            self.connection.execute("DELETE FROM mbox_unhashed")
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('settings', ?)",
+                (settings_json,)
+            )
+
+        self.connection.commit()
+
+    def get(self, mbox_path):
+        """
+        Get the recorded signature of a mailbox.
+        Args:
+            mbox_path (str): Path to the mailbox file.
+        Returns:
+            tuple or None: (size, mtime_ns, digest) from the last clean run,
+                           or None if the mailbox has no record.
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, digest FROM mbox_state WHERE path = ?",
+            (os.path.abspath(mbox_path),)
+        ).fetchone()
+
+        return tuple(row) if row else None
+
+    def is_unchanged(self, mbox_path):
+        """
+        Check whether a mailbox is unchanged since it was last recorded.
+        The size and mtime are compared first, the head/tail digest is only
+        computed if they match.
+        Args:
+            mbox_path (str): Path to the mailbox file.
+        Returns:
+            bool: True if the mailbox matches its record, False if it changed,
+                  has no record or cannot be read.
+        """
+        recorded = self.get(mbox_path)
+
+        if recorded is None:
+            return False
+
+        size, mtime_ns, digest = recorded
+
+        try:
+            stat = os.stat(mbox_path)
+
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                return False
+
+            return get_head_tail_digest(mbox_path, size) == digest
+        except OSError:
+            return False
+
+    def get_resume_point(self, mbox_path):
+        """
+        Check whether a mailbox has only been appended to since it was recorded.
+        That is the case if it has grown, the head/tail digest of the old part
+        still matches and a new message starts exactly where the old file
+        ended. Only the newly appended messages then have to be fingerprinted.
+        Args:
+            mbox_path (str): Path to the mailbox file.
+        Returns:
+            tuple or None: (offset, fingerprints) where offset is the old size
+                           of the mailbox and fingerprints is the set of the
+                           messages before it, or None if the whole mailbox
+                           has to be processed again.
+        """
+        recorded = self.get(mbox_path)
+
+        if recorded is None:
+            return None
+
+        size, _, digest = recorded
+
+        try:
+            if os.path.getsize(mbox_path) <= size or size == 0:
+                return None
+
+            if get_head_tail_digest(mbox_path, size) != digest:
+                return None
+
+            with open(mbox_path, "rb") as f:
+                f.seek(size)
+                if f.read(len(FROM_LINE)) != FROM_LINE:
+                    return None
+        except OSError:
+            return None
+
+        return size, self.get_fingerprints(mbox_path)
+
+    def get_fingerprints(self, mbox_path):
+        """
+        Get the stored fingerprints of the messages in a mailbox.
+        Args:
+            mbox_path (str): Path to the mailbox file.
+        Returns:
+            set: The fingerprints recorded for the mailbox.
+        """
+        rows = self.connection.execute(
+            "SELECT fingerprint FROM mbox_fingerprints WHERE path = ?",
+            (os.path.abspath(mbox_path),)
+        )
+
+        return {row[0] for row in rows}
+
+    def get_unhashed(self, mbox_path):
+        """
+        Get the messages of a mailbox that were kept without being hashed.
+        Args:
+            mbox_path (str): Path to the mailbox file.
+        Returns:
+            dict: {normalized_length: [offset, ...]} of those messages, see
+                  fingerprinting.get_raw_msg_normalized_length().
+        """
+        rows = self.connection.execute(
+            "SELECT offset, length FROM mbox_unhashed WHERE path = ? ORDER BY offset",
+            (os.path.abspath(mbox_path),)
+        )
+
+        unhashed = {}
+        for offset, length in rows:
+            unhashed.setdefault(length, []).append(offset)
+
+        return unhashed
+
+    def record(self, mbox_path, fingerprints=(), append=False, unhashed=()):
+        """
+        Record the current signature of a mailbox after a clean run.
+        Args:
+            mbox_path (str): Path to the mailbox file.
+            fingerprints (iterable, optional): Fingerprints of the messages
+                kept in the mailbox by this run.
+            append (bool, optional): If True, the run was resumed with
+                get_resume_point() and fingerprints are added to the stored
+                ones. Otherwise they replace them. Defaults to False.
+            unhashed (iterable, optional): (offset, normalized_length) of the
+                messages kept without a fingerprint. Added or replaced like
+                fingerprints.
+        """
+        path = os.path.abspath(mbox_path)
+        size, mtime_ns, digest = get_mbox_signature(mbox_path)
+
+        with self.connection:
+            if not append:
+                self.connection.execute("DELETE FROM mbox_fingerprints WHERE path = ?", (path,))
+                self.connection.execute("DELETE FROM mbox_unhashed WHERE path = ?", (path,))
+
+            self.connection.executemany(
+                "INSERT INTO mbox_fingerprints (path, fingerprint) VALUES (?, ?)",
+                ((path, fingerprint) for fingerprint in fingerprints)
+            )
+            self.connection.executemany(
+                "INSERT INTO mbox_unhashed (path, offset, length) VALUES (?, ?, ?)",
+                ((path, offset, length) for offset, length in unhashed)
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO mbox_state (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                (path, size, mtime_ns, digest)
+            )
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self.connection.close()
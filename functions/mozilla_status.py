@@ -0,0 +1,212 @@
+# functions/mozilla_status.py
+
+from functions.mbox_reader import get_header_bounds, get_message_bounds
+
+# Headers Thunderbird rewrites when a message is read, starred, tagged, ...
+STATUS_HEADERS = (b"x-mozilla-status", b"x-mozilla-status2", b"x-mozilla-keys")
+STATUS_HEADER = b"x-mozilla-status"
+KEYS_HEADER = b"x-mozilla-keys"
+
+# Flags of X-Mozilla-Status (nsMsgMessageFlags)
+MSG_FLAG_READ = 0x0001
+MSG_FLAG_REPLIED = 0x0002
+MSG_FLAG_MARKED = 0x0004     # Starred
+MSG_FLAG_EXPUNGED = 0x0008   # Deleted, removed at the next compaction
+MSG_FLAG_FORWARDED = 0x1000
+
+# A duplicate that was read, replied to, starred or forwarded passes that on to the kept copy
+MERGED_FLAGS = MSG_FLAG_READ | MSG_FLAG_REPLIED | MSG_FLAG_MARKED | MSG_FLAG_FORWARDED
+
+
+def iter_header_lines(raw, start, end):
+    """
+    Iterate over the headers of a header block, continuation lines included.
+    Args:
+        raw (bytes): A buffer that contains the headers (bytes or an mmap).
+        start (int): Start of the header block.
+        end (int): End of the header block, see mbox_reader.get_header_bounds().
+    Yields:
+        tuple: (name, line_start, line_end) with the lowercased header name
+               and the span of the header including its line breaks.
+    """
+    line_start = start
+    name = None
+    header_start = start
+
+    while line_start < end:
+        newline = raw.find(b"\n", line_start, end)
+        line_end = end if newline == -1 else newline + 1
+
+        if raw[line_start:line_start + 1] not in (b" ", b"\t") or name is None:
+            if name is not None:
+                yield name, header_start, line_start
+
+            colon = raw.find(b":", line_start, line_end)
+            name = raw[line_start:colon].strip().lower() if colon != -1 else b""
+            header_start = line_start
+
+        line_start = line_end
+
+    if name is not None:
+        yield name, header_start, end
+
+
+def get_status_spans(buffer, offset, length):
+    """
+    Find the Mozilla status headers of a message inside an mbox buffer.
+    Args:
+        buffer (bytes): The mbox contents (bytes or an mmap).
+        offset (int): Position of the message's "From " line in buffer.
+        length (int): Length of the raw mbox entry.
+    Returns:
+        list: (start, end) spans of the X-Mozilla-Status, X-Mozilla-Status2
+              and X-Mozilla-Keys header lines, in file order.
+    """
+    start, end = get_message_bounds(buffer, offset, offset + length)
+    start, end = get_header_bounds(buffer, start, end)
+
+    return [
+        (line_start, line_end)
+        for name, line_start, line_end in iter_header_lines(buffer, start, end)
+        if name in STATUS_HEADERS
+    ]
+
+
+def find_status_field(buffer, offset, length):
+    """
+    Find the X-Mozilla-Status value of a message inside an mbox buffer.
+    The value is always four hex digits, so it can be changed in place
+    without moving any other byte of the mailbox.
+    Args:
+        buffer (bytes): The mbox contents (bytes or an mmap).
+        offset (int): Position of the message's "From " line in buffer.
+        length (int): Length of the raw mbox entry.
+    Returns:
+        tuple or None: (position, flags) with the position of the four hex
+            digits in buffer and their value, or None if the message has no
+            well-formed X-Mozilla-Status header.
+    """
+    start, end = get_message_bounds(buffer, offset, offset + length)
+    start, end = get_header_bounds(buffer, start, end)
+
+    for name, line_start, line_end in iter_header_lines(buffer, start, end):
+        if name != STATUS_HEADER:
+            continue
+
+        position = buffer.find(b":", line_start, line_end) + 1
+        while buffer[position:position + 1] in (b" ", b"\t"):
+            position += 1
+
+        digits = buffer[position:position + 4]
+        after = buffer[position + 4:position + 5]
+
+        if len(digits) == 4 and after in (b"\r", b"\n") and all(c in b"0123456789abcdefABCDEF" for c in digits):
+            return position, int(digits, 16)
+
+        return None
+
+    return None
+
+
+def merge_status(kept_flags, duplicate_flags):
+    """
+    Merge the X-Mozilla-Status flags of duplicates into those of the kept copy.
+    Read, replied, starred and forwarded are kept if any copy has them. The
+    kept copy is only left expunged if every copy was expunged, so a live
+    duplicate is never lost to a copy Thunderbird is about to delete.
+    Args:
+        kept_flags (int): Flags of the kept copy.
+        duplicate_flags (iterable): Flags of the deleted copies.
+    Returns:
+        int: The merged flags for the kept copy.
+    """
+    merged = kept_flags
+
+    for flags in duplicate_flags:
+        merged |= flags & MERGED_FLAGS
+
+        if not flags & MSG_FLAG_EXPUNGED:
+            merged &= ~MSG_FLAG_EXPUNGED
+
+    return merged
+
+
+def format_status(flags):
+    """
+    Format X-Mozilla-Status flags the way Thunderbird writes them.
+    Args:
+        flags (int): The flags.
+    Returns:
+        bytes: Four lowercase hex digits, to replace the ones find_status_field() found.
+    """
+    return b"%04x" % flags
+
+
+def find_keys_field(buffer, offset, length):
+    """
+    Find the X-Mozilla-Keys value (the tags) of a message inside an mbox buffer.
+    Thunderbird pads the header line with spaces, so tags can be added in place
+    as long as they fit into the padding.
+    Args:
+        buffer (bytes): The mbox contents (bytes or an mmap).
+        offset (int): Position of the message's "From " line in buffer.
+        length (int): Length of the raw mbox entry.
+    Returns:
+        tuple or None: (position, size, keys) with the span of the value on
+            the first header line (from after the colon to the line break),
+            and the tags it holds, in order. None if the message has no
+            X-Mozilla-Keys header.
+    """
+    start, end = get_message_bounds(buffer, offset, offset + length)
+    start, end = get_header_bounds(buffer, start, end)
+
+    for name, line_start, line_end in iter_header_lines(buffer, start, end):
+        if name != KEYS_HEADER:
+            continue
+
+        position = buffer.find(b":", line_start, line_end) + 1
+        value_end = buffer.find(b"\n", position, line_end)
+        value_end = line_end if value_end == -1 else value_end
+
+        if buffer[value_end - 1:value_end] == b"\r":
+            value_end -= 1
+
+        return position, value_end - position, bytes(buffer[position:value_end]).split()
+
+    return None
+
+
+def merge_keys(kept_keys, duplicate_keys):
+    """
+    Merge the tags of duplicates into those of the kept copy.
+    Args:
+        kept_keys (list): Tags of the kept copy.
+        duplicate_keys (iterable): Tag lists of the deleted copies.
+    Returns:
+        list: The tags of the kept copy followed by the new tags of the
+              duplicates, each once, in the order they were found.
+    """
+    merged = list(kept_keys)
+
+    for keys in duplicate_keys:
+        merged.extend(key for key in keys if key not in merged)
+
+    return merged
+
+
+def format_keys(keys, size):
+    """
+    Format tags to replace an X-Mozilla-Keys value of a given size.
+    Args:
+        keys (list): The tags.
+        size (int): Size of the value, see find_keys_field().
+    Returns:
+        bytes or None: The value padded with spaces to size, or None if the
+            tags do not fit.
+    """
+    value = b" " + b" ".join(keys)
+
+    if len(value) > size:
+        return None
+
+    return value.ljust(size)
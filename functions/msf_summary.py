@@ -0,0 +1,86 @@
+# functions/msf_summary.py
+
+import logging
+import os
+
+MSF_SUFFIX = ".msf"
+
+# What to do with the .msf index of a mailbox that has been rewritten
+MSF_HANDLING_MODES = ("delete", "keep")
+
+
+def get_msf_path(mbox_path):
+    """
+    Get the path of the Thunderbird summary (Mork index) of a mailbox.
+    Args:
+        mbox_path (str): Path of the mailbox file.
+    Returns:
+        str: "<mbox_path>.msf", whether it exists or not.
+    """
+    return mbox_path + MSF_SUFFIX
+
+
+def invalidate_msf(mbox_path):
+    """
+    Delete the .msf index of a mailbox that has been rewritten.
+    The index stores the byte offset of every message, so after duplicates
+    are removed it points into the wrong places. Thunderbird usually notices
+    that the mailbox has changed and rebuilds the index, but a deleted index
+    is always rebuilt cleanly on the next open and can never be used stale.
+    Args:
+        mbox_path (str): Path of the mailbox file.
+    Returns:
+        bool: True if an index was deleted, False if there was none.
+    """
+    msf_path = get_msf_path(mbox_path)
+
+    try:
+        os.remove(msf_path)
+    except FileNotFoundError:
+        return False
+
+    logging.debug(f"Deleted stale summary {msf_path}")
+
+    return True
+
+
+def needs_reindex(mbox_path):
+    """
+    Check whether Thunderbird will rebuild the index of a mailbox on the next open.
+    Args:
+        mbox_path (str): Path of the mailbox file.
+    Returns:
+        bool: True if the .msf index is missing or older than the mailbox.
+    """
+    try:
+        msf_mtime = os.stat(get_msf_path(mbox_path)).st_mtime_ns
+    except FileNotFoundError:
+        return True
+
+    return msf_mtime < os.stat(mbox_path).st_mtime_ns
+
+
+def get_reindex_cost(mbox_paths):
+    """
+    List the mailboxes whose index Thunderbird will rebuild, biggest first.
+    Rebuilding an index means reading the whole mailbox, so its cost grows
+    with the mailbox size. Opening one of these folders blocks Thunderbird
+    until its index is rebuilt.
+    Args:
+        mbox_paths (iterable): Paths of the mailbox files, e.g. the rewritten ones.
+    Returns:
+        list: (mbox_path, size) tuples of the mailboxes that need a reindex,
+              sorted by size, biggest first. Missing mailboxes are left out.
+    """
+    cost = []
+
+    for mbox_path in mbox_paths:
+        try:
+            if needs_reindex(mbox_path):
+                cost.append((mbox_path, os.path.getsize(mbox_path)))
+        except FileNotFoundError:
+            continue
+
+    cost.sort(key=lambda item: item[1], reverse=True)
+
+    return cost
@@ -0,0 +1,382 @@
+# functions/parallel_zip.py
+
+import bz2
+import lzma
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Files are compressed in blocks of this size, one block per task
+BLOCK_SIZE = 4 * 1024 * 1024  # 4 MB
+
+# Each block is primed with the last bytes of the block before it, so
+# splitting a file into blocks costs almost no compression
+DICT_SIZE = 32 * 1024  # 32 KB, the deflate window
+
+ZIP64_LIMIT = (1 << 31) - 1
+
+# Compression methods, numbered as in the ZIP format (and zipfile)
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP_BZIP2 = 12
+ZIP_LZMA = 14
+
+ZIP_METHODS = {
+    "stored": ZIP_STORED,
+    "deflate": ZIP_DEFLATED,
+    "bzip2": ZIP_BZIP2,  # Smaller but slower, for cold archives
+    "lzma": ZIP_LZMA,    # Smallest and slowest, for cold archives
+}
+
+# Version needed to extract each method
+ZIP_METHOD_VERSIONS = {ZIP_STORED: 20, ZIP_DEFLATED: 20, ZIP_BZIP2: 46, ZIP_LZMA: 63}
+
+# Adaptive compression: how a file is sampled and when compressing is not worth it
+SAMPLE_SIZE = 128 * 1024     # Bytes from the start of the file that are test-compressed
+TINY_FILE_SIZE = 1024        # Smaller files are stored; there is nothing to win
+STORE_RATIO = 0.95           # Sample ratio above which the file is stored
+FAST_RATIO = 0.8             # Sample ratio above which the fastest level is used
+COMPRESSED_EXTENSIONS = {
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp3", ".mp4", ".mkv", ".pdf",
+}
+
+LOCAL_HEADER = struct.Struct("<4sHHHHHLLLHH")
+CENTRAL_HEADER = struct.Struct("<4sHHHHHHLLLHHHHHLL")
+END_RECORD = struct.Struct("<4sHHHHLLH")
+ZIP64_END_RECORD = struct.Struct("<4sQHHLLQQQQ")
+ZIP64_END_LOCATOR = struct.Struct("<4sLQL")
+
+
+def compress_block(block, level, zdict, last):
+    """
+    Compress one block of a file as part of a raw deflate stream.
+    Blocks that are not the last end with a sync flush instead of a final
+    block, so the compressed blocks of a file can simply be concatenated
+    into one valid deflate stream (the same trick pigz uses).
+    Runs in a worker thread; zlib releases the GIL while it compresses.
+    Args:
+        block (bytes): The data to compress.
+        level (int): Compression level (0-9).
+        zdict (bytes): The end of the previous block, used as preset
+            dictionary. Empty for the first block.
+        last (bool): True for the last block of the file.
+    Returns:
+        bytes: The compressed block.
+    """
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    data = compressor.compress(block)
+    data += compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    return data
+
+
+def choose_compression(full_path, size, method=ZIP_DEFLATED, level=6):
+    """
+    Choose how to compress a file, based on a sample of its content.
+    The first SAMPLE_SIZE bytes are compressed with the fastest deflate
+    level, which costs a fraction of compressing the whole file:
+        - Tiny files, known compressed formats and files whose sample barely
+          shrinks (attachment-heavy mailboxes, images) are stored as they are.
+        - Files whose sample shrinks only a little get the fastest level.
+        - Everything else, like text mailboxes, gets the configured method and level.
+    Args:
+        full_path (str): Path of the file.
+        size (int): Size of the file in bytes.
+        method (int, optional): Configured method, one of ZIP_METHODS. Defaults to ZIP_DEFLATED.
+        level (int, optional): Configured compression level (0-9). Defaults to 6.
+    Returns:
+        tuple: (method, level) to use for this file.
+    """
+    if method == ZIP_STORED or size < TINY_FILE_SIZE:
+        return ZIP_STORED, 0
+
+    if os.path.splitext(full_path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return ZIP_STORED, 0
+
+    with open(full_path, "rb") as f:
+        sample = f.read(SAMPLE_SIZE)
+
+    if not sample:
+        return ZIP_STORED, 0
+
+    ratio = len(zlib.compress(sample, 1)) / len(sample)
+
+    if ratio > STORE_RATIO:
+        return ZIP_STORED, 0
+
+    if ratio > FAST_RATIO:
+        return method, 1
+
+    return method, level
+
+
+def new_stream_compressor(method, level):
+    """
+    Create a compressor for the methods that are not split into blocks.
+    Args:
+        method (int): ZIP_BZIP2 or ZIP_LZMA.
+        level (int): Compression level (0-9).
+    Returns:
+        tuple: (header, compressor). header is written before the compressed
+               data, compressor has compress() and flush() methods.
+    """
+    if method == ZIP_BZIP2:
+        return b"", bz2.BZ2Compressor(max(level, 1))
+
+    # ZIP stores LZMA as a small header with the filter properties, then a raw
+    # LZMA1 stream; the same layout zipfile writes
+    props = lzma._encode_filter_properties({"id": lzma.FILTER_LZMA1, "preset": level})
+    filters = [lzma._decode_filter_properties(lzma.FILTER_LZMA1, props)]
+    header = struct.pack("<BBH", 9, 4, len(props)) + props
+
+    return header, lzma.LZMACompressor(lzma.FORMAT_RAW, filters=filters)
+
+
+def get_dos_date_time(mtime):
+    """
+    Convert a timestamp to the DOS date and time used in ZIP headers.
+    Args:
+        mtime (float): Seconds since the epoch.
+    Returns:
+        tuple: (dos_time, dos_date). Dates before 1980 are stored as 1980-01-01.
+    """
+    t = time.localtime(mtime)
+
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+    return dos_time, dos_date
+
+
+class ParallelZipWriter:
+    """
+    Write a standard ZIP archive, compressing with several threads at once.
+    Each file is read in BLOCK_SIZE blocks that are deflated in a thread
+    pool while the next blocks are read, and the compressed blocks are
+    streamed into the archive in order as soon as they are done. Throughput
+    therefore scales with the number of cores, also for a single huge
+    mailbox, and memory use is bounded by the blocks in flight.
+    The archive is a normal ZIP file (deflate, ZIP64 where needed) that
+    zipfile and any unzip tool can read.
+    BZIP2 and LZMA can be chosen for cold archives. They compress better, but
+    each file is compressed as one stream, so they use only one thread.
+    """
+
+    def __init__(self, zip_path, level=6, workers=None, method=ZIP_DEFLATED, adaptive=False):
+        """
+        Create the archive.
+        Args:
+            zip_path (str): Path of the ZIP file to create.
+            level (int, optional): Compression level (0-9). Defaults to 6.
+            workers (int, optional): Number of compression threads.
+                Defaults to the number of CPUs.
+            method (int, optional): Compression method, one of ZIP_METHODS.
+                Defaults to ZIP_DEFLATED.
+            adaptive (bool, optional): If True, choose the method and level per
+                file with choose_compression(), so files that do not compress
+                are stored instead of deflated for nothing. Defaults to False.
+        """
+        self.level = level
+        self.method = method
+        self.adaptive = adaptive
+        self.workers = workers or os.cpu_count() or 1
+        self.fp = open(zip_path, "wb")
+        self.entries = []
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(cancel_futures=True)
+            self.fp.close()
+
+    def write(self, full_path, arcname):
+        """
+        Compress a file into the archive.
+        Args:
+            full_path (str): Path of the file to add.
+            arcname (str): Name of the file inside the archive.
+        """
+        stat = os.stat(full_path)
+        name = arcname.replace(os.sep, "/").encode("utf-8")
+        flags = 0x800 if not name.isascii() else 0  # UTF-8 file name
+
+        if self.adaptive:
+            method, level = choose_compression(full_path, stat.st_size, self.method, self.level)
+        else:
+            method, level = self.method, self.level
+
+        if method == ZIP_LZMA:
+            flags |= 0x02  # The LZMA stream has an end marker
+        zip64 = stat.st_size > ZIP64_LIMIT * 0.95  # Compressed data may be a bit bigger
+        dos_time, dos_date = get_dos_date_time(stat.st_mtime)
+
+        header_offset = self.fp.tell()
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0) if zip64 else b""
+        self.fp.write(self._local_header(method, flags, dos_time, dos_date, 0, 0, 0, name, extra, zip64))
+
+        if method == ZIP_DEFLATED:
+            crc, file_size, compress_size = self._write_compressed(full_path, level)
+        else:
+            crc, file_size, compress_size = self._write_stream(full_path, method, level)
+
+        # Go back and fill in the CRC and sizes
+        end = self.fp.tell()
+        self.fp.seek(header_offset)
+        if zip64:
+            extra = struct.pack("<HHQQ", 1, 16, file_size, compress_size)
+        self.fp.write(self._local_header(method, flags, dos_time, dos_date, crc, compress_size, file_size, name, extra, zip64))
+        self.fp.seek(end)
+
+        self.entries.append((name, method, flags, dos_time, dos_date, crc, compress_size, file_size, header_offset))
+
+    def _local_header(self, method, flags, dos_time, dos_date, crc, compress_size, file_size, name, extra, zip64):
+        return LOCAL_HEADER.pack(
+            b"PK\x03\x04",
+            max(ZIP_METHOD_VERSIONS[method], 45 if zip64 else 20),
+            flags,
+            method,
+            dos_time,
+            dos_date,
+            crc,
+            0xFFFFFFFF if zip64 else compress_size,
+            0xFFFFFFFF if zip64 else file_size,
+            len(name),
+            len(extra)
+        ) + name + extra
+
+    def _write_compressed(self, full_path, level):
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        pending = deque()
+        zdict = b""
+
+        def write_done(wait_for_all):
+            nonlocal compress_size
+            while pending and (wait_for_all or len(pending) > self.workers * 2 or pending[0].done()):
+                data = pending.popleft().result()
+                self.fp.write(data)
+                compress_size += len(data)
+
+        with open(full_path, "rb") as f:
+            block = f.read(BLOCK_SIZE)
+
+            while True:
+                next_block = f.read(BLOCK_SIZE) if block else b""
+                last = not next_block
+
+                crc = zlib.crc32(block, crc)
+                file_size += len(block)
+                pending.append(self._executor.submit(compress_block, block, level, zdict, last))
+                zdict = block[-DICT_SIZE:]
+
+                write_done(wait_for_all=False)
+
+                if last:
+                    break
+
+                block = next_block
+
+        write_done(wait_for_all=True)
+
+        return crc, file_size, compress_size
+
+    def _write_stream(self, full_path, method, level):
+        crc = 0
+        file_size = 0
+        header, compressor = b"", None
+
+        if method != ZIP_STORED:
+            header, compressor = new_stream_compressor(method, level)
+
+        start = self.fp.tell()
+        self.fp.write(header)
+
+        with open(full_path, "rb") as f:
+            while block := f.read(BLOCK_SIZE):
+                crc = zlib.crc32(block, crc)
+                file_size += len(block)
+                self.fp.write(compressor.compress(block) if compressor else block)
+
+        if compressor:
+            self.fp.write(compressor.flush())
+
+        return crc, file_size, self.fp.tell() - start
+
+    def close(self):
+        """
+        Write the central directory and close the archive.
+        """
+        self._executor.shutdown()
+
+        central_dir_offset = self.fp.tell()
+
+        for name, method, flags, dos_time, dos_date, crc, compress_size, file_size, header_offset in self.entries:
+            zip64_fields = []
+            if file_size > ZIP64_LIMIT:
+                zip64_fields.append(file_size)
+            if compress_size > ZIP64_LIMIT:
+                zip64_fields.append(compress_size)
+            if header_offset > ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+
+            extra = b""
+            if zip64_fields:
+                extra = struct.pack(f"<HH{len(zip64_fields)}Q", 1, 8 * len(zip64_fields), *zip64_fields)
+
+            version = max(ZIP_METHOD_VERSIONS[method], 45 if zip64_fields else 20)
+
+            self.fp.write(CENTRAL_HEADER.pack(
+                b"PK\x01\x02",
+                version,  # Made by (MS-DOS)
+                version,  # Needed to extract
+                flags,
+                method,
+                dos_time,
+                dos_date,
+                crc,
+                0xFFFFFFFF if compress_size > ZIP64_LIMIT else compress_size,
+                0xFFFFFFFF if file_size > ZIP64_LIMIT else file_size,
+                len(name),
+                len(extra),
+                0,  # Comment length
+                0,  # Disk number
+                0,  # Internal attributes
+                0,  # External attributes
+                0xFFFFFFFF if header_offset > ZIP64_LIMIT else header_offset
+            ) + name + extra)
+
+        central_dir_end = self.fp.tell()
+        central_dir_size = central_dir_end - central_dir_offset
+        count = len(self.entries)
+
+        if count >= 0xFFFF or central_dir_offset > ZIP64_LIMIT or central_dir_size > ZIP64_LIMIT:
+            self.fp.write(ZIP64_END_RECORD.pack(
+                b"PK\x06\x06", ZIP64_END_RECORD.size - 12, 45, 45, 0, 0,
+                count, count, central_dir_size, central_dir_offset
+            ))
+            self.fp.write(ZIP64_END_LOCATOR.pack(b"PK\x06\x07", 0, central_dir_end, 1))
+            count = min(count, 0xFFFF)
+            central_dir_size = min(central_dir_size, 0xFFFFFFFF)
+            central_dir_offset = min(central_dir_offset, 0xFFFFFFFF)
+
+        self.fp.write(END_RECORD.pack(
+            b"PK\x05\x06", 0, 0, count, count, central_dir_size, central_dir_offset, 0
+        ))
+        self.fp.close()
@@ -1,12 +1,15 @@
 # functions/parser.py
 
-import mailbox
+import email
+from email.parser import BytesHeaderParser
+
+from functions.mbox_reader import MappedMbox, get_header_bounds, get_message_bounds
 
 
 def get_messages_from_mbox(mbox_path):
     """
     Extract messages from an mbox file and return their key information.
-    This function reads an mbox mailbox file and parses each message to extract
+    This function memory-maps an mbox mailbox file and parses each message to extract
     relevant metadata and content. It handles both simple and multipart email
     messages, gracefully handling encoding errors.
     Args:
@@ -22,37 +25,73 @@ def get_messages_from_mbox(mbox_path):
         - Encoding errors are ignored during decoding, with empty strings used as fallback.
         - If a message cannot be decoded, an empty string is used for the body.
     """
-    mbox = mailbox.mbox(mbox_path)
     messages = []
 
-    for msg in mbox:
-        # Extract headers
-        subject = msg.get('subject', '')
-        sender = msg.get('from', '')
-        date = msg.get('date', '')
-
-        # Extract body
-        body = ''
-        
-        if msg.is_multipart():
-            # For multipart messages, concatenate the text parts
-            for part in msg.walk():
-                if part.get_content_type() == 'text/plain':
-                    try:
-                        body += part.get_payload(decode=True).decode(errors='ignore')
-                    except:
-                        continue
-        else:
-            try:
-                body = msg.get_payload(decode=True).decode(errors='ignore')
-            except:
-                body = ''
-
-        messages.append({
-            'subject': subject,
-            'from': sender,
-            'date': date,
-            'body': body
-        })
-    
+    with MappedMbox(mbox_path) as mapped:
+        for offset, length in mapped.iter_ranges():
+            start, end = get_message_bounds(mapped.buffer, offset, offset + length)
+            messages.append(get_message_info(email.message_from_bytes(mapped.buffer[start:end])))
+
     return messages
+
+
+def iter_message_headers(mbox_path):
+    """
+    Parse only the headers of the messages in an mbox file.
+    For each message just the header block, up to the first empty line, is
+    parsed with BytesHeaderParser; the body bytes are never touched. Use this
+    when only headers are needed, e.g. for header-based fingerprints.
+    Header values are the same as those of a full parse with mailbox.mbox.
+    Args:
+        mbox_path (str): The file path to the mbox mailbox file to parse.
+    Yields:
+        email.message.Message: The headers of each message, with an empty body.
+    Raises:
+        FileNotFoundError: If the mbox file does not exist.
+    """
+    parser = BytesHeaderParser()
+
+    with MappedMbox(mbox_path) as mapped:
+        for offset, length in mapped.iter_ranges():
+            start, end = get_message_bounds(mapped.buffer, offset, offset + length)
+            start, end = get_header_bounds(mapped.buffer, start, end)
+            yield parser.parsebytes(mapped.buffer[start:end])
+
+
+def get_message_info(msg):
+    """
+    Extract the key information of one parsed message.
+    Args:
+        msg (email.message.Message): The parsed message.
+    Returns:
+        dict: The 'subject', 'from', 'date' and 'body' of the message, see
+              get_messages_from_mbox().
+    """
+    # Extract headers
+    subject = msg.get('subject', '')
+    sender = msg.get('from', '')
+    date = msg.get('date', '')
+
+    # Extract body
+    body = ''
+    
+    if msg.is_multipart():
+        # For multipart messages, concatenate the text parts
+        for part in msg.walk():
+            if part.get_content_type() == 'text/plain':
+                try:
+                    body += part.get_payload(decode=True).decode(errors='ignore')
+                except:
+                    continue
+    else:
+        try:
+            body = msg.get_payload(decode=True).decode(errors='ignore')
+        except:
+            body = ''
+
+    return {
+        'subject': subject,
+        'from': sender,
+        'date': date,
+        'body': body
+    }
@@ -1,55 +1,235 @@
 # functions/process_1_mbox.py
 
-import mailbox
 import logging
 
-from functions.fingerprinting import get_one_msg_fingerprint_strict, get_one_msg_fingerprint_with_body
-from functions.replace_mbox_file import write_mbox_file
+from functions.fingerprinting import (
+    get_raw_msg_fingerprint_canonical,
+    get_raw_msg_fingerprint_strict,
+    get_raw_msg_header_key,
+    get_raw_msg_normalized_length,
+)
+from functions.hashing import DEFAULT_HASH
+from functions.mbox_reader import MappedMbox
+from functions.mozilla_status import (
+    MSG_FLAG_EXPUNGED,
+    find_keys_field,
+    find_status_field,
+    format_keys,
+    format_status,
+    merge_keys,
+    merge_status,
+)
+from functions.replace_mbox_file import compact_mbox_ranges, resume_compaction, write_mbox_ranges
 
 
-def process_one_mbox(mbox_path):
+def process_one_mbox(mbox_path, seen=None, start_offset=0, collect_fingerprints=False, hash_name=DEFAULT_HASH,
+                     before_rewrite=None, tiered=False, in_place=False, ignore_status=False,
+                     canonical=False, unhashed=None):
     """
     Process an mbox file to identify and remove duplicate messages.
-    Reads all messages from the specified mbox file, compares them using a strict
-    fingerprinting method to detect duplicates, and removes any duplicate entries.
+    Works in two passes so the mailbox is never held in memory:
+        1. Memory-map the file, find the messages and hash them in place,
+           recording only the fingerprint of each message and the
+           (offset, length) range of every message to keep.
+        2. If duplicates were found, copy the kept byte ranges into a new file
+           that atomically replaces the original, or with in_place, move
+           them down inside the original file.
+    When the mailbox is processed on its own (no seen, start_offset or
+    canonical), messages are first bucketed by their length, and only
+    messages that share a length are hashed at all, see
+    find_duplicates_pruned(). With collect_fingerprints, the messages that
+    were not hashed are returned by length instead, so a resumed run can
+    still tell whether an appended message may be a copy of one of them.
+    Peak memory is bounded by the fingerprint table, not by the mailbox size,
+    and kept messages are written back byte-for-byte.
     The mbox file is only rewritten if duplicates were found and removed.
     Args:
         mbox_path (str): Path to the mbox file to process.
+        seen (set, optional): Fingerprints of the messages before start_offset,
+            from an earlier run. Defaults to an empty set.
+        start_offset (int, optional): Resume point for a mailbox that has only
+            been appended to since the last run. Messages before this offset
+            are not read again; they are kept as they are and only the newly
+            appended messages are checked against seen. Defaults to 0.
+        collect_fingerprints (bool, optional): If True, return the fingerprints
+            of the messages kept in this run so they can be stored for the
+            next run. Defaults to False.
+        unhashed (dict, optional): {normalized_length: [offset, ...]} of the
+            messages before start_offset that have no fingerprint in seen,
+            see MboxStateStore.get_unhashed(). An appended message with one
+            of these lengths gets the old messages hashed and added to seen
+            first. Defaults to none.
+        hash_name (str, optional): Hash backend for the fingerprints, see
+            hashing.get_hash_backends(). Fingerprints are kept as raw digest
+            bytes. Defaults to "md5".
+        before_rewrite (callable, optional): Called as before_rewrite(mbox_path)
+            right before the mailbox is rewritten, and only then, e.g. to back
+            up just the mailboxes that change. If it raises, the mailbox is
+            left untouched. Must be picklable when used with a process pool.
+        tiered (bool, optional): If True, messages are first grouped by a key
+            of their headers (get_raw_msg_header_key) and only messages that
+            share a key are measured and hashed in full. The result is the
+            same as in strict mode, but messages whose headers no other
+            message shares are never read past their headers. Cannot be combined with seen, start_offset, canonical or
+            collect_fingerprints. Defaults to False.
+        in_place (bool, optional): If True, the mailbox is compacted in place
+            with compact_mbox_ranges() instead of being copied to a temp
+            file, so no extra disk space is needed. An interrupted in-place
+            compaction of this mailbox is always finished first, whatever
+            this flag is. Defaults to False.
+        ignore_status (bool, optional): If True, fingerprints leave out the
+            X-Mozilla-Status, X-Mozilla-Status2 and X-Mozilla-Keys headers,
+            so copies that only differ in read/starred flags or tags are
+            duplicates too. The first copy is still the one kept, and the
+            flags and tags of its duplicates in this mailbox are merged into
+            it in the rewritten mailbox, see mozilla_status.merge_status()
+            and get_keys_patches(); the original is never patched. Duplicates of messages kept in an
+            earlier run or another mailbox (seen) are deleted without a
+            merge. A kept copy that Thunderbird has marked as deleted
+            (expunged) is not added to seen or the returned fingerprints,
+            so it never makes a live copy elsewhere a duplicate.
+            Defaults to False.
+        canonical (bool, optional): If True, messages are compared by their
+            canonical fingerprint (get_raw_msg_fingerprint_canonical), so
+            copies that were re-encoded or refolded are duplicates too.
+            Re-encoded copies differ in length and headers, so every message
+            is hashed; cannot be combined with tiered. The status headers are
+            not part of the canonical fingerprint, so flags are merged and
+            expunged copies handled as with ignore_status. Defaults to False.
     Returns:
         tuple: A tuple containing:
-            - None: Reserved for potential future use.
-            - str: A message describing the action taken. Empty string if no 
-              duplicates were found, otherwise a message indicating the number 
+            - tuple or None: If collect_fingerprints is True, (fingerprints,
+              unhashed) for the messages read and kept in this run:
+              fingerprints of the ones that were hashed, and
+              (offset, normalized_length) of the ones that were not, with
+              offsets in the mailbox as written. Otherwise None.
+            - str: A message describing the action taken. Empty string if no
+              duplicates were found, otherwise a message indicating the number
               of duplicates deleted.
             - int: The count of duplicate messages that were deleted.
     Side Effects:
         - Logs an info-level message if duplicates were deleted.
         - Overwrites the mbox file if duplicates were removed.
+    Raises:
+        ValueError: If tiered is combined with seen, start_offset, collect_fingerprints or canonical.
     """
     logger = logging.getLogger(__name__)
 
-    # --- Read all messages first (important!)
-    mbox = mailbox.mbox(mbox_path)
-    messages = list(mbox)
-    mbox.close()
+    # Without outside fingerprints to compare against, unique messages need no hash
+    # Canonical fingerprints cannot be bucketed by length: re-encoded copies differ in length
+    pruned = seen is None and not start_offset and not canonical
 
-    seen = set()
-    kept_messages = []
-    deleted_count = 0
+    if tiered and (not pruned or collect_fingerprints):
+        raise ValueError("Tiered dedup cannot be combined with seen, start_offset, collect_fingerprints or canonical")
+
+    if resume_compaction(mbox_path):
+        logger.warning("Finished an interrupted compaction of mbox %s", mbox_path)
+
+    # Canonical fingerprints leave out the status headers too, so copies with other flags match
+    merge_flags = ignore_status or canonical
 
-    for message in messages:
-        # fingerprint = get_one_msg_fingerprint_with_body(message)
-        fingerprint = get_one_msg_fingerprint_strict(message)
+    seen = set() if seen is None else seen
+    kept_ranges = [(0, start_offset)] if start_offset > 0 else []
+    kept_fingerprints = [] if collect_fingerprints else None
+    kept_unhashed = []
+    unhashed = dict(unhashed or {})
+    deleted_count = 0
+    duplicate_of = {}  # Range of a duplicate -> range of the copy kept in this run
+    status_patches = {}
+    patches = {}  # {position: bytes} written over the kept copies in the rewritten mailbox
 
-        if fingerprint not in seen:
-            seen.add(fingerprint)
-            kept_messages.append(message)
+    # --- Pass one: fingerprint every message, remember only what to keep
+    with MappedMbox(mbox_path) as mapped:
+        if pruned:
+            ranges, deleted, lengths, hashed = find_duplicates_pruned(
+                mapped, hash_name, header_key=tiered, ignore_status=ignore_status
+            )
+            kept_indexes = [i for i in range(len(ranges)) if i not in deleted]
+            kept_ranges = [ranges[i] for i in kept_indexes]
+            deleted_count = len(deleted)
+            duplicate_of = {ranges[i]: ranges[kept] for i, kept in deleted.items()}
         else:
-            deleted_count += 1
+            kept_at = {}          # Fingerprint -> range of the copy kept in this run, when merging flags
+            kept_expunged = set() # Kept copies Thunderbird will purge, unless a live duplicate is merged in
+            part_cache = {}
+
+            def remember(fingerprint):
+                seen.add(fingerprint)
+
+                if collect_fingerprints:
+                    kept_fingerprints.append(fingerprint)
+
+            def hash_old_messages(normalized_length):
+                # Messages before start_offset with this length were never hashed
+                for old_offset in unhashed.pop(normalized_length, ()):
+                    old_range = next(mapped.iter_ranges(old_offset), None)
+
+                    if old_range is not None and old_range[0] == old_offset:
+                        remember(get_raw_msg_fingerprint_strict(
+                            mapped.buffer, *old_range, hash_name, hex_digest=False, ignore_status=ignore_status
+                        ))
+
+            for offset, length in mapped.iter_ranges(start_offset):
+                if unhashed and not canonical:
+                    hash_old_messages(get_raw_msg_normalized_length(mapped.buffer, offset, length, ignore_status))
+
+                if canonical:
+                    fingerprint = get_raw_msg_fingerprint_canonical(
+                        mapped.buffer, offset, length, hash_name, hex_digest=False, part_cache=part_cache
+                    )
+                else:
+                    fingerprint = get_raw_msg_fingerprint_strict(
+                        mapped.buffer, offset, length, hash_name, hex_digest=False, ignore_status=ignore_status
+                    )
+
+                expunged = False
+                if merge_flags:
+                    field = find_status_field(mapped.buffer, offset, length)
+                    expunged = field is not None and bool(field[1] & MSG_FLAG_EXPUNGED)
 
-    # --- Only rewrite the mailbox if something was deleted
+                if fingerprint in kept_at:
+                    deleted_count += 1
+                    duplicate_of[(offset, length)] = kept_at[fingerprint]
+
+                    # The merge makes the kept copy live, see merge_status()
+                    if fingerprint in kept_expunged and not expunged:
+                        kept_expunged.discard(fingerprint)
+                        remember(fingerprint)
+                elif fingerprint not in seen:
+                    kept_ranges.append((offset, length))
+
+                    if merge_flags:
+                        kept_at[fingerprint] = (offset, length)
+
+                    # An expunged copy must not make live copies elsewhere or later look like duplicates
+                    if expunged:
+                        kept_expunged.add(fingerprint)
+                    else:
+                        remember(fingerprint)
+                else:
+                    deleted_count += 1
+
+        if merge_flags:
+            status_patches = get_status_patches(mapped.buffer, duplicate_of)
+            patches = {position: format_status(flags) for position, flags in status_patches.items()}
+            patches.update(get_keys_patches(mapped.buffer, duplicate_of))
+
+        if pruned and collect_fingerprints:
+            kept_fingerprints, kept_unhashed = get_kept_entries(
+                mapped.buffer, ranges, kept_indexes, lengths, hashed, status_patches if merge_flags else None,
+                rewritten=deleted_count > 0
+            )
+
+    # --- Pass two: only rewrite the mailbox if something was deleted
     if deleted_count > 0:
-        write_mbox_file(mbox_path, kept_messages)
+        if before_rewrite is not None:
+            before_rewrite(mbox_path)
+
+        # The merged flags and tags only go into the rewritten mailbox, never into the original
+        if in_place:
+            compact_mbox_ranges(mbox_path, kept_ranges, patches)
+        else:
+            write_mbox_ranges(mbox_path, kept_ranges, patches)
 
         logger.info(
             "Deleted %d duplicate messages from mbox %s",
@@ -61,4 +241,212 @@ def process_one_mbox(mbox_path):
     else:
         msg = ""
 
+    if collect_fingerprints:
+        return (kept_fingerprints, kept_unhashed), msg, deleted_count
+
     return None, msg, deleted_count
+
+
+def get_kept_entries(buffer, ranges, kept_indexes, lengths, hashed, status_patches=None, rewritten=False):
+    """
+    Split the kept messages of a pruned pass into hashed and unhashed ones.
+    Args:
+        buffer (bytes): The mbox contents (bytes or an mmap).
+        ranges (list): (offset, length) of all messages, see find_duplicates_pruned().
+        kept_indexes (list): Indexes in ranges of the kept messages, in file order.
+        lengths (list): Normalized length of each message.
+        hashed (dict): {index: fingerprint} of the messages that were hashed.
+        status_patches (dict, optional): Merged flags from get_status_patches().
+            If given, copies that stay expunged are left out, so they never
+            make a live copy look like a duplicate.
+        rewritten (bool, optional): True if the mailbox is rewritten with just
+            the kept messages, which moves them. Defaults to False.
+    Returns:
+        tuple: (fingerprints, unhashed), see process_one_mbox().
+    """
+    fingerprints = []
+    unhashed = []
+    new_offset = 0
+
+    for i in kept_indexes:
+        offset, length = ranges[i]
+        stored_offset = new_offset if rewritten else offset
+        new_offset += length
+
+        if status_patches is not None:
+            field = find_status_field(buffer, offset, length)
+
+            if field is not None and status_patches.get(field[0], field[1]) & MSG_FLAG_EXPUNGED:
+                continue
+
+        if i in hashed:
+            fingerprints.append(hashed[i])
+        else:
+            unhashed.append((stored_offset, lengths[i]))
+
+    return fingerprints, unhashed
+
+
+def group_duplicates(duplicate_of):
+    """
+    Group the duplicates of a mailbox by the copy that is kept.
+    Args:
+        duplicate_of (dict): {duplicate range: kept range} with (offset, length) ranges.
+    Returns:
+        dict: {kept range: [duplicate range, ...]}.
+    """
+    duplicates = {}
+    for duplicate, kept in duplicate_of.items():
+        duplicates.setdefault(kept, []).append(duplicate)
+
+    return duplicates
+
+
+def get_status_patches(buffer, duplicate_of):
+    """
+    Work out the merged X-Mozilla-Status of each kept copy.
+    Args:
+        buffer (bytes): The mbox contents (bytes or an mmap).
+        duplicate_of (dict): {duplicate range: kept range} with (offset, length) ranges.
+    Returns:
+        dict: {position: flags} with positions from find_status_field(), only
+              for kept copies whose flags change. Copies without a
+              well-formed status header are skipped.
+    """
+    patches = {}
+
+    for kept, members in group_duplicates(duplicate_of).items():
+        field = find_status_field(buffer, *kept)
+        if field is None:
+            continue
+
+        position, flags = field
+        duplicate_flags = [found[1] for found in (find_status_field(buffer, *r) for r in members) if found]
+        merged = merge_status(flags, duplicate_flags)
+
+        if merged != flags:
+            patches[position] = merged
+
+    return patches
+
+
+def get_keys_patches(buffer, duplicate_of):
+    """
+    Work out the merged X-Mozilla-Keys (tags) of each kept copy.
+    Tags are written into the padding of the kept copy's header. If they do
+    not fit, or the kept copy has no X-Mozilla-Keys header, the tags of its
+    duplicates are lost, which is logged.
+    Args:
+        buffer (bytes): The mbox contents (bytes or an mmap).
+        duplicate_of (dict): {duplicate range: kept range} with (offset, length) ranges.
+    Returns:
+        dict: {position: bytes} with the new header values, only for kept
+              copies whose tags change.
+    """
+    patches = {}
+
+    for kept, members in group_duplicates(duplicate_of).items():
+        duplicate_keys = [found[2] for found in (find_keys_field(buffer, *r) for r in members) if found]
+        field = find_keys_field(buffer, *kept)
+        keys = field[2] if field is not None else []
+        merged = merge_keys(keys, duplicate_keys)
+
+        if merged == keys:
+            continue
+
+        value = format_keys(merged, field[1]) if field is not None else None
+
+        if value is None:
+            logging.getLogger(__name__).warning(
+                "Tags of duplicates of the message at offset %d do not fit into its X-Mozilla-Keys header", kept[0]
+            )
+            continue
+
+        patches[field[0]] = value
+
+    return patches
+
+
+def find_duplicates_pruned(mapped, hash_name=DEFAULT_HASH, header_key=False, ignore_status=False):
+    """
+    Find the duplicate messages of a mailbox, hashing as little as possible.
+        1. Every message is put in a bucket by a cheap key: its length without
+           CR bytes (get_raw_msg_normalized_length), or if header_key is
+           True, a hash of its headers (get_raw_msg_header_key). Header
+           buckets with more than one message are then split by length, so
+           the body of a message with headers of its own is never read.
+        2. Only messages in a bucket with other messages get the strict
+           full-content fingerprint. Within each bucket, later messages with
+           the same fingerprint as an earlier one are duplicates.
+    Messages with the same strict fingerprint always share a bucket, so the
+    result is exactly that of hashing every message.
+    Args:
+        mapped (MappedMbox): The mapped mailbox.
+        hash_name (str, optional): Hash backend. Defaults to "md5".
+        header_key (bool, optional): Also bucket by headers (tiered dedup).
+            Defaults to False.
+        ignore_status (bool, optional): Leave the Mozilla status headers out
+            of every key and fingerprint. Defaults to False.
+    Returns:
+        tuple: (ranges, deleted, lengths, hashed) where ranges is the list of
+               (offset, length) of all messages in file order, deleted is a
+               dict from the index in ranges of each duplicate to the index
+               of the copy kept, lengths holds the normalized length of each
+               message (None for messages that were only bucketed by their
+               headers) and hashed is a dict {index: fingerprint} of the
+               messages that had to be hashed.
+    """
+    ranges = []
+    lengths = []
+    buckets = {}
+
+    for offset, length in mapped.iter_ranges():
+        if header_key:
+            key = get_raw_msg_header_key(
+                mapped.buffer, offset, length, hash_name, hex_digest=False, ignore_status=ignore_status
+            )
+            lengths.append(None)
+        else:
+            key = get_raw_msg_normalized_length(mapped.buffer, offset, length, ignore_status)
+            lengths.append(key)
+
+        buckets.setdefault(key, []).append(len(ranges))
+        ranges.append((offset, length))
+
+    if header_key:
+        # Counting the CR bytes reads the whole body, so only do it for shared headers
+        by_length = {}
+
+        for key, members in buckets.items():
+            if len(members) < 2:
+                continue
+
+            for i in members:
+                lengths[i] = get_raw_msg_normalized_length(mapped.buffer, *ranges[i], ignore_status)
+                by_length.setdefault((key, lengths[i]), []).append(i)
+
+        buckets = by_length
+
+    deleted = {}
+    hashed = {}
+
+    for members in buckets.values():
+        if len(members) < 2:
+            continue
+
+        seen = {}
+
+        for i in members:
+            offset, length = ranges[i]
+            fingerprint = get_raw_msg_fingerprint_strict(
+                mapped.buffer, offset, length, hash_name, hex_digest=False, ignore_status=ignore_status
+            )
+
+            hashed[i] = fingerprint
+
+            if fingerprint in seen:
+                deleted[i] = seen[fingerprint]
+            else:
+                seen[fingerprint] = i
+
+    return ranges, deleted, lengths, hashed
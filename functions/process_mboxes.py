@@ -1,40 +1,270 @@
 # functions/process_mboxes.py
 
 import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+from functions.global_index import order_mboxes_by_policy
+from functions.hashing import DEFAULT_HASH
+from functions.msf_summary import invalidate_msf
 from functions.process_1_mbox import process_one_mbox
-from PySide6.QtWidgets import QApplication
 
-def process_mboxes(mboxes, progress_bar):
+def get_mbox_sizes(mboxes):
+    """
+    Get the file size of each mailbox, used to weight the progress reporting.
+    Args:
+        mboxes (list): Paths of the mailbox files.
+    Returns:
+        list: The size in bytes of each mailbox, in the same order. Files that
+              cannot be read count as 0 bytes, and if the total is 0 every
+              mailbox counts as 1 so progress still advances.
+    """
+    sizes = []
+
+    for mbox in mboxes:
+        try:
+            sizes.append(os.path.getsize(mbox))
+        except OSError:
+            sizes.append(0)
+
+    if sum(sizes) == 0:
+        sizes = [1] * len(mboxes)
+
+    return sizes
+
+
+def process_mboxes(mboxes, progress_callback=None, workers=1, result_callback=None, is_cancelled=None,
+                   state_store=None, global_index=None, survivor_policy="oldest", folder_priority=None,
+                   hash_name=DEFAULT_HASH, before_rewrite=None, tiered=False, in_place=False,
+                   invalidate_summaries=False, ignore_status=False,
+                   canonical=False):
     """
     Process multiple mailboxes to remove duplicate messages.
+    This function does not touch the GUI, so it can run in a worker thread.
+    Progress and per-mailbox results are reported through callbacks.
     Args:
         mboxes (list): A list of mailbox objects to be processed for duplicate removal.
-        progress_bar (QProgressBar): A GUI progress bar widget to display processing progress.
+        progress_callback (callable, optional): Called as
+            progress_callback(processed_bytes, total_bytes) after each mailbox.
+        workers (int, optional): Number of worker processes. Each mailbox is
+            independent, so with more than one worker the mailboxes are fanned
+            out over a ProcessPoolExecutor. If one mailbox fails, the ones
+            already running are finished and reported, the rest are not
+            started, and the error is raised afterwards. Defaults to 1 (no pool).
+        result_callback (callable, optional): Called as
+            result_callback(mbox_path, msg, messages_deleted) after each mailbox.
+        is_cancelled (callable, optional): Returns True when the run should
+            stop. It is checked between mailboxes; a mailbox that has already
+            started is always finished, so no file is left half-written.
+        state_store (MboxStateStore, optional): Enables incremental dedup.
+            Mailboxes that are unchanged since their last clean run are
+            skipped without being read, mailboxes that have only been
+            appended to are resumed from where the last run stopped, and
+            every mailbox that is processed is recorded in the store afterwards.
+        global_index (GlobalFingerprintIndex, optional): Enables global dedup.
+            One fingerprint index is shared by all mailboxes, so a message
+            that also exists in another mailbox is deleted as well. Global
+            mode processes the mailboxes one at a time (workers is ignored).
+        survivor_policy (str, optional): Global mode only. Decides which
+            mailbox keeps its copy of a duplicate, see
+            global_index.order_mboxes_by_policy(). Defaults to "oldest".
+        folder_priority (list, optional): Folder names, most important first,
+            for the "priority" survivor policy.
+        hash_name (str, optional): Hash backend for the fingerprints, see
+            hashing.get_hash_backends(). Defaults to "md5".
+        before_rewrite (callable, optional): Passed on to process_one_mbox(),
+            called with the path of each mailbox right before it is rewritten.
+            Used for just-in-time backups.
+        tiered (bool, optional): Find duplicates by header key first and only
+            hash messages in full that share a key, see process_one_mbox().
+            Ignored in global mode, which compares full fingerprints across
+            mailboxes. With a state store, unchanged mailboxes are still
+            skipped, but no fingerprints are stored, so mailboxes that have
+            grown are processed whole instead of resumed. Defaults to False.
+        in_place (bool, optional): Compact rewritten mailboxes in place
+            instead of through a temp file, see process_one_mbox().
+            Defaults to False.
+        invalidate_summaries (bool, optional): Delete the Thunderbird .msf
+            index of every mailbox that is rewritten, so Thunderbird rebuilds
+            it cleanly instead of trusting stale offsets, see
+            msf_summary.invalidate_msf(). Defaults to False.
+        ignore_status (bool, optional): Leave the Mozilla status headers out
+            of the fingerprints and merge the flags of deleted copies into
+            the kept one, see process_one_mbox(). Defaults to False.
+        canonical (bool, optional): Compare messages by their canonical,
+            MIME-decoded fingerprint, see process_one_mbox(). Tiered dedup is
+            ignored in this mode. Defaults to False.
     Returns:
         tuple: A tuple containing:
-            - mboxes (list): The updated list of mailbox objects after duplicate removal.
+            - mboxes (list): The list of mailbox paths that was passed in.
             - msg_out (str): Concatenated messages/output from processing each mailbox.
             - total_messages_deleted (int): The total count of duplicate messages deleted across all mailboxes.
     Notes:
-        - Progress is incremented equally across all mailboxes.
-        - GUI events are processed after each mailbox to ensure responsive UI updates.
+        - Progress is weighted by mailbox file size, so a big Inbox counts for
+          more than an empty folder.
+        - With a pool, results are collected in the order the mailboxes finish.
+        - Skipped mailboxes count as done for the progress reporting.
+        - In global mode with a state store, the stored fingerprints of
+          unchanged and appended-to mailboxes are loaded into the index
+          first. Those mailboxes are never rewritten, so their copies survive.
         - Results are logged to the logging system.
     """
-    i = 0
     msg_out = ""
     total_messages_deleted = 0
-    progress_per_mbox = int((100 - progress_bar.value()) / len(mboxes))
 
-    for mbox in mboxes:
-        mbox, msg, messages_deleted = process_one_mbox(mbox)
-        mboxes[i] = mbox
+    if not mboxes:
+        return mboxes, msg_out, total_messages_deleted
+
+    if is_cancelled is None:
+        is_cancelled = lambda: False
+
+    sizes = get_mbox_sizes(mboxes)
+    total_size = sum(sizes)
+    processed_size = 0
+
+    resumed = set()
+    tiered = tiered and global_index is None and not canonical
+
+    def get_job_kwargs(i):
+        kwargs = {"hash_name": hash_name}
+
+        if before_rewrite is not None:
+            kwargs["before_rewrite"] = before_rewrite
+
+        if in_place:
+            kwargs["in_place"] = True
+
+        if ignore_status:
+            kwargs["ignore_status"] = True
+
+        if canonical:
+            kwargs["canonical"] = True
+
+        if tiered:
+            kwargs["tiered"] = True
+            return kwargs
+
+        if state_store is None:
+            return kwargs
+
+        kwargs["collect_fingerprints"] = True
+        resume_point = state_store.get_resume_point(mboxes[i])
+
+        if resume_point is None:
+            return kwargs
+
+        start_offset, seen = resume_point
+        resumed.add(i)
+        logging.debug(f"Resuming {mboxes[i]} from offset {start_offset}")
+
+        kwargs["seen"] = seen
+        kwargs["start_offset"] = start_offset
+
+        unhashed = state_store.get_unhashed(mboxes[i])
+        if unhashed:
+            kwargs["unhashed"] = unhashed
+
+        return kwargs
+
+    def on_result(i, result):
+        nonlocal msg_out, total_messages_deleted, processed_size
+        mbox_path = mboxes[i]
+        kept, msg, messages_deleted = result
         msg_out += msg
         total_messages_deleted += messages_deleted
-        progress_bar.setValue(progress_bar.value() + progress_per_mbox)
-        QApplication.processEvents()  # Forces GUI update immediately
-        i += 1
+        processed_size += sizes[i]
+
+        if invalidate_summaries and messages_deleted:
+            invalidate_msf(mbox_path)
+
+        if state_store is not None:
+            fingerprints, unhashed = kept or ((), ())
+            state_store.record(mbox_path, fingerprints, append=i in resumed, unhashed=unhashed)
+
+        if result_callback:
+            result_callback(mbox_path, msg, messages_deleted)
+
+        if progress_callback:
+            progress_callback(processed_size, total_size)
+
+    to_process = list(range(len(mboxes)))
+    unchanged = []
+
+    if state_store is not None:
+        unchanged = [i for i in to_process if state_store.is_unchanged(mboxes[i])]
+
+        if unchanged:
+            to_process = sorted(set(to_process) - set(unchanged))
+            processed_size += sum(sizes[i] for i in unchanged)
+            logging.info(f"Skipped {len(unchanged)} mailboxes unchanged since the last run")
+
+            if progress_callback:
+                progress_callback(processed_size, total_size)
+
+    if global_index is not None:
+        ordered = order_mboxes_by_policy(mboxes, survivor_policy, folder_priority)
+        rank = {mbox: n for n, mbox in enumerate(ordered)}
+        to_process.sort(key=lambda i: rank[mboxes[i]])
+
+        if state_store is not None:
+            for i in unchanged:
+                global_index.update(state_store.get_fingerprints(mboxes[i]))
+
+        jobs = {i: get_job_kwargs(i) for i in to_process}
+
+        for job in jobs.values():
+            global_index.update(job.get("seen", ()))
+            job["seen"] = global_index
+
+        for i in to_process:
+            if is_cancelled():
+                break
+
+            on_result(i, process_one_mbox(mboxes[i], **jobs[i]))
+    elif workers > 1 and len(to_process) > 1:
+        # Spawn instead of fork: the pool is started from a thread of a Qt process
+        mp_context = multiprocessing.get_context("spawn")
+        error = None
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(to_process)), mp_context=mp_context) as executor:
+            # Submit the biggest mailboxes first so they don't finish last on their own
+            order = sorted(to_process, key=lambda i: sizes[i], reverse=True)
+            futures = {
+                executor.submit(process_one_mbox, mboxes[i], **get_job_kwargs(i)): i
+                for i in order
+            }
+
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f"Processing {mboxes[futures[future]]} failed: {e}")
+                    error = error or e
+                else:
+                    # Also after an error: a mailbox that was rewritten must get its .msf and state updated
+                    on_result(futures[future], result)
+
+                if error is not None or is_cancelled():
+                    # Mailboxes already running are finished, the rest never start
+                    for pending in futures:
+                        pending.cancel()
+
+        if error is not None:
+            raise error
+    else:
+        for i in to_process:
+            if is_cancelled():
+                break
+
+            on_result(i, process_one_mbox(mboxes[i], **get_job_kwargs(i)))
+
+    if is_cancelled():
+        logging.info("Processing of mailboxes was cancelled")
 
     logging.info(f"Total duplicate messages deleted across all mailboxes: {total_messages_deleted}")
 
-    return mboxes, msg_out, total_messages_deleted
\ No newline at end of file
+    return mboxes, msg_out, total_messages_deleted
@@ -1,5 +1,8 @@
 # functions/replace_mbox_file.py
 
+import bisect
+import errno
+import json
 import os
 import mailbox
 import logging
@@ -85,3 +88,422 @@ def write_mbox_file(mbox_path, messages):
         
 
 
+
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024  # 8 MB
+
+# Errors meaning a kernel copy call is not supported for these files, so the
+# next copy method is tried instead
+COPY_FALLBACK_ERRNOS = {
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.ENOTSOCK,  # macOS only sends files to sockets
+    errno.EPERM,
+}
+
+
+def merge_ranges(ranges):
+    """
+    Merge byte ranges that follow each other directly into one range.
+    Most kept messages are next to each other, so a mailbox with a few
+    duplicates becomes a few large copies instead of one per message.
+    Args:
+        ranges (iterable): (offset, length) tuples, in the order they are written.
+    Yields:
+        tuple: The merged (offset, length) ranges, in the same order.
+    """
+    current_offset, current_length = None, 0
+
+    for offset, length in ranges:
+        if length <= 0:
+            continue
+
+        if current_offset is not None and current_offset + current_length == offset:
+            current_length += length
+            continue
+
+        if current_offset is not None:
+            yield current_offset, current_length
+
+        current_offset, current_length = offset, length
+
+    if current_offset is not None:
+        yield current_offset, current_length
+
+
+def map_patches(ranges, patches):
+    """
+    Find where byte patches of the original file end up in the rewritten one.
+    Args:
+        ranges (iterable): (offset, length) tuples of the bytes to keep, in
+            the order they are written.
+        patches (dict): {position: bytes} to write over the original bytes at
+            position. Each patch must lie inside one kept range; patches
+            outside the kept ranges are dropped.
+    Returns:
+        list: (position, bytes) tuples in the rewritten file, in file order.
+    """
+    positions = sorted(patches)
+    moved = []
+    new_offset = 0
+
+    for offset, length in ranges:
+        first = bisect.bisect_left(positions, offset)
+        last = bisect.bisect_left(positions, offset + length)
+
+        for position in positions[first:last]:
+            moved.append((new_offset + position - offset, patches[position]))
+
+        new_offset += length
+
+    moved.sort()
+
+    return moved
+
+
+def write_at(f, position, data):
+    """
+    Write all of data at a position of an unbuffered file.
+    Args:
+        f: A file opened with buffering=0.
+        position (int): Where to write.
+        data (bytes): The bytes to write.
+    """
+    f.seek(position)
+    view = memoryview(data)
+    written = 0
+    while written < len(data):
+        written += f.write(view[written:])
+
+
+class RangeCopier:
+    """
+    Append byte ranges of one file to another as fast as the OS allows.
+    Uses os.copy_file_range (Linux; the kernel copies without going through
+    user space, and can share blocks on filesystems like Btrfs or XFS), then
+    os.sendfile, and finally a plain read/write loop with one reused buffer
+    (Windows). A method the OS rejects for these files is not tried again.
+    """
+
+    def __init__(self, src, dst):
+        """
+        Args:
+            src: The source file, opened "rb" with buffering=0.
+            dst: The destination file, opened "wb" with buffering=0.
+        """
+        self.src = src
+        self.dst = dst
+        self.methods = [
+            method for method, available in (
+                ("copy_file_range", hasattr(os, "copy_file_range")),
+                ("sendfile", hasattr(os, "sendfile")),
+                ("readinto", True),
+            )
+            if available
+        ]
+        self._buffer = None
+
+    def copy(self, offset, length):
+        """
+        Append length bytes from offset in the source to the destination.
+        Args:
+            offset (int): Start of the range in the source file.
+            length (int): Number of bytes to copy.
+        Returns:
+            int: The number of bytes copied; less than length only if the
+                 source file ends before the range does.
+        """
+        copied = 0
+
+        while copied < length:
+            method = self.methods[0]
+
+            try:
+                count = getattr(self, "_copy_" + method)(offset + copied, length - copied)
+            except OSError as e:
+                if method == "readinto" or e.errno not in COPY_FALLBACK_ERRNOS:
+                    raise
+
+                logging.debug(f"{method} not supported here ({e}), falling back")
+                self.methods.pop(0)
+                continue
+
+            if count == 0:
+                break  # End of the source file
+
+            copied += count
+
+        return copied
+
+    def _copy_copy_file_range(self, offset, length):
+        return os.copy_file_range(self.src.fileno(), self.dst.fileno(), min(length, 1 << 30), offset)
+
+    def _copy_sendfile(self, offset, length):
+        return os.sendfile(self.dst.fileno(), self.src.fileno(), offset, min(length, 1 << 30))
+
+    def _copy_readinto(self, offset, length):
+        if self._buffer is None:
+            self._buffer = memoryview(bytearray(COPY_CHUNK_SIZE))
+
+        self.src.seek(offset)
+        count = self.src.readinto(self._buffer[:min(length, COPY_CHUNK_SIZE)])
+
+        written = 0
+        while written < count:
+            written += self.dst.write(self._buffer[written:count])
+
+        return count
+
+
+def write_mbox_ranges(mbox_path, ranges, patches=None):
+    """
+    Rewrite an MBOX file so that it only contains the given byte ranges.
+    Copies each (offset, length) range of the original file, in order, into a
+    temporary file in the same directory and then atomically replaces the
+    original. Adjacent ranges are merged and copied with RangeCopier, so the
+    data is moved by the kernel where possible and otherwise in large chunks.
+    Memory use does not depend on the size of the mailbox or of any single
+    message, and kept messages stay byte-for-byte identical to the original.
+    Args:
+        mbox_path (str): The full file path of the MBOX file to rewrite.
+        ranges (iterable): (offset, length) tuples of the bytes to keep, in
+            the order they should be written.
+        patches (dict, optional): {position: bytes} to write over the bytes
+            at position of the original, e.g. merged status flags. They are
+            only written into the copy, so the original stays untouched if
+            the rewrite fails. See map_patches().
+    Raises:
+        Exception: Re-raises any exception that occurs during copying or file
+                   replacement after cleanup of the temporary file.
+    """
+    ranges = list(ranges)
+    directory = os.path.dirname(mbox_path)
+
+    with tempfile.NamedTemporaryFile(
+        dir=directory,
+        delete=False
+    ) as tmp:
+        tmp_path = tmp.name
+
+    try:
+        with open(mbox_path, "rb", buffering=0) as src, open(tmp_path, "wb", buffering=0) as dst:
+            copier = RangeCopier(src, dst)
+
+            for offset, length in merge_ranges(ranges):
+                copier.copy(offset, length)
+
+            for position, data in map_patches(ranges, patches or {}):
+                write_at(dst, position, data)
+
+            os.fsync(dst.fileno())
+
+        # Atomic replace (Windows-safe)
+        shutil.move(tmp_path, mbox_path)
+    except Exception as e:
+        logging.exception(f"Error writing MBOX file {mbox_path}: {str(e)}")
+
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        raise
+
+
+def get_compaction_journal_paths(mbox_path):
+    """
+    Get the paths of the journal files of an in-place compaction.
+    The files are hidden (leading "."), so the scanner never takes them for mailboxes.
+    Args:
+        mbox_path (str): Path of the mailbox.
+    Returns:
+        tuple: (journal_path, state_path, data_path). The journal holds the
+               ranges to keep and the patches, and is written once; the state file holds the
+               progress; the data file holds a batch that is being moved.
+    """
+    directory, name = os.path.split(mbox_path)
+    base = os.path.join(directory, "." + name)
+
+    return base + ".compact-journal", base + ".compact-state", base + ".compact-data"
+
+
+def write_json_durably(path, data):
+    """
+    Write a small JSON file atomically and fsync it.
+    Args:
+        path (str): Path of the file.
+        data: JSON-serializable data.
+    """
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+def compact_mbox_ranges(mbox_path, ranges, patches=None):
+    """
+    Rewrite an MBOX file in place so that it only contains the given byte ranges.
+    Instead of copying the kept ranges to a new file like write_mbox_ranges(),
+    every range after the first removed message is moved down inside the file
+    and the file is truncated at the end. No extra disk space is needed, and
+    only the bytes after the first duplicate are read and written.
+    The ranges are written to a journal next to the mailbox once. They are
+    then moved in batches of up to COPY_CHUNK_SIZE bytes, so many small
+    messages cost one fsync per batch. After each batch the progress is
+    saved. If the run is interrupted (crash, power loss), the next
+    process_one_mbox() call finishes the compaction with resume_compaction()
+    before the mailbox is read. A batch whose write would overwrite its own
+    source bytes is saved next to the journal first, so it can be written
+    again safely.
+    An interrupted compaction can be finished but not undone: the bytes of the
+    removed duplicates have been overwritten. To undo, restore a backup.
+    Args:
+        mbox_path (str): The full file path of the MBOX file to rewrite.
+        ranges (iterable): (offset, length) tuples of the bytes to keep, in
+            file order and not overlapping, e.g. the kept messages.
+        patches (dict, optional): {position: bytes} to write over the bytes
+            at position of the original, see write_mbox_ranges(). They are
+            kept in the journal and written after the last batch has been
+            moved, so a resumed compaction writes them too.
+    Raises:
+        ValueError: If the ranges are not in file order.
+        RuntimeError: If an earlier compaction of the file is unfinished.
+    """
+    journal_path, state_path, _ = get_compaction_journal_paths(mbox_path)
+
+    if os.path.exists(journal_path):
+        raise RuntimeError(f"Unfinished compaction of {mbox_path}, resume it first")
+
+    ranges = list(ranges)
+    merged = list(merge_ranges(ranges))
+    moved_patches = [[position, data.hex()] for position, data in map_patches(ranges, patches or {})]
+
+    for (offset, length), (next_offset, _) in zip(merged, merged[1:]):
+        if offset + length > next_offset:
+            raise ValueError("Ranges must be in file order and must not overlap")
+
+    # Leading ranges that are already in place are not touched
+    dst = 0
+    index = 0
+    while index < len(merged) and merged[index][0] == dst:
+        dst += merged[index][1]
+        index += 1
+
+    state = {
+        "range_index": index,
+        "done": 0,        # Bytes of the current range already moved
+        "dst": dst,       # Where the next byte goes
+        "pending": None,  # Batch saved in the data file, not yet known to be written
+    }
+
+    # The journal is what marks a compaction as started, so it is written last
+    write_json_durably(state_path, state)
+    write_json_durably(journal_path, {"ranges": merged, "patches": moved_patches})
+    run_compaction(mbox_path, merged, state, moved_patches)
+
+
+def resume_compaction(mbox_path):
+    """
+    Finish an interrupted in-place compaction, if there is one.
+    Args:
+        mbox_path (str): Path of the mailbox.
+    Returns:
+        bool: True if an interrupted compaction was found and finished.
+    """
+    journal_path, state_path, _ = get_compaction_journal_paths(mbox_path)
+
+    if not os.path.exists(journal_path):
+        return False
+
+    with open(journal_path, "r", encoding="utf-8") as f:
+        journal = json.load(f)
+
+    with open(state_path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+
+    logging.warning(f"Finishing interrupted compaction of {mbox_path}")
+    run_compaction(mbox_path, journal["ranges"], state, journal["patches"])
+
+    return True
+
+
+def run_compaction(mbox_path, ranges, state, patches=()):
+    """
+    Move the ranges of a compaction from the point its state describes.
+    Each batch gathers up to COPY_CHUNK_SIZE bytes from one or more ranges,
+    which land next to each other at dst, and is written with one write and
+    one fsync. Only a batch that reaches past its first source byte can
+    destroy data it still needs if interrupted; its data is saved to the
+    data file before it is written. The patches are written last; writing
+    them again after an interruption gives the same bytes.
+    Args:
+        mbox_path (str): Path of the mailbox.
+        ranges (list): The merged ranges from the journal.
+        state (dict): The progress, see compact_mbox_ranges().
+        patches (list, optional): [position, hex data] pairs in the compacted
+            file, from the journal.
+    """
+    journal_path, state_path, data_path = get_compaction_journal_paths(mbox_path)
+
+    with open(mbox_path, "r+b", buffering=0) as f:
+        pending = state["pending"]
+
+        if pending is not None:
+            with open(data_path, "rb") as data_file:
+                write_at(f, pending["dst"], data_file.read())
+
+            os.fsync(f.fileno())
+            state.update(pending["next"], pending=None)
+            write_json_durably(state_path, state)
+
+        while state["range_index"] < len(ranges):
+            range_index = state["range_index"]
+            done = state["done"]
+            dst = state["dst"]
+            first_src = ranges[range_index][0] + done
+            batch = bytearray()
+
+            while range_index < len(ranges) and len(batch) < COPY_CHUNK_SIZE:
+                offset, length = ranges[range_index]
+                count = min(COPY_CHUNK_SIZE - len(batch), length - done)
+
+                f.seek(offset + done)
+                batch += f.read(count)
+                done += count
+
+                if done == length:
+                    range_index += 1
+                    done = 0
+
+            next_state = {"range_index": range_index, "done": done, "dst": dst + len(batch)}
+
+            if dst + len(batch) > first_src:
+                # The write overwrites bytes this batch was read from; save the data to redo it
+                with open(data_path, "wb") as data_file:
+                    data_file.write(batch)
+                    data_file.flush()
+                    os.fsync(data_file.fileno())
+
+                state["pending"] = {"dst": dst, "next": next_state}
+                write_json_durably(state_path, state)
+
+            write_at(f, dst, batch)
+            os.fsync(f.fileno())
+
+            state.update(next_state, pending=None)
+            write_json_durably(state_path, state)
+
+        for position, data in patches:
+            write_at(f, position, bytes.fromhex(data))
+
+        f.truncate(state["dst"])
+        os.fsync(f.fileno())
+
+    # Without the journal the leftover files are never read, so it goes first
+    for path in (journal_path, data_path, state_path):
+        if os.path.exists(path):
+            os.remove(path)
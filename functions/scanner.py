@@ -1,57 +1,281 @@
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-from functions.parser import get_messages_from_mbox
+from functions.mbox_reader import FROM_LINE, MappedMbox
 
+# Bytes read from the start of a file to decide whether it is a mailbox
+SNIFF_SIZE = 4096
 
-def find_mbox_files(root_folder: str, exclude_trash_files: bool):
+# Discovered folders and mailboxes, reused by the next scan
+SCAN_CACHE_FILE = os.path.join("config", "scan_cache.json")
+
+
+def is_mbox_file(path, size=None, has_msf=False):
+    """
+    Check whether a file is an MBOX mailbox without reading more than a few bytes.
+    Args:
+        path (str): Path to the file.
+        size (int, optional): File size, if already known from a directory scan.
+        has_msf (bool, optional): True if Thunderbird keeps a "<name>.msf"
+            index next to the file. Thunderbird only indexes its own mailbox
+            files, so a non-empty file with an index is accepted unread.
+    Returns:
+        bool: True if the file is a non-empty mailbox, i.e. it starts with
+              "From " or has a "From " line within its first SNIFF_SIZE bytes.
+    """
+    if size == 0:
+        return False
+
+    if has_msf and size is not None:
+        return True
+
+    try:
+        with open(path, "rb") as f:
+            head = f.read(SNIFF_SIZE)
+    except OSError:
+        return False
+
+    return head.startswith(FROM_LINE) or b"\n" + FROM_LINE in head
+
+
+def scan_directory(dirpath, exclude_trash_files, cached=None):
+    """
+    List the mailbox files and subdirectories of one directory (not recursive).
+    With a cache record from an earlier scan, a directory whose mtime has not
+    changed is not listed at all: adding, removing or renaming a file changes
+    the mtime of its directory, so the cached listing is still correct. Only
+    files that were empty are checked again, as mail can be appended to them
+    in place. In a changed directory, files with the same size and mtime as
+    before keep their cached classification and are not opened.
+    Args:
+        dirpath (str): The directory to scan.
+        exclude_trash_files (bool): If True, skip files and directories with
+            "trash" in their name or path (case-insensitive).
+        cached (dict, optional): The record of this directory from an earlier
+            scan, as returned by this function.
+    Returns:
+        tuple: (mbox_files, subdirs, record). mbox_files and subdirs are lists
+               of paths. record describes the directory for the next scan:
+               {"mtime_ns", "subdirs": [names], "files": {name: [size, mtime_ns, is_mbox]}}.
+               An unreadable directory gives two empty lists and None.
+    """
+    try:
+        mtime_ns = os.stat(dirpath).st_mtime_ns
+    except OSError:
+        return [], [], None
+
+    if cached is not None and cached["mtime_ns"] == mtime_ns:
+        return reuse_directory(dirpath, cached)
+
+    try:
+        with os.scandir(dirpath) as it:
+            entries = list(it)
+    except OSError:
+        return [], [], None
+
+    cached_files = cached["files"] if cached is not None else {}
+    names = {entry.name for entry in entries}
+    trash_dir = exclude_trash_files and "trash" in dirpath.lower()
+    mbox_files = []
+    subdirs = []
+    files = {}
+
+    for entry in entries:
+        name = entry.name
+
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if not (exclude_trash_files and "trash" in name.lower()):
+                    subdirs.append(entry.path)
+                continue
+
+            if not entry.is_file():
+                continue
+        except OSError:
+            continue
+
+        if name.endswith(".msf") or name.startswith(".") or name.lower() == "desktop.ini":
+            continue
+
+        if trash_dir or (exclude_trash_files and "trash" in name.lower()):
+            continue
+
+        try:
+            stat = entry.stat()  # Cached by scandir on Windows, no extra call
+        except OSError:
+            continue
+
+        old = cached_files.get(name)
+        if old is not None and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+            is_mbox = old[2]
+        else:
+            is_mbox = is_mbox_file(entry.path, stat.st_size, has_msf=name + ".msf" in names)
+
+        files[name] = [stat.st_size, stat.st_mtime_ns, is_mbox]
+
+        if is_mbox:
+            mbox_files.append(entry.path)
+
+    record = {
+        "mtime_ns": mtime_ns,
+        "subdirs": [os.path.basename(subdir) for subdir in subdirs],
+        "files": files,
+    }
+
+    return mbox_files, subdirs, record
+
+
+def reuse_directory(dirpath, cached):
+    """
+    Get the mailboxes and subdirectories of an unchanged directory from the cache.
+    Args:
+        dirpath (str): The directory.
+        cached (dict): Its record from an earlier scan_directory().
+    Returns:
+        tuple: (mbox_files, subdirs, record), like scan_directory().
+    """
+    mbox_files = []
+    files = {}
+
+    for name, (size, mtime_ns, is_mbox) in cached["files"].items():
+        path = os.path.join(dirpath, name)
+
+        if size == 0:
+            # An empty mailbox may have got its first message since
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                size, mtime_ns = stat.st_size, stat.st_mtime_ns
+                is_mbox = is_mbox_file(path, size, has_msf=os.path.exists(path + ".msf"))
+
+        files[name] = [size, mtime_ns, is_mbox]
+
+        if is_mbox:
+            mbox_files.append(path)
+
+    subdirs = [os.path.join(dirpath, name) for name in cached["subdirs"]]
+    record = dict(cached, files=files)
+
+    return mbox_files, subdirs, record
+
+
+def load_scan_cache(cache_path, root_folder, exclude_trash_files):
+    """
+    Load the directory records of an earlier scan.
+    Args:
+        cache_path (str): Path to the cache file.
+        root_folder (str): The root directory of the scan.
+        exclude_trash_files (bool): The trash setting of the scan.
+    Returns:
+        dict: Directory path -> record. Empty if there is no cache, it cannot
+              be read, or it was made for another folder or trash setting.
+    """
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if cache.get("root_folder") != root_folder or cache.get("exclude_trash_files") != exclude_trash_files:
+        return {}
+
+    return cache.get("directories", {})
+
+
+def save_scan_cache(cache_path, root_folder, exclude_trash_files, directories):
+    """
+    Save the directory records of a scan, replacing the cache file atomically.
+    Args:
+        cache_path (str): Path to the cache file.
+        root_folder (str): The root directory of the scan.
+        exclude_trash_files (bool): The trash setting of the scan.
+        directories (dict): Directory path -> record.
+    """
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "root_folder": root_folder,
+                "exclude_trash_files": exclude_trash_files,
+                "directories": directories,
+            },
+            f
+        )
+
+    os.replace(tmp_path, cache_path)
+
+
+def find_mbox_files(root_folder: str, exclude_trash_files: bool, workers: int = 1, cache_path: str = None):
     """
     Recursively search for MBOX format files within a directory tree.
-    This function walks through all subdirectories of the specified root folder
-    and identifies files that follow the MBOX format by checking if they contain
-    lines starting with "From " in their first 10 lines.
+    Directories are listed with os.scandir, reusing the file type and size
+    it returns, and a file is identified as a mailbox by its first few bytes
+    (see is_mbox_file()), or without opening it at all if Thunderbird keeps
+    a .msf index for it.
     Args:
         root_folder (str): The root directory path to start searching from.
         exclude_trash_files (bool): If True, excludes files and directories
             containing "trash" in their name or path (case-insensitive).
+        workers (int, optional): Number of threads that scan directories at
+            the same time. Helps a lot on network drives, where each listing
+            waits for the server. Defaults to 1.
+        cache_path (str, optional): File in which the scan results are kept
+            for the next scan, see scan_directory(). Then only directories
+            that changed since the last scan are listed, and only new or
+            changed files are opened. Defaults to None (no cache).
     Returns:
-        list: A list of absolute file paths (str) that match the MBOX format criteria.
+        list: A list of file paths (str) that match the MBOX format criteria,
+              directory by directory, top level first.
     Note:
         - Skips files with .msf extension, hidden files (starting with "."),
-          and desktop.ini files.
-        - Handles encoding errors gracefully by ignoring them.
-        - Silently continues on any file read exceptions.
+          desktop.ini files and empty files.
+        - Silently continues on directories and files that cannot be read.
+        - Symbolic links to directories are not followed.
     """
+    cached = load_scan_cache(cache_path, root_folder, exclude_trash_files) if cache_path else {}
+    directories = {}
     mbox_files = []
+    level = [root_folder]
 
-    for dirpath, dirnames, filenames in os.walk(root_folder):
-        for filename in filenames:
-            if filename.endswith(".msf") or filename.startswith(".") or filename.lower() == "desktop.ini":
-                continue
+    def scan(dirpath):
+        return scan_directory(dirpath, exclude_trash_files, cached.get(dirpath))
 
-            if exclude_trash_files:
-                if "trash" in filename.lower() or "trash" in dirpath.lower():
-                    continue
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
 
-            full_path = os.path.join(dirpath, filename)
+    try:
+        # One directory level at a time, so the result order does not depend on the threads
+        while level:
+            results = executor.map(scan, level) if executor else map(scan, level)
+            dirpaths, level = level, []
 
-            try:
-                with open(full_path, "r", encoding="utf-8", errors="ignore") as f:
-                    for _ in range(10):
-                        line = f.readline()
-                        if not line:
-                            break
-                        if line.startswith("From "):
-                            mbox_files.append(full_path)
-                            break
-            except Exception:
-                continue
+            for dirpath, (files, subdirs, record) in zip(dirpaths, results):
+                mbox_files.extend(files)
+                level.extend(subdirs)
+
+                if record is not None:
+                    directories[dirpath] = record
+    finally:
+        if executor:
+            executor.shutdown()
+
+    if cache_path:
+        try:
+            save_scan_cache(cache_path, root_folder, exclude_trash_files, directories)
+        except OSError:
+            pass  # The cache only saves time; the scan result is still valid
 
     return mbox_files
 
 
 def parse_all_mailboxes(folder, exclude_trash_files=True):
     """
-    Parse all mailbox files in a given folder and count the total number of messages.
+    Find all mailbox files in a given folder and count the total number of messages.
     Args:
         folder (str): The path to the folder containing mailbox files.
         exclude_trash_files (bool, optional): Whether to exclude trash-related files from parsing.
@@ -63,7 +287,8 @@ def parse_all_mailboxes(folder, exclude_trash_files=True):
 
     total_messages = 0
     for mbox_file in mbox_files:
-        messages = get_messages_from_mbox(mbox_file)
-        total_messages += len(messages)
+        # Counting only needs the message boundaries, not parsed messages
+        with MappedMbox(mbox_file) as mapped:
+            total_messages += sum(1 for _ in mapped.iter_ranges())
 
     return total_messages
\ No newline at end of file
@@ -1,7 +1,9 @@
+import gzip
+import pickle
 import zipfile
 from pathlib import Path
 
-from functions.backup_mail_folder import backup_folder
+from functions.backup_mail_folder import JustInTimeBackup, backup_folder
 
 
 
@@ -38,4 +40,24 @@ def test_backup_folder_creates_zip(tmp_path, monkeypatch):
         names = zipf.namelist()
 
     assert "test1.txt" in names
-    assert "sub/test2.txt" in names or "sub\\test2.txt" in names
\ No newline at end of file
+    assert "sub/test2.txt" in names or "sub\\test2.txt" in names
+
+
+def test_just_in_time_backup_copies_one_mailbox(tmp_path):
+    source_folder = tmp_path / "mail_folder"
+    mbox = source_folder / "Inbox.sbd" / "Sub"
+    mbox.parent.mkdir(parents=True)
+    mbox.write_bytes(b"From a\nhello\n")
+    (source_folder / "Other").write_bytes(b"From b\nnot backed up\n")
+
+    backup = JustInTimeBackup(str(source_folder), {"backup_zip_file_compr_level": 1}, str(tmp_path / "backups"))
+    assert backup.get_backup_files() == []
+
+    # Must survive the trip to a worker process
+    copy_path = pickle.loads(pickle.dumps(backup))(str(mbox))
+
+    assert Path(copy_path).relative_to(backup.backup_path) == Path("Inbox.sbd") / "Sub.gz"
+    assert backup.get_backup_files() == [copy_path]
+
+    with gzip.open(copy_path, "rb") as f:
+        assert f.read() == b"From a\nhello\n"
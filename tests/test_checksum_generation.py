@@ -78,3 +78,31 @@ def test_empty_mbox_returns_empty_results(tmp_path):
 
     assert get_messages_fingerprint_hashed_list(str(mbox_path)) == []
     assert get_messages_fingerprint_hashed_str(str(mbox_path)) == ""
+
+
+def test_get_messages_fingerprint_hashed_list_matches_full_parse(tmp_path):
+    mbox_path = tmp_path / "test.mbox"
+    mbox_path.write_bytes(
+        b"From a Sat Jan 01 00:00:00 2022\n"
+        b"Message-ID: <folded\n @example.com>\n"
+        b"Subject: =?utf-8?q?R=C3=A4ksm=C3=B6rg=C3=A5s?=\n"
+        b"From: a@test.com\n"
+        b"\n"
+        b"Body\n"
+        b"Subject: not a header\n"
+        b"\n"
+        b"From b Sat Jan 01 00:00:00 2022\r\n"
+        b"Subject: CRLF\r\n"
+        b"From: b@test.com\r\n"
+        b"\r\n"
+        b"Body\r\n"
+        b"\r\n"
+        b"From c Sat Jan 01 00:00:00 2022\n"
+        b"Subject: Headers only\n"
+    )
+
+    mbox = mailbox.mbox(mbox_path)
+    expected = [get_one_msg_fingerprint_hashed(message) for message in mbox]
+    mbox.close()
+
+    assert get_messages_fingerprint_hashed_list(str(mbox_path)) == expected
@@ -0,0 +1,148 @@
+from unittest.mock import patch
+
+from functions.dedup_worker import DedupWorker
+
+
+def run_worker(worker):
+    events = []
+    worker.progress.connect(lambda value, label: events.append(("progress", value)))
+    worker.output.connect(lambda text: events.append(("output", text)))
+    worker.mboxes_found.connect(lambda mboxes: events.append(("mboxes", mboxes)))
+    worker.failed.connect(lambda error: events.append(("failed", error)))
+    worker.finished.connect(lambda total, cancelled: events.append(("finished", total, cancelled)))
+    worker.run()
+    return events
+
+
+def test_dedup_worker_runs_pipeline_and_emits_signals(tmp_path):
+    backup = tmp_path / "backup.zip"
+    backup.write_bytes(b"zip")
+
+    def fake_process(mboxes, progress_callback, workers, result_callback, is_cancelled, **kwargs):
+        result_callback("Inbox", "Deleted 2 duplicate messages from mbox Inbox\n", 2)
+        progress_callback(10, 10)
+        return mboxes, "", 2
+
+    worker = DedupWorker(str(tmp_path), {"dedup_workers": 1}, True)
+
+    with patch("functions.dedup_worker.backup_folder", return_value=str(backup)), \
+         patch("functions.dedup_worker.find_mbox_files", return_value=["Inbox"]), \
+         patch("functions.dedup_worker.process_mboxes", side_effect=fake_process):
+
+        events = run_worker(worker)
+
+    assert ("mboxes", ["Inbox"]) in events
+    assert ("output", "Deleted 2 duplicate messages from mbox Inbox") in events
+    assert ("progress", 100) in events
+    assert events[-1] == ("finished", 2, False)
+
+
+def test_dedup_worker_reports_failure_and_still_finishes(tmp_path):
+    worker = DedupWorker(str(tmp_path), {}, True)
+
+    with patch("functions.dedup_worker.backup_folder", side_effect=OSError("disk full")):
+        events = run_worker(worker)
+
+    assert ("failed", "disk full") in events
+    assert events[-1] == ("finished", 0, False)
+
+
+def test_dedup_worker_cancel_after_backup_skips_dedup(tmp_path):
+    backup = tmp_path / "backup.zip"
+    backup.write_bytes(b"zip")
+    worker = DedupWorker(str(tmp_path), {}, True)
+    worker.cancel()
+
+    with patch("functions.dedup_worker.backup_folder", return_value=str(backup)), \
+         patch("functions.dedup_worker.process_mboxes") as mock_process:
+
+        events = run_worker(worker)
+
+    mock_process.assert_not_called()
+    assert events[-1] == ("finished", 0, True)
+
+
+def test_dedup_worker_uses_incremental_backup(tmp_path):
+    worker = DedupWorker(str(tmp_path), {"backup_mode": "incremental"}, True)
+
+    with patch("functions.dedup_worker.backup_folder_incremental", return_value=("m.json", 3, 2048)), \
+         patch("functions.dedup_worker.backup_folder") as full_backup, \
+         patch("functions.dedup_worker.find_mbox_files", return_value=[]), \
+         patch("functions.dedup_worker.process_mboxes", return_value=([], "", 0)):
+
+        events = run_worker(worker)
+
+    full_backup.assert_not_called()
+    assert any(event[0] == "output" and "3 changed files stored" in event[1] for event in events)
+    assert events[-1] == ("finished", 0, False)
+
+
+def test_dedup_worker_reports_cross_folder_duplicates(tmp_path):
+    backup = tmp_path / "backup.zip"
+    backup.write_bytes(b"zip")
+    inbox = tmp_path / "Inbox"
+    archive = tmp_path / "Archive"
+    inbox.write_bytes(b"From a\nSubject: A\n\nBody\n\n")
+    archive.write_bytes(b"From b\nSubject: A\n\nBody\n\nFrom c\nSubject: C\n\nBody\n\n")
+
+    worker = DedupWorker(str(tmp_path), {"cross_folder_report": "True", "incremental_dedup": "False"}, True)
+
+    with patch("functions.dedup_worker.backup_folder", return_value=str(backup)), \
+         patch("functions.dedup_worker.find_mbox_files", return_value=[str(inbox), str(archive)]):
+
+        events = run_worker(worker)
+
+    assert ("output", "1 messages (25.00 B) also exist in another folder. Turn on global dedup to remove them.") in events
+    assert events[-1] == ("finished", 0, False)
+
+
+def test_dedup_worker_skips_cross_folder_report_with_global_dedup(tmp_path):
+    worker = DedupWorker(str(tmp_path), {"cross_folder_report": "True", "global_dedup": "True"}, True)
+
+    with patch("functions.dedup_worker.backup_folder", return_value=str(tmp_path)), \
+         patch("functions.dedup_worker.find_mbox_files", return_value=[]), \
+         patch("functions.dedup_worker.process_mboxes", return_value=([], "", 0)), \
+         patch("functions.dedup_worker.find_profile_duplicates") as mock_report:
+
+        run_worker(worker)
+
+    mock_report.assert_not_called()
+
+
+def test_dedup_worker_cancel_after_last_mailbox_is_not_reported_as_cancelled(tmp_path):
+    backup = tmp_path / "backup.zip"
+    backup.write_bytes(b"zip")
+    worker = DedupWorker(str(tmp_path), {"dedup_workers": 1}, True)
+
+    def fake_process(mboxes, progress_callback, workers, result_callback, is_cancelled, **kwargs):
+        result_callback("Inbox", "Deleted 1 duplicate messages from mbox Inbox\n", 1)
+        progress_callback(10, 10)
+        worker.cancel()  # Pressed after the last mailbox was done
+        return mboxes, "", 1
+
+    with patch("functions.dedup_worker.backup_folder", return_value=str(backup)), \
+         patch("functions.dedup_worker.find_mbox_files", return_value=["Inbox"]), \
+         patch("functions.dedup_worker.process_mboxes", side_effect=fake_process):
+
+        events = run_worker(worker)
+
+    assert events[-1] == ("finished", 1, False)
+
+
+def test_dedup_worker_cancel_between_mailboxes_is_reported_as_cancelled(tmp_path):
+    backup = tmp_path / "backup.zip"
+    backup.write_bytes(b"zip")
+    worker = DedupWorker(str(tmp_path), {"dedup_workers": 1}, True)
+
+    def fake_process(mboxes, progress_callback, workers, result_callback, is_cancelled, **kwargs):
+        progress_callback(4, 10)
+        worker.cancel()
+        return mboxes, "", 0
+
+    with patch("functions.dedup_worker.backup_folder", return_value=str(backup)), \
+         patch("functions.dedup_worker.find_mbox_files", return_value=["Inbox", "Sent"]), \
+         patch("functions.dedup_worker.process_mboxes", side_effect=fake_process):
+
+        events = run_worker(worker)
+
+    assert events[-1] == ("finished", 0, True)
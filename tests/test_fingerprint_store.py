@@ -0,0 +1,105 @@
+import pytest
+
+from functions.fingerprint_store import FingerprintStore, find_profile_duplicates, summarize_duplicate_groups
+from functions.global_index import GlobalFingerprintIndex
+from functions.process_mboxes import process_mboxes
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr("functions.fingerprint_store.np", None)
+
+    return request.param
+
+
+def test_fingerprint_store_finds_duplicate_groups(backend):
+    store = FingerprintStore(digest_size=2)
+    store.add("Inbox", 0, 10, b"bb")
+    store.add("Inbox", 10, 10, b"aa")
+    store.add("Archive", 0, 10, b"bb")
+    store.add("Archive", 10, 5, b"cc")
+    store.add("Sent", 0, 10, b"bb")
+    store.add("Sent", 10, 10, b"aa")
+
+    assert len(store) == 6
+    assert store.find_duplicate_groups() == [
+        [("Inbox", 0, 10), ("Archive", 0, 10), ("Sent", 0, 10)],
+        [("Inbox", 10, 10), ("Sent", 10, 10)],
+    ]
+
+
+def test_fingerprint_store_empty_and_wrong_digest_size(backend):
+    store = FingerprintStore(digest_size=4)
+
+    assert store.find_duplicate_groups() == []
+
+    with pytest.raises(ValueError):
+        store.add("Inbox", 0, 1, b"abc")
+
+
+def test_fingerprint_store_to_array():
+    np = pytest.importorskip("numpy")
+    store = FingerprintStore(digest_size=2)
+    store.add("Inbox", 5, 7, b"ab")
+
+    table = store.to_array()
+
+    assert table["digest"][0] == b"ab"
+    assert (table["mbox"][0], table["offset"][0], table["length"][0]) == (0, 5, 7)
+    assert table.dtype["digest"] == np.dtype("S2")
+
+
+def test_find_profile_duplicates_matches_global_dedup(tmp_path, backend):
+    inbox = tmp_path / "Inbox"
+    archive = tmp_path / "Archive"
+    inbox.write_bytes(b"From a\nSubject: A\n\nBody\n\nFrom b\nSubject: B\n\nOther body\n\n")
+    archive.write_bytes(b"From c\nSubject: A\r\n\r\nBody\r\n\r\nFrom d\nSubject: C\n\nBody\n\n")
+
+    groups = find_profile_duplicates([str(inbox), str(archive)])
+
+    assert groups == [[(str(inbox), 0, 25), (str(archive), 0, 29)]]
+
+    index = GlobalFingerprintIndex()
+    try:
+        _, _, deleted = process_mboxes([str(inbox), str(archive)], global_index=index, survivor_policy="priority",
+                                       folder_priority=["Inbox"])
+    finally:
+        index.close()
+
+    assert deleted == sum(len(group) - 1 for group in groups)
+
+
+def test_summarize_duplicate_groups():
+    groups = [
+        [("Inbox", 0, 10), ("Archive", 0, 10), ("Sent", 40, 10)],
+        [("Inbox", 10, 7), ("Archive", 10, 7)],
+    ]
+
+    copies, size, per_mbox = summarize_duplicate_groups(groups)
+
+    assert (copies, size) == (3, 27)
+    assert per_mbox == {"Archive": 2, "Sent": 1}
+    assert summarize_duplicate_groups([])[:2] == (0, 0)
+
+
+def test_find_profile_duplicates_skips_unreadable_mailbox(tmp_path):
+    inbox = tmp_path / "Inbox"
+    archive = tmp_path / "Archive"
+    broken = tmp_path / "Broken"
+    inbox.write_bytes(b"From a\nSubject: A\n\nBody\n\n")
+    archive.write_bytes(b"From b\nSubject: A\n\nBody\n\n")
+    broken.mkdir()
+
+    groups = find_profile_duplicates([str(inbox), str(broken), str(archive)])
+
+    assert groups == [[(str(inbox), 0, 25), (str(archive), 0, 25)]]
+
+
+def test_find_profile_duplicates_stops_when_cancelled(tmp_path):
+    inbox = tmp_path / "Inbox"
+    inbox.write_bytes(b"From a\nSubject: A\n\nBody\n\n")
+
+    assert find_profile_duplicates([str(inbox)], is_cancelled=lambda: True) is None
@@ -1,11 +1,19 @@
 import hashlib
 from email.message import EmailMessage
 
+from functions import fingerprinting
 from functions.fingerprinting import (
+    count_cr,
+    get_one_msg_fingerprint_canonical,
     get_one_msg_fingerprint_simple,
     get_one_msg_fingerprint_with_body,
     get_one_msg_fingerprint_strict,
+    get_raw_msg_fingerprint_canonical,
+    get_raw_msg_fingerprint_strict,
+    get_raw_msg_header_key,
+    get_raw_msg_normalized_length,
 )
+from functions.mbox_reader import get_message_content
 
 
 def make_message(
@@ -105,3 +113,148 @@ def test_strict_fingerprint_is_md5():
     # MD5 hex digest is always 32 chars
     assert isinstance(fp, str)
     assert len(fp) == 32
+
+
+def test_strict_fingerprint_of_raw_bytes_ignores_from_line():
+    content = make_message().as_bytes()
+
+    fp1 = get_one_msg_fingerprint_strict(b"From - Mon Jan  1 00:00:00 2024\n" + content + b"\n")
+    fp2 = get_one_msg_fingerprint_strict(b"From - Tue Feb  2 00:00:00 2025\n" + content + b"\n")
+
+    assert fp1 == fp2
+    assert fp1 == hashlib.md5(content.replace(b"\r\n", b"\n")).hexdigest()
+
+
+def test_strict_fingerprint_raw_digest_and_backend():
+    msg = make_message()
+    content = msg.as_bytes().replace(b"\r\n", b"\n")
+
+    assert get_one_msg_fingerprint_strict(msg, hex_digest=False) == hashlib.md5(content).digest()
+    assert get_one_msg_fingerprint_strict(msg, "sha1") == hashlib.sha1(content).hexdigest()
+
+
+def test_strict_fingerprint_chunked_crlf_folding_is_bit_identical(monkeypatch):
+    monkeypatch.setattr("functions.fingerprinting.HASH_CHUNK_SIZE", 7)
+
+    # CRLF pairs land on every possible chunk boundary, plus a stray CR
+    raw = b"From - x\r\n" + b"Subject: A\r\n\r\n" + b"line\r\r\n" * 20 + b"end\r\n\r\n"
+    content = raw[len(b"From - x\r\n"):-2]
+
+    expected = hashlib.md5(content.replace(b"\r\n", b"\n")).hexdigest()
+
+    assert get_one_msg_fingerprint_strict(raw) == expected
+
+
+def test_strict_fingerprint_without_crlf_is_hashed_in_chunks(monkeypatch):
+    monkeypatch.setattr("functions.fingerprinting.HASH_CHUNK_SIZE", 5)
+    raw = b"From - x\nSubject: A\n\n" + b"body line\n" * 10 + b"\n"
+    content = raw[len(b"From - x\n"):-1]
+
+    assert get_one_msg_fingerprint_strict(raw) == hashlib.md5(content).hexdigest()
+
+
+def test_header_key_ignores_body_and_line_endings():
+    lf = b"From a\nSubject: A\n\nBody 1\n"
+    crlf = b"From b\nSubject: A\r\n\r\nBody 2\r\n"
+    other = b"From c\nSubject: B\n\nBody 1\n"
+
+    key = get_raw_msg_header_key(lf, 0, len(lf))
+
+    assert key == get_raw_msg_header_key(crlf, 0, len(crlf))
+    assert key != get_raw_msg_header_key(other, 0, len(other))
+    assert key == hashlib.md5(b"Subject: A\n").hexdigest()
+
+
+def test_normalized_length_is_equal_for_equal_strict_fingerprints(monkeypatch):
+    monkeypatch.setattr("functions.fingerprinting.HASH_CHUNK_SIZE", 5)
+
+    pairs = [
+        (b"From a\nSubject: A\n\nBody\n\n", b"From b\r\nSubject: A\r\n\r\nBody\r\n\r\n"),
+        (b"From a\nSub\r\r\nject\n\n", b"From b\nSub\r\r\nject\r\n\r\n"),
+    ]
+
+    for lf, crlf in pairs:
+        assert get_one_msg_fingerprint_strict(lf) == get_one_msg_fingerprint_strict(crlf)
+        assert get_raw_msg_normalized_length(lf, 0, len(lf)) == get_raw_msg_normalized_length(crlf, 0, len(crlf))
+
+    raw = b"From a\nSubject: A\n\nBody\n\n"
+    assert get_raw_msg_normalized_length(raw, 0, len(raw)) == len(get_message_content(raw))
+
+
+def test_count_cr_counts_across_chunks(monkeypatch):
+    monkeypatch.setattr("functions.fingerprinting.HASH_CHUNK_SIZE", 4)
+    raw = b"abc\r\nde\r\r\n\r\n"
+
+    assert count_cr(raw) == 4
+    assert count_cr(raw, 5, 9) == 2
+    assert count_cr(b"no line breaks") == 0
+
+
+def test_ignore_status_matches_copies_with_different_flags():
+    read = b"From x\r\nX-Mozilla-Status: 0001\r\nSubject: hi\r\nX-Mozilla-Keys: $label1  \r\n\r\nbody\r\n"
+    unread = b"From x\nSubject: hi\nX-Mozilla-Status: 0000\n\nbody\n"
+    plain = b"From x\nSubject: hi\n\nbody\n"
+
+    for func in (get_raw_msg_fingerprint_strict, get_raw_msg_header_key):
+        assert func(read, 0, len(read)) != func(unread, 0, len(unread))
+        assert (
+            func(read, 0, len(read), ignore_status=True)
+            == func(unread, 0, len(unread), ignore_status=True)
+            == func(plain, 0, len(plain))
+        )
+
+    assert (
+        get_raw_msg_normalized_length(read, 0, len(read), ignore_status=True)
+        == get_raw_msg_normalized_length(unread, 0, len(unread), ignore_status=True)
+        == get_raw_msg_normalized_length(plain, 0, len(plain))
+    )
+
+
+def make_mime_message(body_cte, attachment, subject="Quarterly report for the team"):
+    msg = EmailMessage()
+    msg["From"] = "alice@example.com"
+    msg["Subject"] = subject
+    msg["Message-ID"] = "<abc@example.com>"
+    msg.set_content("Zażółć gęślą jaźń\nsee attachment\n", cte=body_cte)
+    msg.add_attachment(attachment, maintype="application", subtype="octet-stream", filename="data.bin")
+    return msg
+
+
+def test_canonical_fingerprint_ignores_transfer_encoding_and_folding():
+    attachment = bytes(range(256)) * 10
+    qp = make_mime_message("quoted-printable", attachment)
+    b64 = make_mime_message("base64", attachment)
+
+    raw_b64 = b"From x\r\n" + b64.as_bytes().replace(b"\n", b"\r\n").replace(
+        b"Subject: Quarterly report", b"Subject: Quarterly\r\n report"
+    )
+
+    assert get_one_msg_fingerprint_strict(qp) != get_one_msg_fingerprint_strict(b64)
+    assert get_one_msg_fingerprint_canonical(qp) == get_one_msg_fingerprint_canonical(b64)
+    assert get_one_msg_fingerprint_canonical(qp) == get_raw_msg_fingerprint_canonical(raw_b64, 0, len(raw_b64))
+
+    other_attachment = make_mime_message("quoted-printable", attachment[:-1])
+    assert get_one_msg_fingerprint_canonical(qp) != get_one_msg_fingerprint_canonical(other_attachment)
+
+
+def test_canonical_fingerprint_caches_attachment_digests(monkeypatch):
+    monkeypatch.setattr(fingerprinting, "PART_CACHE_MIN_SIZE", 16)
+    attachment = b"attachment bytes" * 100
+    cache = {}
+
+    first = get_one_msg_fingerprint_canonical(make_mime_message("8bit", attachment), part_cache=cache)
+    unique = get_one_msg_fingerprint_canonical(make_mime_message("8bit", attachment * 2), part_cache=cache)
+
+    # Attachments with a size of their own are not hashed for the cache
+    assert all(len(key) == 2 for key in cache)
+
+    second = get_one_msg_fingerprint_canonical(make_mime_message("8bit", attachment), part_cache=cache)
+    assert second == first
+    content_keys = [key for key in cache if len(key) == 3]
+    assert len(content_keys) == 1
+
+    # The third copy finds the attachment in the cache instead of decoding it
+    cache[content_keys[0]] = b"cached"
+    third = get_one_msg_fingerprint_canonical(make_mime_message("8bit", attachment), part_cache=cache)
+
+    assert third not in (first, unique)
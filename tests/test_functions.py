@@ -12,6 +12,7 @@ from functions.functions import (
     is_thunderbird_running,
     calc_duration,
     format_size,
+    get_cfg_bool,
 )
 
 # -------------------------------------------------
@@ -109,3 +110,17 @@ def test_format_size_gigabytes():
 
 def test_format_size_rounding():
     assert format_size(1536) == "1.50 KB"
+
+
+# -------------------------------------------------
+# get_cfg_bool
+# -------------------------------------------------
+def test_get_cfg_bool_accepts_strings_and_booleans():
+    assert get_cfg_bool({"flag": "True"}, "flag") is True
+    assert get_cfg_bool({"flag": "False"}, "flag") is False
+    assert get_cfg_bool({"flag": True}, "flag") is True
+
+
+def test_get_cfg_bool_missing_key_uses_default():
+    assert get_cfg_bool({}, "flag") is False
+    assert get_cfg_bool({}, "flag", default=True) is True
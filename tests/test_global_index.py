@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from functions.global_index import (
+    GlobalFingerprintIndex,
+    get_folder_priority,
+    order_mboxes_by_policy,
+)
+
+
+def test_global_index_behaves_like_a_set(tmp_path, monkeypatch):
+    monkeypatch.setattr("functions.global_index.INSERT_BATCH_SIZE", 2)
+    index = GlobalFingerprintIndex(str(tmp_path / "index.sqlite"))
+
+    index.add("a")
+    assert "a" in index  # Still buffered
+
+    index.update(["b", "c", "a"])
+    assert "b" in index
+    assert "c" in index
+    assert "d" not in index
+    assert len(index) == 3
+    index.close()
+
+
+def test_global_index_temporary_file_is_removed():
+    index = GlobalFingerprintIndex()
+    path = index._temp_path
+    index.add("a")
+
+    assert os.path.exists(path)
+    index.close()
+    assert not os.path.exists(path)
+
+
+def test_get_folder_priority_matches_folder_names():
+    priority = ["Inbox", "Archives"]
+
+    assert get_folder_priority(os.path.join("Local Folders", "Inbox"), priority) == 0
+    assert get_folder_priority(os.path.join("Local Folders", "Archives.sbd", "2023"), priority) == 1
+    assert get_folder_priority(os.path.join("Local Folders", "Sent"), priority) == 2
+
+
+def test_order_mboxes_by_policy(tmp_path):
+    old = tmp_path / "Archives"
+    new = tmp_path / "Inbox"
+    old.write_bytes(b"x" * 10)
+    new.write_bytes(b"x" * 20)
+    os.utime(old, (1000, 1000))
+    os.utime(new, (2000, 2000))
+    mboxes = [str(new), str(old)]
+
+    assert order_mboxes_by_policy(mboxes, "oldest") == [str(old), str(new)]
+    assert order_mboxes_by_policy(mboxes, "largest") == [str(new), str(old)]
+    assert order_mboxes_by_policy(mboxes, "priority", ["Archives"]) == [str(old), str(new)]
+
+
+def test_order_mboxes_by_unknown_policy_raises():
+    with pytest.raises(ValueError):
+        order_mboxes_by_policy(["Inbox"], "newest")
@@ -0,0 +1,36 @@
+import hashlib
+
+import pytest
+
+from functions.hashing import get_hash_backends, hash_bytes, new_hasher
+
+
+def test_standard_backends_are_available():
+    backends = get_hash_backends()
+
+    assert "md5" in backends
+    assert "sha1" in backends
+    assert "blake2b" in backends
+
+
+def test_hash_bytes_returns_raw_digest():
+    assert hash_bytes(b"hello", "md5") == hashlib.md5(b"hello").digest()
+    assert hash_bytes(b"hello", "sha1") == hashlib.sha1(b"hello").digest()
+
+
+def test_blake2b_uses_short_digest():
+    assert len(hash_bytes(b"hello", "blake2b")) == 16
+
+
+@pytest.mark.parametrize("hash_name", get_hash_backends())
+def test_every_backend_hashes_incrementally(hash_name):
+    hash_object = new_hasher(hash_name)
+    hash_object.update(b"hel")
+    hash_object.update(b"lo")
+
+    assert hash_object.digest() == hash_bytes(b"hello", hash_name)
+
+
+def test_unknown_backend_raises():
+    with pytest.raises(ValueError):
+        new_hasher("crc32")
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+from functions.incremental_backup import (
+    backup_folder_incremental,
+    list_manifests,
+    load_manifest,
+    restore_backup,
+)
+
+CFG = {"backup_zip_file_compr_level": "6"}
+
+
+def make_mail_folder(tmp_path):
+    source_folder = tmp_path / "mail_folder"
+    (source_folder / "Inbox.sbd").mkdir(parents=True)
+    (source_folder / "Inbox").write_bytes(b"From a\nhello\n")
+    (source_folder / "Inbox.sbd" / "Sub").write_bytes(b"From b\nworld\n")
+    return source_folder
+
+
+def test_backup_folder_incremental_stores_only_changed_files(tmp_path):
+    source_folder = make_mail_folder(tmp_path)
+    backup_dir = str(tmp_path / "backups")
+
+    _, stored_files, stored_bytes = backup_folder_incremental(str(source_folder), CFG, backup_dir)
+    assert stored_files == 2
+    assert stored_bytes > 0
+
+    # Nothing changed: nothing new is stored
+    _, stored_files, stored_bytes = backup_folder_incremental(str(source_folder), CFG, backup_dir)
+    assert (stored_files, stored_bytes) == (0, 0)
+
+    (source_folder / "Inbox").write_bytes(b"From a\nhello again\n")
+    manifest_path, stored_files, _ = backup_folder_incremental(str(source_folder), CFG, backup_dir)
+    assert stored_files == 1
+
+    assert len(list_manifests(backup_dir)) == 3
+    paths = {entry["path"] for entry in load_manifest(manifest_path)["files"]}
+    assert paths == {"Inbox", "Inbox.sbd/Sub"}
+
+
+def test_restore_backup_reconstructs_each_point_in_time(tmp_path):
+    source_folder = make_mail_folder(tmp_path)
+    backup_dir = str(tmp_path / "backups")
+
+    first, _, _ = backup_folder_incremental(str(source_folder), CFG, backup_dir)
+    (source_folder / "Inbox").write_bytes(b"From a\nchanged\n")
+    second, _, _ = backup_folder_incremental(str(source_folder), CFG, backup_dir)
+
+    assert restore_backup(first, str(tmp_path / "restore1")) == 2
+    restore_backup(second, str(tmp_path / "restore2"))
+
+    assert (tmp_path / "restore1" / "Inbox").read_bytes() == b"From a\nhello\n"
+    assert (tmp_path / "restore2" / "Inbox").read_bytes() == b"From a\nchanged\n"
+    assert (tmp_path / "restore2" / "Inbox.sbd" / "Sub").read_bytes() == b"From b\nworld\n"
+
+    entry = load_manifest(first)["files"][0]
+    restored = tmp_path / "restore1" / entry["path"]
+    assert os.stat(restored).st_mtime_ns == entry["mtime_ns"]
+
+
+def test_restore_backup_fails_if_object_is_missing(tmp_path):
+    source_folder = make_mail_folder(tmp_path)
+    backup_dir = tmp_path / "backups"
+
+    manifest_path, _, _ = backup_folder_incremental(str(source_folder), CFG, str(backup_dir))
+
+    for root, _, files in os.walk(backup_dir / "objects"):
+        for file in files:
+            os.remove(os.path.join(root, file))
+
+    with pytest.raises(FileNotFoundError):
+        restore_backup(manifest_path, str(tmp_path / "restore"))
@@ -0,0 +1,121 @@
+import mailbox
+from email.message import EmailMessage
+
+from functions.mbox_reader import (
+    MappedMbox,
+    get_header_bounds,
+    get_message_content,
+    iter_message_ranges,
+    iter_raw_messages,
+)
+
+
+def create_mbox(path, subjects):
+    mbox = mailbox.mbox(path)
+
+    for subject in subjects:
+        msg = EmailMessage()
+        msg["From"] = "a@test.com"
+        msg["Subject"] = subject
+        msg.set_content(f"Body {subject}")
+        mbox.add(msg)
+
+    mbox.flush()
+    mbox.close()
+
+
+def test_iter_raw_messages_splits_on_from_lines(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    create_mbox(mbox_path, ["A", "B", "C"])
+
+    raw_messages = list(iter_raw_messages(str(mbox_path)))
+
+    assert len(raw_messages) == 3
+    assert all(raw.data.startswith(b"From ") for raw in raw_messages)
+    assert b"Subject: B" in raw_messages[1].data
+
+
+def test_iter_raw_messages_offsets_cover_the_file(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    create_mbox(mbox_path, ["A", "B"])
+    content = mbox_path.read_bytes()
+
+    raw_messages = list(iter_raw_messages(str(mbox_path)))
+
+    for raw in raw_messages:
+        assert content[raw.offset:raw.offset + raw.length] == raw.data
+
+    assert sum(raw.length for raw in raw_messages) == len(content)
+
+
+def test_iter_raw_messages_empty_file(tmp_path):
+    mbox_path = tmp_path / "Empty"
+    mbox_path.write_bytes(b"")
+
+    assert list(iter_raw_messages(str(mbox_path))) == []
+
+
+def test_get_message_content_matches_mailbox_module(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    create_mbox(mbox_path, ["A", "B"])
+
+    mbox = mailbox.mbox(mbox_path)
+    expected = [mbox.get_bytes(key) for key in mbox.keys()]
+    mbox.close()
+
+    contents = [get_message_content(raw.data) for raw in iter_raw_messages(str(mbox_path))]
+
+    assert contents == expected
+
+
+def test_iter_message_ranges_finds_from_lines():
+    buffer = b"junk\nFrom a\nx\n\nFrom b\ny\n>From c\nFrom d\n"
+
+    ranges = list(iter_message_ranges(buffer))
+
+    assert [buffer[offset:offset + length] for offset, length in ranges] == [
+        b"From a\nx\n\n",
+        b"From b\ny\n>From c\n",
+        b"From d\n",
+    ]
+
+
+def test_iter_message_ranges_from_start_offset():
+    buffer = b"From a\nx\nFrom b\ny\n"
+
+    assert list(iter_message_ranges(buffer, 9)) == [(9, 9)]
+
+
+def test_mapped_mbox_gives_zero_copy_views(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    create_mbox(mbox_path, ["A", "B"])
+    content = mbox_path.read_bytes()
+
+    with MappedMbox(str(mbox_path)) as mapped:
+        ranges = list(mapped.iter_ranges())
+        offset, length = ranges[1]
+        view = mapped.view(offset, length)
+        assert view == content[offset:offset + length]
+        view.release()
+
+    assert len(ranges) == 2
+
+
+def test_mapped_mbox_empty_file(tmp_path):
+    mbox_path = tmp_path / "Empty"
+    mbox_path.write_bytes(b"")
+
+    with MappedMbox(str(mbox_path)) as mapped:
+        assert list(mapped.iter_ranges()) == []
+
+
+def test_get_header_bounds_stops_at_first_empty_line():
+    raw = b"Subject: A\nFrom: b\n\nBody\n\nMore\n"
+    assert get_header_bounds(raw) == (0, 19)
+
+    crlf = b"Subject: A\r\n\r\nBody\r\n"
+    assert get_header_bounds(crlf) == (0, 12)
+
+    assert get_header_bounds(b"\nBody\n") == (0, 0)
+    assert get_header_bounds(b"Subject: A\n") == (0, 11)
+    assert get_header_bounds(b"xxSubject: A\n\nB", 2, 15) == (2, 13)
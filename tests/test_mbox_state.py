@@ -0,0 +1,155 @@
+import os
+
+from functions.mbox_state import MboxStateStore, get_mbox_signature
+
+
+def test_unrecorded_mailbox_is_not_unchanged(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\nSubject: A\n")
+
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+
+    assert store.get(str(mbox_path)) is None
+    assert store.is_unchanged(str(mbox_path)) is False
+    store.close()
+
+
+def test_recorded_mailbox_is_unchanged(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\nSubject: A\n")
+
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+    store.record(str(mbox_path))
+
+    assert store.get(str(mbox_path)) == get_mbox_signature(str(mbox_path))
+    assert store.is_unchanged(str(mbox_path)) is True
+    store.close()
+
+
+def test_modified_mailbox_is_changed(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\nSubject: A\n")
+
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+    store.record(str(mbox_path))
+
+    # Same size and mtime, different content: only the digest can tell
+    stat = os.stat(mbox_path)
+    mbox_path.write_bytes(b"From a\nSubject: B\n")
+    os.utime(mbox_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert store.is_unchanged(str(mbox_path)) is False
+    store.close()
+
+
+def test_state_survives_reopening(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\nSubject: A\n")
+    db_path = str(tmp_path / "state.sqlite")
+
+    store = MboxStateStore(db_path)
+    store.record(str(mbox_path))
+    store.close()
+
+    store = MboxStateStore(db_path)
+    assert store.is_unchanged(str(mbox_path)) is True
+    store.close()
+
+
+def test_missing_mailbox_is_changed(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\nSubject: A\n")
+
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+    store.record(str(mbox_path))
+    mbox_path.unlink()
+
+    assert store.is_unchanged(str(mbox_path)) is False
+    store.close()
+
+
+def test_resume_point_for_appended_mailbox(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\nSubject: A\n\n")
+
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+    store.record(str(mbox_path), ["fp-a"])
+
+    with open(mbox_path, "ab") as f:
+        f.write(b"From b\nSubject: B\n\n")
+
+    assert store.get_resume_point(str(mbox_path)) == (19, {"fp-a"})
+    store.close()
+
+
+def test_no_resume_point_when_old_part_changed(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\nSubject: A\n\n")
+
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+    store.record(str(mbox_path), ["fp-a"])
+
+    mbox_path.write_bytes(b"From a\nSubject: X\n\nFrom b\nSubject: B\n\n")
+
+    assert store.get_resume_point(str(mbox_path)) is None
+    store.close()
+
+
+def test_no_resume_point_when_not_grown(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\nSubject: A\n\n")
+
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+    store.record(str(mbox_path), ["fp-a"])
+
+    assert store.get_resume_point(str(mbox_path)) is None
+    store.close()
+
+
+def test_record_append_adds_fingerprints(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\nSubject: A\n\n")
+
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+    store.record(str(mbox_path), ["fp-a"])
+    store.record(str(mbox_path), ["fp-b"], append=True)
+    assert store.get_fingerprints(str(mbox_path)) == {"fp-a", "fp-b"}
+
+    store.record(str(mbox_path), ["fp-c"])
+    assert store.get_fingerprints(str(mbox_path)) == {"fp-c"}
+    store.close()
+
+
+def test_record_stores_unhashed_messages_by_length(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\nSubject: A\n\n")
+
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+    store.record(str(mbox_path), ["fp-a"], unhashed=[(0, 12), (40, 12), (80, 30)])
+    assert store.get_unhashed(str(mbox_path)) == {12: [0, 40], 30: [80]}
+
+    store.record(str(mbox_path), unhashed=[(120, 30)], append=True)
+    assert store.get_unhashed(str(mbox_path)) == {12: [0, 40], 30: [80, 120]}
+
+    store.record(str(mbox_path), ["fp-b"])
+    assert store.get_unhashed(str(mbox_path)) == {}
+    store.close()
+
+
+def test_changed_settings_clear_the_store(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\nSubject: A\n\n")
+    db_path = str(tmp_path / "state.sqlite")
+
+    store = MboxStateStore(db_path, settings={"global": False})
+    store.record(str(mbox_path), ["fp-a"])
+    store.close()
+
+    store = MboxStateStore(db_path, settings={"global": False})
+    assert store.is_unchanged(str(mbox_path)) is True
+    store.close()
+
+    store = MboxStateStore(db_path, settings={"global": True})
+    assert store.is_unchanged(str(mbox_path)) is False
+    assert store.get_fingerprints(str(mbox_path)) == set()
+    store.close()
@@ -0,0 +1,70 @@
+from functions.mozilla_status import (
+    MSG_FLAG_EXPUNGED,
+    MSG_FLAG_MARKED,
+    MSG_FLAG_READ,
+    find_keys_field,
+    find_status_field,
+    format_keys,
+    format_status,
+    get_status_spans,
+    merge_keys,
+    merge_status,
+)
+
+MESSAGE = (
+    b"From x\n"
+    b"X-Mozilla-Status: 0001\n"
+    b"X-Mozilla-Status2: 00000000\n"
+    b"Subject: hi\n"
+    b"X-Mozilla-Keys: $label1\n"
+    b"                 \n"
+    b"\n"
+    b"X-Mozilla-Status: not a header\n"
+)
+
+
+def test_get_status_spans_finds_whole_header_lines():
+    spans = get_status_spans(MESSAGE, 0, len(MESSAGE))
+
+    assert [MESSAGE[start:end] for start, end in spans] == [
+        b"X-Mozilla-Status: 0001\n",
+        b"X-Mozilla-Status2: 00000000\n",
+        b"X-Mozilla-Keys: $label1\n                 \n",
+    ]
+
+
+def test_find_status_field_and_format_status():
+    position, flags = find_status_field(MESSAGE, 0, len(MESSAGE))
+    assert MESSAGE[position:position + 4] == b"0001"
+    assert flags == MSG_FLAG_READ
+
+    patched = MESSAGE[:position] + format_status(MSG_FLAG_READ | MSG_FLAG_MARKED) + MESSAGE[position + 4:]
+
+    assert patched == MESSAGE.replace(b"Status: 0001", b"Status: 0005", 1)
+
+
+def test_find_keys_field_and_merge_into_padding():
+    raw = b"From x\r\nX-Mozilla-Keys: $label1          \r\nSubject: hi\r\n\r\nbody\r\n"
+    position, size, keys = find_keys_field(raw, 0, len(raw))
+
+    assert raw[position:position + size] == b" $label1          "
+    assert keys == [b"$label1"]
+
+    merged = merge_keys(keys, [[b"$label2", b"$label1"], [b"$label2"]])
+
+    assert merged == [b"$label1", b"$label2"]
+    assert format_keys(merged, size) == b" $label1 $label2".ljust(size)
+    assert format_keys(merged + [b"$label3"], size) is None
+    assert find_keys_field(b"From x\nSubject: hi\n\nbody\n", 0, 26) is None
+
+
+def test_find_status_field_without_header():
+    raw = b"From x\nSubject: hi\n\nbody\n"
+    assert find_status_field(raw, 0, len(raw)) is None
+
+
+def test_merge_status_read_and_starred_win_expunged_only_if_all():
+    assert merge_status(0, [MSG_FLAG_READ, MSG_FLAG_MARKED]) == MSG_FLAG_READ | MSG_FLAG_MARKED
+    assert merge_status(MSG_FLAG_EXPUNGED, [MSG_FLAG_READ]) == MSG_FLAG_READ
+    assert merge_status(MSG_FLAG_EXPUNGED, [MSG_FLAG_EXPUNGED]) == MSG_FLAG_EXPUNGED
+    assert merge_status(0, [MSG_FLAG_EXPUNGED]) == 0
@@ -0,0 +1,47 @@
+import os
+
+from functions.msf_summary import get_msf_path, get_reindex_cost, invalidate_msf, needs_reindex
+
+
+def test_invalidate_msf_deletes_only_the_index(tmp_path):
+    mbox = tmp_path / "Inbox"
+    mbox.write_bytes(b"From a\n")
+    msf = tmp_path / "Inbox.msf"
+    msf.write_bytes(b"// <!-- <mdb:mork:z v=\"1.4\"/> -->")
+
+    assert get_msf_path(str(mbox)) == str(msf)
+    assert invalidate_msf(str(mbox)) is True
+    assert not msf.exists()
+    assert mbox.exists()
+    assert invalidate_msf(str(mbox)) is False
+
+
+def test_needs_reindex_when_index_is_missing_or_older(tmp_path):
+    mbox = tmp_path / "Inbox"
+    mbox.write_bytes(b"From a\n")
+    assert needs_reindex(str(mbox)) is True
+
+    msf = tmp_path / "Inbox.msf"
+    msf.write_bytes(b"mork")
+    os.utime(mbox, ns=(1_000_000_000, 1_000_000_000))
+    os.utime(msf, ns=(2_000_000_000, 2_000_000_000))
+    assert needs_reindex(str(mbox)) is False
+
+    # The mailbox was rewritten after Thunderbird last wrote the index
+    os.utime(mbox, ns=(3_000_000_000, 3_000_000_000))
+    assert needs_reindex(str(mbox)) is True
+
+
+def test_get_reindex_cost_lists_biggest_first(tmp_path):
+    small = tmp_path / "Small"
+    small.write_bytes(b"From a\n")
+    big = tmp_path / "Big"
+    big.write_bytes(b"From b\n" * 100)
+    indexed = tmp_path / "Indexed"
+    indexed.write_bytes(b"From c\n")
+    os.utime(indexed, ns=(1_000_000_000, 1_000_000_000))
+    (tmp_path / "Indexed.msf").write_bytes(b"mork")
+
+    cost = get_reindex_cost([str(small), str(big), str(indexed), str(tmp_path / "Missing")])
+
+    assert cost == [(str(big), 700), (str(small), 7)]
@@ -0,0 +1,123 @@
+import os
+import zipfile
+
+import pytest
+
+from functions.parallel_zip import (
+    ZIP_BZIP2,
+    ZIP_DEFLATED,
+    ZIP_LZMA,
+    ZIP_STORED,
+    ParallelZipWriter,
+    choose_compression,
+)
+
+
+def write_files(folder):
+    files = {
+        "empty": b"",
+        "small.txt": b"hello world\n" * 10,
+        "Inbox": b"From a\nSubject: Test\n\nbody\n" * 5000,
+        "random.bin": os.urandom(300_000),
+        "Archives.sbd/2023": b"From b\nSubject: Old\n\nold body\n" * 3000,
+        "Räksmörgås": b"utf-8 name",
+    }
+
+    for name, data in files.items():
+        path = folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    return files
+
+
+def create_zip(tmp_path, files, **kwargs):
+    zip_path = tmp_path / "backup.zip"
+
+    with ParallelZipWriter(str(zip_path), **kwargs) as zipf:
+        for name in files:
+            zipf.write(str(tmp_path / "src" / name), name)
+
+    return zip_path
+
+
+def assert_zip_contains(zip_path, files):
+    with zipfile.ZipFile(zip_path) as zipf:
+        assert zipf.testzip() is None
+        assert sorted(zipf.namelist()) == sorted(files)
+
+        for name, data in files.items():
+            assert zipf.read(name) == data
+
+
+def test_parallel_zip_writes_standard_zip(tmp_path):
+    files = write_files(tmp_path / "src")
+
+    zip_path = create_zip(tmp_path, files, level=6, workers=4)
+
+    assert_zip_contains(zip_path, files)
+
+
+def test_parallel_zip_splits_files_into_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr("functions.parallel_zip.BLOCK_SIZE", 1000)
+    files = write_files(tmp_path / "src")
+
+    zip_path = create_zip(tmp_path, files, level=1, workers=3)
+
+    assert_zip_contains(zip_path, files)
+
+
+def test_parallel_zip_level_zero(tmp_path):
+    files = write_files(tmp_path / "src")
+
+    zip_path = create_zip(tmp_path, files, level=0, workers=2)
+
+    assert_zip_contains(zip_path, files)
+
+
+def test_parallel_zip_uses_zip64_when_needed(tmp_path, monkeypatch):
+    # Pretend the 2 GB limit is tiny so every entry and offset needs ZIP64
+    monkeypatch.setattr("functions.parallel_zip.ZIP64_LIMIT", 100)
+    files = write_files(tmp_path / "src")
+
+    zip_path = create_zip(tmp_path, files, level=6, workers=2)
+
+    assert_zip_contains(zip_path, files)
+
+
+@pytest.mark.parametrize("method", [ZIP_STORED, ZIP_BZIP2, ZIP_LZMA])
+def test_parallel_zip_other_methods(tmp_path, method):
+    files = write_files(tmp_path / "src")
+
+    zip_path = create_zip(tmp_path, files, level=6, workers=2, method=method)
+
+    assert_zip_contains(zip_path, files)
+
+    with zipfile.ZipFile(zip_path) as zipf:
+        assert {info.compress_type for info in zipf.infolist()} == {method}
+
+
+def test_parallel_zip_adaptive_stores_incompressible_files(tmp_path):
+    files = write_files(tmp_path / "src")
+
+    zip_path = create_zip(tmp_path, files, level=6, workers=2, adaptive=True)
+
+    assert_zip_contains(zip_path, files)
+
+    with zipfile.ZipFile(zip_path) as zipf:
+        assert zipf.getinfo("random.bin").compress_type == ZIP_STORED
+        assert zipf.getinfo("small.txt").compress_type == ZIP_STORED
+        assert zipf.getinfo("Inbox").compress_type == ZIP_DEFLATED
+
+
+def test_choose_compression(tmp_path):
+    text = tmp_path / "Inbox"
+    text.write_bytes(b"From a\nSubject: Test\n\nbody\n" * 1000)
+    photo = tmp_path / "photo.jpg"
+    photo.write_bytes(b"a" * 5000)
+    mixed = tmp_path / "Attachments"
+    mixed.write_bytes(os.urandom(8000) + b"a" * 2000)
+
+    assert choose_compression(str(text), text.stat().st_size, ZIP_LZMA, 9) == (ZIP_LZMA, 9)
+    assert choose_compression(str(photo), photo.stat().st_size) == (ZIP_STORED, 0)
+    assert choose_compression(str(mixed), mixed.stat().st_size, ZIP_DEFLATED, 6) == (ZIP_DEFLATED, 1)
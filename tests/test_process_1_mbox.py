@@ -1,15 +1,20 @@
-from unittest.mock import MagicMock, patch
+import mailbox
+from email.message import EmailMessage
+from unittest.mock import patch
+
+import pytest
+
+from functions.fingerprinting import get_one_msg_fingerprint_strict, get_raw_msg_fingerprint_strict
 from functions.process_1_mbox import process_one_mbox
 
 
-def test_process_one_mbox_removes_duplicates(tmp_path):
-    mbox_path = tmp_path / "Inbox"
+def write_raw_mbox(path, count):
+    path.write_bytes(b"".join(b"From x\n%d\n" % i for i in range(count)))
 
-    msg1 = MagicMock()
-    msg2 = MagicMock()
-    msg3 = MagicMock()
 
-    messages = [msg1, msg2, msg3]
+def test_process_one_mbox_removes_duplicates(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    write_raw_mbox(mbox_path, 3)
 
     fingerprints = [
         "dup",
@@ -17,35 +22,328 @@ def test_process_one_mbox_removes_duplicates(tmp_path):
         "unique",
     ]
 
-    mock_mbox = MagicMock()
-    mock_mbox.__iter__.return_value = messages
-
-    with patch("functions.process_1_mbox.mailbox.mbox", return_value=mock_mbox), \
-         patch("functions.process_1_mbox.get_one_msg_fingerprint_strict", side_effect=fingerprints), \
-         patch("functions.process_1_mbox.write_mbox_file") as mock_write:
+    with patch("functions.process_1_mbox.get_raw_msg_fingerprint_strict", side_effect=fingerprints), \
+         patch("functions.process_1_mbox.write_mbox_ranges") as mock_write:
 
         _, msg, deleted = process_one_mbox(str(mbox_path))
 
     assert deleted == 1
     assert "Deleted 1 duplicate" in msg
-    mock_write.assert_called_once()
+    mock_write.assert_called_once_with(str(mbox_path), [(0, 9), (18, 9)], {})
 
 
 def test_process_one_mbox_no_duplicates(tmp_path):
     mbox_path = tmp_path / "Inbox"
+    write_raw_mbox(mbox_path, 2)
 
-    msg1 = MagicMock()
-    msg2 = MagicMock()
-
-    mock_mbox = MagicMock()
-    mock_mbox.__iter__.return_value = [msg1, msg2]
-
-    with patch("functions.process_1_mbox.mailbox.mbox", return_value=mock_mbox), \
-         patch("functions.process_1_mbox.get_one_msg_fingerprint_strict", side_effect=["a", "b"]), \
-         patch("functions.process_1_mbox.write_mbox_file") as mock_write:
+    with patch("functions.process_1_mbox.get_raw_msg_fingerprint_strict", side_effect=["a", "b"]), \
+         patch("functions.process_1_mbox.write_mbox_ranges") as mock_write:
 
         _, msg, deleted = process_one_mbox(str(mbox_path))
 
     assert deleted == 0
     assert msg == ""
     mock_write.assert_not_called()
+
+
+def test_process_one_mbox_rewrites_real_mbox(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox = mailbox.mbox(mbox_path)
+
+    for subject in ["A", "B", "A"]:
+        msg = EmailMessage()
+        msg["From"] = "a@test.com"
+        msg["Subject"] = subject
+        msg.set_content(f"Body {subject}")
+        mbox.add(msg)
+
+    mbox.flush()
+    mbox.close()
+
+    _, msg, deleted = process_one_mbox(str(mbox_path))
+
+    mbox = mailbox.mbox(mbox_path)
+    subjects = [message["subject"] for message in mbox]
+    mbox.close()
+
+    assert deleted == 1
+    assert subjects == ["A", "B"]
+
+
+def test_process_one_mbox_resumes_from_offset(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    old = b"From a\nSubject: A\n\n"
+    new = b"From b\nSubject: A\n\nFrom c\nSubject: C\n\n"
+    mbox_path.write_bytes(old + new)
+
+    seen = {get_one_msg_fingerprint_strict(old, hex_digest=False)}
+    (fingerprints, unhashed), _, deleted = process_one_mbox(
+        str(mbox_path),
+        seen=seen,
+        start_offset=len(old),
+        collect_fingerprints=True
+    )
+
+    assert deleted == 1
+    assert mbox_path.read_bytes() == old + b"From c\nSubject: C\n\n"
+    assert fingerprints == [get_one_msg_fingerprint_strict(b"From c\nSubject: C\n\n", hex_digest=False)]
+    assert unhashed == []
+
+
+def test_process_one_mbox_calls_before_rewrite_only_when_rewriting(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    write_raw_mbox(mbox_path, 2)
+    calls = []
+
+    def before_rewrite(path):
+        # The mailbox must still be untouched at this point
+        calls.append((path, mbox_path.read_bytes()))
+
+    with patch("functions.process_1_mbox.get_raw_msg_fingerprint_strict", side_effect=["a", "b"]):
+        process_one_mbox(str(mbox_path), before_rewrite=before_rewrite)
+
+    assert calls == []
+
+    original = mbox_path.read_bytes()
+
+    with patch("functions.process_1_mbox.get_raw_msg_fingerprint_strict", side_effect=["a", "a"]):
+        process_one_mbox(str(mbox_path), before_rewrite=before_rewrite)
+
+    assert calls == [(str(mbox_path), original)]
+    assert mbox_path.read_bytes() == b"From x\n0\n"
+
+
+def test_process_one_mbox_does_not_rewrite_if_before_rewrite_fails(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    write_raw_mbox(mbox_path, 2)
+    original = mbox_path.read_bytes()
+
+    def before_rewrite(path):
+        raise OSError("disk full")
+
+    with patch("functions.process_1_mbox.get_raw_msg_fingerprint_strict", side_effect=["a", "a"]):
+        with pytest.raises(OSError):
+            process_one_mbox(str(mbox_path), before_rewrite=before_rewrite)
+
+    assert mbox_path.read_bytes() == original
+
+
+def test_process_one_mbox_tiered_matches_strict(tmp_path):
+    entries = [
+        b"From a\nSubject: A\n\nBody 1\n\n",
+        b"From b\nSubject: A\n\nBody 2\n\n",        # Same headers, other body: kept
+        b"From c\nSubject: A\r\n\r\nBody 1\r\n\r\n",  # CRLF copy of the first: deleted
+        b"From d\nSubject: B\n\nBody 1\n\n",
+        b"From e\nSubject: B\n\nBody 1\n\n",        # Duplicate: deleted
+    ]
+    strict_path = tmp_path / "Strict"
+    tiered_path = tmp_path / "Tiered"
+    strict_path.write_bytes(b"".join(entries))
+    tiered_path.write_bytes(b"".join(entries))
+
+    _, _, strict_deleted = process_one_mbox(str(strict_path))
+    _, _, tiered_deleted = process_one_mbox(str(tiered_path), tiered=True)
+
+    assert tiered_deleted == strict_deleted == 2
+    assert tiered_path.read_bytes() == strict_path.read_bytes() == entries[0] + entries[1] + entries[3]
+
+
+def test_process_one_mbox_tiered_hashes_only_colliding_messages(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(
+        b"From a\nSubject: A\n\nBody\n\n"
+        b"From b\nSubject: B\n\nBody\n\n"
+        b"From c\nSubject: B\n\nBody\n\n"
+    )
+
+    with patch("functions.process_1_mbox.get_raw_msg_fingerprint_strict", side_effect=["b", "b"]) as strict:
+        _, _, deleted = process_one_mbox(str(mbox_path), tiered=True)
+
+    assert deleted == 1
+    assert [call.args[1] for call in strict.call_args_list] == [25, 50]
+
+
+def test_process_one_mbox_tiered_measures_only_shared_headers(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(
+        b"From a\nSubject: A\n\nBody\n\n"
+        b"From b\nSubject: B\n\nBody\n\n"
+        b"From c\nSubject: B\n\nBody\n\n"
+    )
+
+    with patch("functions.process_1_mbox.get_raw_msg_normalized_length", return_value=20) as measure:
+        _, _, deleted = process_one_mbox(str(mbox_path), tiered=True)
+
+    assert deleted == 1
+    assert [call.args[1] for call in measure.call_args_list] == [25, 50]
+
+
+def test_process_one_mbox_tiered_needs_a_full_pass(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    write_raw_mbox(mbox_path, 1)
+
+    with pytest.raises(ValueError):
+        process_one_mbox(str(mbox_path), tiered=True, collect_fingerprints=True)
+
+
+def test_process_one_mbox_hashes_only_messages_of_equal_length(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(
+        b"From a\nSubject: A\n\nShort\n\n"
+        b"From b\nSubject: A\n\nLonger body\n\n"
+        b"From c\nSubject: A\r\n\r\nShort\r\n\r\n"
+    )
+
+    with patch("functions.process_1_mbox.get_raw_msg_fingerprint_strict", side_effect=["a", "a"]) as strict:
+        _, _, deleted = process_one_mbox(str(mbox_path))
+
+    # The CRLF copy has the length of the first message once folded
+    assert deleted == 1
+    assert [call.args[1] for call in strict.call_args_list] == [0, 58]
+
+
+def test_process_one_mbox_in_place_compacts_the_mailbox(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    message_a = b"From a\nSubject: A\n\nbody a\n"
+    message_b = b"From b\nSubject: B\n\nbody b\n"
+    mbox_path.write_bytes(message_a + message_a + message_b)
+
+    with patch("functions.process_1_mbox.write_mbox_ranges") as mock_write:
+        _, _, deleted = process_one_mbox(str(mbox_path), in_place=True)
+
+    mock_write.assert_not_called()
+    assert deleted == 1
+    assert mbox_path.read_bytes() == message_a + message_b
+
+
+@pytest.mark.parametrize("collect_fingerprints", [False, True])
+def test_process_one_mbox_ignore_status_merges_flags(tmp_path, collect_fingerprints):
+    mbox_path = tmp_path / "Inbox"
+    unread = b"From a\nX-Mozilla-Status: 0000\nSubject: A\n\nbody a\n"
+    read_starred = b"From a\nX-Mozilla-Status: 0005\nSubject: A\n\nbody a\n"
+    other = b"From b\nX-Mozilla-Status: 0008\nSubject: B\n\nbody b\n"
+    mbox_path.write_bytes(unread + b"\n" + other + b"\n" + read_starred)
+
+    _, _, deleted = process_one_mbox(str(mbox_path), collect_fingerprints=collect_fingerprints)
+    assert deleted == 0
+
+    _, _, deleted = process_one_mbox(
+        str(mbox_path), collect_fingerprints=collect_fingerprints, ignore_status=True
+    )
+
+    assert deleted == 1
+    assert mbox_path.read_bytes() == read_starred + b"\n" + other + b"\n"
+
+
+@pytest.mark.parametrize("in_place", [False, True])
+def test_process_one_mbox_ignore_status_merges_tags(tmp_path, in_place):
+    mbox_path = tmp_path / "Inbox"
+    padding = b" " * 20
+    first = b"From a\nX-Mozilla-Status: 0000\nX-Mozilla-Keys: $label1" + padding + b"\nSubject: A\n\nbody\n"
+    tagged = b"From a\nX-Mozilla-Status: 0000\nX-Mozilla-Keys: $label2 $label1" + padding[8:] + b"\nSubject: A\n\nbody\n"
+    mbox_path.write_bytes(b"From b\nSubject: B\n\nother\n\n" + first + b"\n" + tagged)
+
+    _, _, deleted = process_one_mbox(str(mbox_path), ignore_status=True, in_place=in_place)
+
+    assert deleted == 1
+    assert mbox_path.read_bytes() == (
+        b"From b\nSubject: B\n\nother\n\n"
+        + first.replace(b"$label1" + padding, b"$label1 $label2" + padding[8:]) + b"\n"
+    )
+
+
+def test_process_one_mbox_failed_rewrite_leaves_flags_untouched(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    unread = b"From a\nX-Mozilla-Status: 0000\nSubject: A\n\nbody a\n"
+    read = b"From a\nX-Mozilla-Status: 0001\nSubject: A\n\nbody a\n"
+    original = unread + b"\n" + read
+    mbox_path.write_bytes(original)
+
+    with patch("functions.process_1_mbox.write_mbox_ranges", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            process_one_mbox(str(mbox_path), ignore_status=True)
+
+    assert mbox_path.read_bytes() == original
+
+
+def test_process_one_mbox_canonical_removes_re_encoded_copies(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    qp = b"From a\nSubject: Hi\nContent-Transfer-Encoding: quoted-printable\n\ncaf=C3=A9\n"
+    b64 = b"From a\r\nSubject: Hi\r\nContent-Transfer-Encoding: base64\r\n\r\nY2Fmw6k=\r\n"
+    mbox_path.write_bytes(qp + b"\n" + b64)
+
+    _, _, deleted = process_one_mbox(str(mbox_path))
+    assert deleted == 0
+
+    _, _, deleted = process_one_mbox(str(mbox_path), canonical=True)
+
+    assert deleted == 1
+    assert mbox_path.read_bytes() == qp + b"\n"
+
+    with pytest.raises(ValueError):
+        process_one_mbox(str(mbox_path), tiered=True, canonical=True)
+
+
+def test_process_one_mbox_ignore_status_does_not_return_expunged_fingerprints(tmp_path):
+    mbox_path = tmp_path / "Trash"
+    expunged = b"From a\nX-Mozilla-Status: 0008\nSubject: A\n\nbody a\n"
+    live = b"From b\nX-Mozilla-Status: 0001\nSubject: B\n\nbody b\n"
+    mbox_path.write_bytes(expunged + b"\n" + live)
+
+    seen = set()
+    (fingerprints, _), _, deleted = process_one_mbox(
+        str(mbox_path), seen=seen, collect_fingerprints=True, ignore_status=True
+    )
+
+    assert deleted == 0
+    assert len(fingerprints) == 1
+    assert seen == set(fingerprints)
+
+
+def test_process_one_mbox_canonical_keeps_a_live_copy(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    expunged = b"From a\nX-Mozilla-Status: 0009\nSubject: A\n\nbody a\n"
+    starred = b"From a\nX-Mozilla-Status: 0005\nSubject: A\n\nbody a\n"
+    mbox_path.write_bytes(expunged + b"\n" + starred)
+
+    _, _, deleted = process_one_mbox(str(mbox_path), canonical=True)
+
+    # The first copy is kept, but with the flags of the live one it replaces
+    assert deleted == 1
+    assert mbox_path.read_bytes() == starred + b"\n"
+
+
+def test_process_one_mbox_collects_by_length_without_hashing_unique_messages(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    message_a = b"From a\nSubject: A\n\nbody a\n\n"
+    message_b = b"From b\nSubject: B\n\nlonger body b\n\n"
+    mbox_path.write_bytes(message_a + message_b + message_a)
+
+    with patch("functions.process_1_mbox.get_raw_msg_fingerprint_strict", wraps=get_raw_msg_fingerprint_strict) as spy:
+        (fingerprints, unhashed), _, deleted = process_one_mbox(str(mbox_path), collect_fingerprints=True)
+
+    assert deleted == 1
+    assert spy.call_count == 2
+    assert fingerprints == [get_one_msg_fingerprint_strict(message_a, hex_digest=False)]
+    # Offset in the rewritten mailbox and length without the "From " line and separator
+    assert unhashed == [(len(message_a), len(message_b) - len(b"From b\n") - 1)]
+
+
+def test_process_one_mbox_resume_hashes_old_messages_of_the_same_length(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    old = b"From a\nSubject: A\n\nbody a\n\n"
+    mbox_path.write_bytes(old)
+    (_, unhashed), _, _ = process_one_mbox(str(mbox_path), collect_fingerprints=True)
+    assert unhashed
+
+    with open(mbox_path, "ab") as f:
+        f.write(old)
+
+    lengths = {length: [offset] for offset, length in unhashed}
+    (fingerprints, _), _, deleted = process_one_mbox(
+        str(mbox_path), seen=set(), start_offset=len(old), collect_fingerprints=True, unhashed=lengths
+    )
+
+    assert deleted == 1
+    assert mbox_path.read_bytes() == old
+    assert fingerprints == [get_one_msg_fingerprint_strict(old, hex_digest=False)]
@@ -1,4 +1,12 @@
+import mailbox
+from email.message import EmailMessage
 from unittest.mock import MagicMock, patch
+
+import pytest
+
+from functions.global_index import GlobalFingerprintIndex
+from functions.mbox_state import MboxStateStore
+from functions.process_1_mbox import process_one_mbox
 from functions.process_mboxes import process_mboxes
 
 
@@ -6,7 +14,6 @@ def test_process_mboxes_aggregates_results():
     mboxes = ["mbox1", "mbox2"]
 
     progress = MagicMock()
-    progress.value.return_value = 0
 
     with patch(
         "functions.process_mboxes.process_one_mbox",
@@ -14,13 +21,284 @@ def test_process_mboxes_aggregates_results():
             (None, "msg1\n", 2),
             (None, "msg2\n", 3),
         ]
-    ), patch(
-        "functions.process_mboxes.QApplication.processEvents"
     ):
 
         result_mboxes, msg_out, total_deleted = process_mboxes(mboxes, progress)
 
     assert total_deleted == 5
     assert msg_out == "msg1\nmsg2\n"
-    assert progress.setValue.call_count == 2
+    assert progress.call_count == 2
     assert len(result_mboxes) == 2
+
+
+def create_mbox(path, subjects):
+    mbox = mailbox.mbox(path)
+
+    for subject in subjects:
+        msg = EmailMessage()
+        msg["From"] = "a@test.com"
+        msg["Subject"] = subject
+        msg.set_content(f"Body {subject}")
+        mbox.add(msg)
+
+    mbox.flush()
+    mbox.close()
+
+
+def test_process_mboxes_weights_progress_by_file_size(tmp_path):
+    small = tmp_path / "small"
+    big = tmp_path / "big"
+    small.write_bytes(b"x" * 100)
+    big.write_bytes(b"x" * 300)
+
+    progress = MagicMock()
+
+    with patch(
+        "functions.process_mboxes.process_one_mbox",
+        return_value=(None, "", 0)
+    ):
+
+        process_mboxes([str(small), str(big)], progress)
+
+    assert [call.args for call in progress.call_args_list] == [(100, 400), (400, 400)]
+
+
+def test_process_mboxes_reports_each_result(tmp_path):
+    result = MagicMock()
+
+    with patch(
+        "functions.process_mboxes.process_one_mbox",
+        side_effect=[
+            (None, "msg1\n", 2),
+            (None, "", 0),
+        ]
+    ):
+
+        process_mboxes(["mbox1", "mbox2"], result_callback=result)
+
+    assert [call.args for call in result.call_args_list] == [
+        ("mbox1", "msg1\n", 2),
+        ("mbox2", "", 0),
+    ]
+
+
+def test_process_mboxes_stops_between_mailboxes_when_cancelled():
+    cancelled = [False]
+
+    def process(mbox, **kwargs):
+        cancelled[0] = True
+        return None, "", 1
+
+    with patch("functions.process_mboxes.process_one_mbox", side_effect=process) as mock_process:
+        _, _, total_deleted = process_mboxes(
+            ["mbox1", "mbox2", "mbox3"],
+            is_cancelled=lambda: cancelled[0]
+        )
+
+    assert mock_process.call_count == 1
+    assert total_deleted == 1
+
+
+def test_process_mboxes_with_process_pool(tmp_path):
+    inbox = tmp_path / "Inbox"
+    sent = tmp_path / "Sent"
+    create_mbox(inbox, ["A", "A", "B"])
+    create_mbox(sent, ["C", "C", "C"])
+
+    progress = MagicMock()
+
+    _, msg_out, total_deleted = process_mboxes([str(inbox), str(sent)], progress, workers=2)
+
+    assert total_deleted == 3
+    assert str(inbox) in msg_out
+    assert str(sent) in msg_out
+    assert progress.call_args_list[-1].args[0] == progress.call_args_list[-1].args[1]
+
+
+def test_process_mboxes_pool_reports_finished_mailboxes_before_raising(tmp_path):
+    inbox = tmp_path / "Inbox"
+    broken = tmp_path / "Broken"
+    create_mbox(inbox, ["A", "A"])
+    (tmp_path / "Inbox.msf").write_bytes(b"mork")
+    broken.mkdir()
+
+    results = []
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+
+    with pytest.raises(OSError):
+        process_mboxes([str(inbox), str(broken)], workers=2, state_store=store, invalidate_summaries=True,
+                       result_callback=lambda path, msg, deleted: results.append((path, deleted)))
+
+    assert results == [(str(inbox), 1)]
+    assert not (tmp_path / "Inbox.msf").exists()
+    assert store.is_unchanged(str(inbox))
+    store.close()
+
+
+def test_process_mboxes_skips_unchanged_mailboxes(tmp_path):
+    inbox = tmp_path / "Inbox"
+    sent = tmp_path / "Sent"
+    create_mbox(inbox, ["A", "A"])
+    create_mbox(sent, ["B"])
+
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+    process_mboxes([str(inbox), str(sent)], state_store=store)
+
+    create_mbox(inbox, ["C", "C"])  # Appends to Inbox, Sent is untouched
+
+    with patch(
+        "functions.process_mboxes.process_one_mbox",
+        return_value=([], "", 0)
+    ) as mock_process:
+
+        process_mboxes([str(inbox), str(sent)], state_store=store)
+
+    mock_process.assert_called_once()
+    assert mock_process.call_args.args == (str(inbox),)
+    store.close()
+
+
+def test_process_mboxes_resumes_appended_mailbox(tmp_path):
+    inbox = tmp_path / "Inbox"
+    create_mbox(inbox, ["A", "B", "A"])
+
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+    _, _, total_deleted = process_mboxes([str(inbox)], state_store=store)
+    old_size = inbox.stat().st_size
+    old_content = inbox.read_bytes()
+
+    create_mbox(inbox, ["B", "C", "C"])  # One old duplicate, one new one
+
+    with patch(
+        "functions.process_mboxes.process_one_mbox",
+        wraps=process_one_mbox
+    ) as mock_process:
+
+        _, _, total_deleted = process_mboxes([str(inbox)], state_store=store)
+
+    assert mock_process.call_args.kwargs["start_offset"] == old_size
+    assert total_deleted == 2
+    assert inbox.read_bytes().startswith(old_content)
+
+    mbox = mailbox.mbox(inbox)
+    assert [message["subject"] for message in mbox] == ["A", "B", "C"]
+    mbox.close()
+    store.close()
+
+
+def test_process_mboxes_global_mode_removes_copies_across_mailboxes(tmp_path):
+    inbox = tmp_path / "Inbox"
+    archive = tmp_path / "Archives"
+    create_mbox(inbox, ["A", "B"])
+    archive.write_bytes(inbox.read_bytes())
+    create_mbox(archive, ["C"])
+
+    index = GlobalFingerprintIndex()
+    _, _, total_deleted = process_mboxes(
+        [str(inbox), str(archive)],
+        global_index=index,
+        survivor_policy="priority",
+        folder_priority=["Archives"]
+    )
+    index.close()
+
+    mbox = mailbox.mbox(inbox)
+    assert len(mbox) == 0
+    mbox.close()
+
+    mbox = mailbox.mbox(archive)
+    assert [message["subject"] for message in mbox] == ["A", "B", "C"]
+    mbox.close()
+    assert total_deleted == 2
+
+
+def test_process_mboxes_tiered_skips_fingerprints_and_resume(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    create_mbox(mbox_path, ["A", "A"])
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+
+    try:
+        _, _, deleted = process_mboxes([str(mbox_path)], state_store=store, tiered=True)
+
+        assert deleted == 1
+        assert store.is_unchanged(str(mbox_path))
+        assert store.get_fingerprints(str(mbox_path)) == set()
+
+        with patch("functions.process_mboxes.process_one_mbox", return_value=(None, "", 0)) as mock_process:
+            with open(mbox_path, "ab") as f:
+                f.write(b"From b\nSubject: B\n\n")
+
+            process_mboxes([str(mbox_path)], state_store=store, tiered=True)
+
+        assert mock_process.call_args.kwargs == {"hash_name": "md5", "tiered": True}
+    finally:
+        store.close()
+
+
+def test_process_mboxes_deletes_index_of_rewritten_mailboxes(tmp_path):
+    rewritten = tmp_path / "Inbox"
+    untouched = tmp_path / "Sent"
+    for mbox in (rewritten, untouched):
+        mbox.write_bytes(b"")
+        (tmp_path / (mbox.name + ".msf")).write_bytes(b"mork")
+
+    def fake_process(mbox_path, **kwargs):
+        deleted = 1 if mbox_path == str(rewritten) else 0
+        return None, "", deleted
+
+    with patch("functions.process_mboxes.process_one_mbox", side_effect=fake_process):
+        process_mboxes([str(rewritten), str(untouched)], invalidate_summaries=True)
+
+    assert not (tmp_path / "Inbox.msf").exists()
+    assert (tmp_path / "Sent.msf").exists()
+
+
+def test_process_mboxes_ignore_status_never_keeps_only_an_expunged_copy(tmp_path):
+    expunged = b"From a\nX-Mozilla-Status: 0009\nSubject: A\n\nbody\n"
+    live = b"From a\nX-Mozilla-Status: 0001\nSubject: A\n\nbody\n"
+    trash = tmp_path / "A"
+    inbox = tmp_path / "B"
+    trash.write_bytes(expunged)
+    inbox.write_bytes(live)
+
+    index = GlobalFingerprintIndex()
+    _, _, deleted = process_mboxes([str(trash), str(inbox)], global_index=index, ignore_status=True)
+    index.close()
+
+    assert deleted == 0
+    assert inbox.read_bytes() == live
+
+    # The other way round the expunged copy is the duplicate
+    trash.write_bytes(live)
+    inbox.write_bytes(expunged)
+    index = GlobalFingerprintIndex()
+    _, _, deleted = process_mboxes([str(trash), str(inbox)], global_index=index, ignore_status=True)
+    index.close()
+
+    assert deleted == 1
+    assert inbox.read_bytes() == b""
+
+
+def test_process_mboxes_incremental_run_prunes_and_resumes_by_length(tmp_path):
+    inbox = tmp_path / "Inbox"
+    create_mbox(inbox, ["A", "Unique", "A"])
+    store = MboxStateStore(str(tmp_path / "state.sqlite"))
+
+    try:
+        with patch("functions.process_1_mbox.get_raw_msg_fingerprint_strict", return_value=b"fp") as mock_hash:
+            _, _, total_deleted = process_mboxes([str(inbox)], state_store=store)
+
+        # Only the two messages of the same length were hashed
+        assert total_deleted == 1
+        assert mock_hash.call_count == 2
+        assert len(store.get_unhashed(str(inbox))) == 1
+
+        create_mbox(inbox, ["Unique"])
+        _, _, total_deleted = process_mboxes([str(inbox)], state_store=store)
+
+        assert total_deleted == 1
+        mbox = mailbox.mbox(inbox)
+        assert [message["subject"] for message in mbox] == ["A", "Unique"]
+        mbox.close()
+    finally:
+        store.close()
@@ -1,5 +1,19 @@
+import errno
+import os
 from unittest.mock import MagicMock, patch
-from functions.replace_mbox_file import write_mbox_file
+
+import pytest
+
+from functions import replace_mbox_file
+from functions.replace_mbox_file import (
+    compact_mbox_ranges,
+    get_compaction_journal_paths,
+    map_patches,
+    merge_ranges,
+    resume_compaction,
+    write_mbox_file,
+    write_mbox_ranges,
+)
 
 
 def test_write_mbox_file_writes_messages(tmp_path):
@@ -15,4 +29,239 @@ def test_write_mbox_file_writes_messages(tmp_path):
 
     assert mock_mbox.add.call_count == 2
     mock_mbox.flush.assert_called_once()
-    mock_mbox.close.assert_called_once()
\ No newline at end of file
+    mock_mbox.close.assert_called_once()
+
+
+def test_write_mbox_ranges_copies_ranges_unchanged(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    content = b"From a\nSubject: A\n\nFrom b\nSubject: B\n\nFrom c\nSubject: C\n"
+    mbox_path.write_bytes(content)
+
+    write_mbox_ranges(str(mbox_path), [(0, 19), (38, 18)])
+
+    assert mbox_path.read_bytes() == content[0:19] + content[38:]
+    assert [p.name for p in tmp_path.iterdir()] == ["Inbox"]
+
+
+def test_write_mbox_ranges_copies_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr("functions.replace_mbox_file.COPY_CHUNK_SIZE", 3)
+    mbox_path = tmp_path / "Inbox"
+    content = b"From a\n0123456789\nFrom b\nabcdefghij\n"
+    mbox_path.write_bytes(content)
+
+    write_mbox_ranges(str(mbox_path), [(18, 18)])
+
+    assert mbox_path.read_bytes() == content[18:]
+
+
+@pytest.mark.parametrize("method", ["copy_file_range", "sendfile", "readinto"])
+def test_write_mbox_ranges_with_each_copy_method(tmp_path, monkeypatch, method):
+    if method == "copy_file_range" and not hasattr(os, "copy_file_range"):
+        pytest.skip("os.copy_file_range is not available")
+    if method == "sendfile" and not hasattr(os, "sendfile"):
+        pytest.skip("os.sendfile is not available")
+
+    if method != "copy_file_range":
+        monkeypatch.delattr("os.copy_file_range", raising=False)
+    if method == "readinto":
+        monkeypatch.delattr("os.sendfile", raising=False)
+
+    monkeypatch.setattr("functions.replace_mbox_file.COPY_CHUNK_SIZE", 3)
+    mbox_path = tmp_path / "Inbox"
+    content = bytes(range(256)) * 40
+    mbox_path.write_bytes(content)
+
+    write_mbox_ranges(str(mbox_path), [(0, 100), (100, 50), (500, 4000), (9000, 1240)])
+
+    assert mbox_path.read_bytes() == content[:150] + content[500:4500] + content[9000:]
+
+
+def test_write_mbox_ranges_falls_back_if_kernel_copy_is_rejected(tmp_path, monkeypatch):
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr("os.copy_file_range", unsupported, raising=False)
+    monkeypatch.setattr("os.sendfile", unsupported, raising=False)
+    mbox_path = tmp_path / "Inbox"
+    content = b"From a\nSubject: A\n\nFrom b\nSubject: B\n\n"
+    mbox_path.write_bytes(content)
+
+    write_mbox_ranges(str(mbox_path), [(19, 19)])
+
+    assert mbox_path.read_bytes() == content[19:]
+
+
+def test_write_mbox_ranges_does_not_hide_real_errors(tmp_path, monkeypatch):
+    def disk_full(*args):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr("os.copy_file_range", disk_full, raising=False)
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\n\n")
+
+    with pytest.raises(OSError):
+        write_mbox_ranges(str(mbox_path), [(0, 9)])
+
+    assert mbox_path.read_bytes() == b"From a\n\n"
+    assert [p.name for p in tmp_path.iterdir()] == ["Inbox"]
+
+
+def test_merge_ranges_joins_adjacent_ranges():
+    assert list(merge_ranges([(0, 10), (10, 5), (20, 5), (25, 0), (25, 5), (5, 5)])) == [
+        (0, 15), (20, 10), (5, 5)
+    ]
+    assert list(merge_ranges([])) == []
+
+
+def make_compaction_mbox(path):
+    messages = [f"From {n}\nSubject: {n}\n\n{'x' * (n * 7)}\n".encode() for n in range(1, 9)]
+    path.write_bytes(b"".join(messages))
+
+    ranges = []
+    offset = 0
+    for message in messages:
+        ranges.append((offset, len(message)))
+        offset += len(message)
+
+    # Keep the 1st, 2nd, 5th, 6th and 8th message
+    kept = [ranges[i] for i in (0, 1, 4, 5, 7)]
+    expected = b"".join(messages[i] for i in (0, 1, 4, 5, 7))
+
+    return kept, expected
+
+
+def test_compact_mbox_ranges_moves_ranges_and_truncates(tmp_path, monkeypatch):
+    monkeypatch.setattr(replace_mbox_file, "COPY_CHUNK_SIZE", 16)
+    mbox_path = tmp_path / "Inbox"
+    kept, expected = make_compaction_mbox(mbox_path)
+
+    compact_mbox_ranges(str(mbox_path), kept)
+
+    assert mbox_path.read_bytes() == expected
+    assert sorted(os.listdir(tmp_path)) == ["Inbox"]
+
+
+def test_compact_mbox_ranges_rejects_unordered_ranges(tmp_path):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\n\nFrom b\n\n")
+
+    with pytest.raises(ValueError):
+        compact_mbox_ranges(str(mbox_path), [(8, 8), (0, 8)])
+
+    assert mbox_path.read_bytes() == b"From a\n\nFrom b\n\n"
+
+
+# With 16-byte batches nothing overlaps; bigger batches overlap their source and go through the data file
+@pytest.mark.parametrize("chunk_size", [16, 100, 4096])
+@pytest.mark.parametrize("crash_before_write", [False, True])
+def test_interrupted_compaction_is_finished_by_resume(tmp_path, monkeypatch, chunk_size, crash_before_write):
+    monkeypatch.setattr(replace_mbox_file, "COPY_CHUNK_SIZE", chunk_size)
+    real_write_json = replace_mbox_file.write_json_durably
+    crash_points = 1
+
+    while True:
+        mbox_path = tmp_path / f"Inbox{crash_points}"
+        kept, expected = make_compaction_mbox(mbox_path)
+        original = mbox_path.read_bytes()
+        calls = 0
+
+        def crashing_write_json(path, data):
+            nonlocal calls
+            calls += 1
+            if crash_before_write and calls == crash_points:
+                raise OSError("power failure")
+            real_write_json(path, data)
+            if calls == crash_points:
+                raise OSError("power failure")
+
+        monkeypatch.setattr(replace_mbox_file, "write_json_durably", crashing_write_json)
+
+        try:
+            compact_mbox_ranges(str(mbox_path), kept)
+        except OSError:
+            monkeypatch.setattr(replace_mbox_file, "write_json_durably", real_write_json)
+
+            if os.path.exists(get_compaction_journal_paths(str(mbox_path))[0]):
+                with pytest.raises(RuntimeError):
+                    compact_mbox_ranges(str(mbox_path), kept)
+
+                assert resume_compaction(str(mbox_path)) is True
+            else:
+                # Interrupted before the journal was written: nothing was moved yet
+                assert mbox_path.read_bytes() == original
+                compact_mbox_ranges(str(mbox_path), kept)
+
+            assert mbox_path.read_bytes() == expected
+            crash_points += 1
+            continue
+
+        # No crash: every journal write has been interrupted once
+        assert mbox_path.read_bytes() == expected
+        break
+
+    assert crash_points > 2
+    assert resume_compaction(str(mbox_path)) is False
+    assert not any(name.startswith(".") for name in os.listdir(tmp_path))
+
+
+def test_compaction_batches_small_ranges(tmp_path, monkeypatch):
+    mbox_path = tmp_path / "Inbox"
+    message = b"From x\nSubject: %05d\n\nbody\n\n"
+    mbox_path.write_bytes(b"".join(message % (n // 2) for n in range(10000)))
+    kept = [(n * 29, 29) for n in range(0, 10000, 2)]
+
+    fsyncs = 0
+    real_fsync = os.fsync
+
+    def counting_fsync(fd):
+        nonlocal fsyncs
+        fsyncs += 1
+        real_fsync(fd)
+
+    monkeypatch.setattr(replace_mbox_file.os, "fsync", counting_fsync)
+
+    compact_mbox_ranges(str(mbox_path), kept)
+
+    assert mbox_path.read_bytes() == b"".join(message % n for n in range(5000))
+    # 5,000 moved ranges fit in one batch: a few fsyncs, not some per range
+    assert fsyncs < 10
+
+
+def test_map_patches_follows_the_kept_ranges():
+    ranges = [(0, 10), (20, 10), (40, 5)]
+
+    assert map_patches(ranges, {3: b"a", 25: b"b", 41: b"c", 15: b"dropped"}) == [(3, b"a"), (15, b"b"), (21, b"c")]
+
+
+@pytest.mark.parametrize("rewrite", [write_mbox_ranges, compact_mbox_ranges])
+def test_patches_only_go_into_the_rewritten_mailbox(tmp_path, rewrite):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\n\nFrom b\nX: 0000\n\n")
+
+    rewrite(str(mbox_path), [(8, 17)], {18: b"0005"})
+
+    assert mbox_path.read_bytes() == b"From b\nX: 0005\n\n"
+
+
+def test_resumed_compaction_writes_the_patches(tmp_path, monkeypatch):
+    mbox_path = tmp_path / "Inbox"
+    mbox_path.write_bytes(b"From a\n\nFrom b\nX: 0000\n\n")
+    real_write_json = replace_mbox_file.write_json_durably
+    calls = 0
+
+    def crashing_write_json(path, data):
+        nonlocal calls
+        calls += 1
+        if calls == 3:  # After the state and the journal
+            raise OSError("power failure")
+        real_write_json(path, data)
+
+    monkeypatch.setattr(replace_mbox_file, "write_json_durably", crashing_write_json)
+
+    with pytest.raises(OSError):
+        compact_mbox_ranges(str(mbox_path), [(8, 17)], {18: b"0005"})
+
+    monkeypatch.setattr(replace_mbox_file, "write_json_durably", real_write_json)
+
+    assert resume_compaction(str(mbox_path)) is True
+    assert mbox_path.read_bytes() == b"From b\nX: 0005\n\n"
@@ -1,58 +1,124 @@
 import os
-from unittest.mock import patch, mock_open
+from unittest.mock import patch
 
-from functions.scanner import find_mbox_files
+from functions.scanner import find_mbox_files, is_mbox_file, parse_all_mailboxes
 
 
-def test_find_mbox_files_detects_valid_mbox():
-    fake_walk = [
-        ("root", [], ["Inbox", "notes.txt", "archive.msf"]),
-    ]
-
+def test_find_mbox_files_detects_valid_mbox(tmp_path):
     mbox_content = (
-        "From user@example.com Sat Jan 01 00:00:00 2022\n"
-        "Subject: Test\n"
-        "\n"
-        "Hello\n"
+        b"From user@example.com Sat Jan 01 00:00:00 2022\n"
+        b"Subject: Test\n"
+        b"\n"
+        b"Hello\n"
     )
 
-    with patch("functions.scanner.os.walk", return_value=fake_walk), \
-         patch("builtins.open", mock_open(read_data=mbox_content)):
+    (tmp_path / "Inbox").write_bytes(mbox_content)
+    (tmp_path / "notes.txt").write_bytes(mbox_content)
+    (tmp_path / "archive.msf").write_bytes(mbox_content)
 
-        result = find_mbox_files("root", exclude_trash_files=False)
+    result = find_mbox_files(str(tmp_path), exclude_trash_files=False)
 
-    assert os.path.join("root", "Inbox") in result
-    assert os.path.join("root", "notes.txt") in result
+    assert os.path.join(str(tmp_path), "Inbox") in result
+    assert os.path.join(str(tmp_path), "notes.txt") in result
     assert len(result) == 2
-    
 
 
-def test_find_mbox_files_ignores_files_without_from_line():
-    fake_walk = [
-        ("root", [], ["file1", "file2"]),
-    ]
+def test_find_mbox_files_ignores_files_without_from_line(tmp_path):
+    (tmp_path / "file1").write_bytes(b"Just some text\nAnother line\n")
+    (tmp_path / "file2").write_bytes(b"")
 
-    non_mbox_content = "Just some text\nAnother line\n"
+    result = find_mbox_files(str(tmp_path), exclude_trash_files=False)
 
-    with patch("functions.scanner.os.walk", return_value=fake_walk), \
-         patch("builtins.open", mock_open(read_data=non_mbox_content)):
+    assert result == []
 
-        result = find_mbox_files("root", exclude_trash_files=False)
 
-    assert result == []
+def test_find_mbox_files_excludes_trash_when_enabled(tmp_path):
+    mbox_content = b"From someone@example.com\nBody\n"
+
+    (tmp_path / "Inbox").write_bytes(mbox_content)
+    (tmp_path / "Trash").write_bytes(mbox_content)
+    (tmp_path / "Trash.sbd").mkdir()
+    (tmp_path / "Trash.sbd" / "Old").write_bytes(mbox_content)
+
+    result = find_mbox_files(str(tmp_path), exclude_trash_files=True)
+
+    assert result == [os.path.join(str(tmp_path), "Inbox")]
+
+
+def test_find_mbox_files_recurses_in_parallel(tmp_path):
+    expected = []
+
+    for i in range(5):
+        folder = tmp_path / f"Folder{i}.sbd" / "Sub.sbd"
+        folder.mkdir(parents=True)
+        mbox = folder / "Mail"
+        mbox.write_bytes(b"From a\nBody\n")
+        expected.append(str(mbox))
+
+    sequential = find_mbox_files(str(tmp_path), exclude_trash_files=False)
+    parallel = find_mbox_files(str(tmp_path), exclude_trash_files=False, workers=4)
+
+    assert sorted(sequential) == sorted(expected)
+    assert parallel == sequential
+
+
+def test_is_mbox_file_sniffs_only_the_start(tmp_path):
+    late = tmp_path / "late"
+    late.write_bytes(b"x" * 10000 + b"\nFrom a\n")
+    second_line = tmp_path / "second_line"
+    second_line.write_bytes(b"\nFrom a\nBody\n")
+
+    assert not is_mbox_file(str(late))
+    assert is_mbox_file(str(second_line))
+
+
+def test_is_mbox_file_trusts_msf_companion(tmp_path):
+    mbox = tmp_path / "Inbox"
+    mbox.write_bytes(b"not read at all")
+
+    assert is_mbox_file(str(mbox), size=15, has_msf=True)
+    assert not is_mbox_file(str(mbox), size=0, has_msf=True)
+    assert not is_mbox_file(str(mbox))
+
+
+def test_parse_all_mailboxes_counts_messages(tmp_path):
+    (tmp_path / "Inbox").write_bytes(b"From a\nSubject: A\n\nFrom b\nSubject: B\n\n")
+    (tmp_path / "Sent").write_bytes(b"From c\nSubject: C\n\n")
+
+    assert parse_all_mailboxes(str(tmp_path)) == 3
+
+
+def test_find_mbox_files_cache_skips_unchanged_directories(tmp_path):
+    root = tmp_path / "root"
+    sub = root / "Inbox.sbd"
+    sub.mkdir(parents=True)
+    (root / "Inbox").write_bytes(b"From a\nBody\n")
+    (sub / "Sub").write_bytes(b"From b\nBody\n")
+    (sub / "Empty").write_bytes(b"")
+    cache_path = str(tmp_path / "scan_cache.json")
+
+    first = find_mbox_files(str(root), False, cache_path=cache_path)
+    assert sorted(first) == sorted([str(root / "Inbox"), str(sub / "Sub")])
 
+    # Unchanged directories are not listed and no file is opened
+    with patch("functions.scanner.os.scandir", side_effect=AssertionError("listed")), \
+         patch("functions.scanner.is_mbox_file", side_effect=AssertionError("sniffed")):
+        assert find_mbox_files(str(root), False, cache_path=cache_path) == first
 
-def test_find_mbox_files_excludes_trash_when_enabled():
-    fake_walk = [
-        ("root", [], ["Inbox", "Trash"]),
-    ]
+    # Mail appended in place to an empty mailbox is still found
+    (sub / "Empty").write_bytes(b"From c\nBody\n")
+    os.utime(sub / "Empty", ns=(1, 1))
+    assert str(sub / "Empty") in find_mbox_files(str(root), False, cache_path=cache_path)
 
-    mbox_content = "From someone@example.com\nBody\n"
+    # A new mailbox changes the mtime of its directory
+    (root / "New").write_bytes(b"From d\nBody\n")
+    os.utime(root, ns=(2, 2))
+    assert str(root / "New") in find_mbox_files(str(root), False, cache_path=cache_path)
 
-    with patch("functions.scanner.os.walk", return_value=fake_walk), \
-         patch("builtins.open", mock_open(read_data=mbox_content)):
 
-        result = find_mbox_files("root", exclude_trash_files=True)
+def test_find_mbox_files_ignores_cache_of_other_settings(tmp_path):
+    (tmp_path / "Trash").write_bytes(b"From a\nBody\n")
+    cache_path = str(tmp_path / "cache" / "scan_cache.json")
 
-    assert os.path.join("root", "Inbox") in result
-    assert os.path.join("root", "Trash") not in result
\ No newline at end of file
+    assert find_mbox_files(str(tmp_path), True, cache_path=cache_path) == []
+    assert find_mbox_files(str(tmp_path), False, cache_path=cache_path) == [str(tmp_path / "Trash")]